@@ -0,0 +1,139 @@
+#!/bin/env python3
+
+# SPDX-License-Identifier: CC0-1.0 OR Unlicense
+
+import argparse
+from pathlib import Path
+import tempfile
+import time
+
+from typing import Dict, Tuple
+
+import decomp_getter
+import gen_changelog
+import gen_fixtures
+import profiling
+
+# stage name: (counter of the items the stage processes, unit name)
+STAGES_THROUGHPUT_COUNTERS: Dict[str, Tuple[str, str]] = {
+    "read_map": ("map_lines", "lines"),
+    "parse_map": ("map_lines", "lines"),
+    "organize_symbols": ("map_symbols", "symbols"),
+    "format_syms": ("map_symbols", "symbols"),
+    "copy_headers": ("headers_copied", "headers"),
+    "fingerprint_headers": ("headers_copied", "headers"),
+    "compare_syms": ("old_symbols", "symbols"),
+    "compare_objfiles": ("old_symbols", "symbols"),
+}
+
+
+def print_report(report: dict):
+    counters = report["counters"]
+
+    def print_stages(stages, depth):
+        for stage in stages:
+            throughput = ""
+            counter_and_unit = STAGES_THROUGHPUT_COUNTERS.get(stage["name"])
+            if counter_and_unit is not None and stage["time"] > 0:
+                counter, unit = counter_and_unit
+                throughput = (
+                    f"{counters.get(counter, 0) / stage['time'] / 1000:10.1f}"
+                    f" k{unit}/s"
+                )
+            print(
+                f"{'  ' * depth + stage['name']:<32}"
+                f" {stage['time']:8.3f} s"
+                f" {stage['peak_memory'] / 1024 / 1024:8.1f} MiB"
+                f" {throughput}"
+            )
+            print_stages(stage.get("stages", ()), depth + 1)
+
+    print(f"{'stage':<32} {'time':>10} {'peak mem':>12} throughput")
+    print_stages(report["stages"], 0)
+    print()
+    for counter, value in counters.items():
+        print(f"{counter:<32} {value:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Benchmark decomp_getter.py and gen_changelog.py on synthetic data"
+            " (see gen_fixtures.py), reporting time, memory and throughput per stage"
+        )
+    )
+    parser.add_argument("--objfiles", type=int, default=3000)
+    parser.add_argument("--headers", type=int, default=2000)
+    parser.add_argument(
+        "--symbols",
+        type=int,
+        default=1000,
+        help="Symbols per section of each .o file for the changelog",
+    )
+    parser.add_argument(
+        "--changelog-objfiles",
+        type=int,
+        default=100,
+        help=".o files for the changelog",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "-j",
+        "--processes",
+        type=int,
+        help="Amount of processes to compare .o files with (default: amount of CPUs)",
+    )
+    parser.add_argument(
+        "--report",
+        type=Path,
+        metavar="REPORT_PATH",
+        help="Also write the report as json (see profiling.py)",
+    )
+    parser.add_argument(
+        "--work-dir",
+        type=Path,
+        help="Where to generate the data and outputs (default: a temporary folder)",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir if args.work_dir is not None else Path(temp_dir)
+
+        start = time.perf_counter()
+        decomp_path = work_dir / "decomp"
+        gen_fixtures.write_decomp_tree(
+            decomp_path, args.objfiles, args.headers, args.seed
+        )
+        old_syms_path, new_syms_path = gen_fixtures.write_syms_pair(
+            work_dir / "syms_pair",
+            args.symbols,
+            args.changelog_objfiles,
+            seed=args.seed,
+        )
+        print(f"Generated data in {time.perf_counter() - start:.3f} s")
+        print()
+
+        report_path = (
+            args.report if args.report is not None else work_dir / "report.json"
+        )
+        with profiling.profile("bench", report_path) as profiler:
+            with profiling.stage("decomp_getter"):
+                decomp_getter.update_z64hdr(
+                    decomp_path,
+                    work_dir / "out" / "syms",
+                    work_dir / "out" / "include",
+                    ask_before_delete=False,
+                )
+            with profiling.stage("gen_changelog"):
+                gen_changelog.gen_changelog(
+                    old_syms_path,
+                    new_syms_path,
+                    work_dir / "out" / "changelog",
+                    processes=args.processes,
+                )
+        print()
+        print_report(profiler.get_report())
+
+
+if __name__ == "__main__":
+    main()
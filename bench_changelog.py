@@ -0,0 +1,49 @@
+#!/bin/env python3
+
+# SPDX-License-Identifier: CC0-1.0 OR Unlicense
+
+import argparse
+import time
+
+import gen_changelog
+import gen_fixtures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark gen_changelog.py on synthetic syms.json files"
+    )
+    parser.add_argument("--symbols", type=int, default=50_000)
+    parser.add_argument("--objfiles", type=int, default=1)
+    parser.add_argument(
+        "-j",
+        "--processes",
+        type=int,
+        help="Amount of processes to compare .o files with (default: amount of CPUs)",
+    )
+    args = parser.parse_args()
+
+    old_syms, new_syms, n_renamed = gen_fixtures.make_syms_pair(
+        args.symbols, args.objfiles
+    )
+
+    start = time.perf_counter()
+    changes = gen_changelog.compare_syms(old_syms, new_syms, processes=args.processes)
+    duration = time.perf_counter() - start
+
+    found_renamed = sum(
+        len(changes_in_section.get("renamed", ()))
+        for changes_by_section in changes["symbols"].values()
+        for changes_in_section in changes_by_section.values()
+    )
+    print(
+        f"{args.objfiles} .o file(s) x 3 sections x {args.symbols} symbols:"
+        f" {duration:.3f} s"
+        f" ({found_renamed} renamed symbols found, {n_renamed} expected)"
+    )
+    if found_renamed != n_renamed:
+        raise Exception("Unexpected amount of renamed symbols")
+
+
+if __name__ == "__main__":
+    main()
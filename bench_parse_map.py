@@ -0,0 +1,58 @@
+#!/bin/env python3
+
+# SPDX-License-Identifier: CC0-1.0 OR Unlicense
+
+import argparse
+import time
+
+from typing import List
+
+import decomp_getter
+import gen_fixtures
+
+
+def time_parse(mapfile_lines: List[str], use_fast_path: bool):
+    start = time.perf_counter()
+    parsed = list(decomp_getter.parse_map_file(mapfile_lines, use_fast_path))
+    return time.perf_counter() - start, parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark parse_map_file on a synthetic map"
+    )
+    parser.add_argument(
+        "--objfiles",
+        type=int,
+        default=7_500,
+        help="Amount of .o files in the map (the default makes a ~500k-line map)",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    mapfile_lines = gen_fixtures.make_map_lines(
+        args.objfiles, n_debug_lines=args.objfiles * 20
+    )
+    print(f"Synthetic map: {len(mapfile_lines)} lines")
+
+    results = dict()
+    for use_fast_path in (False, True):
+        best = None
+        for _ in range(args.repeat):
+            duration, parsed = time_parse(mapfile_lines, use_fast_path)
+            if best is None or duration < best:
+                best = duration
+        results[use_fast_path] = parsed
+        print(
+            f"{'fast path' if use_fast_path else 'tokenizing only':<16}"
+            f" {best:7.3f} s"
+            f" {len(mapfile_lines) / best / 1000:8.1f} klines/s"
+            f" ({len(parsed)} symbols)"
+        )
+
+    if results[False] != results[True]:
+        raise Exception("The fast path and tokenizing path results differ")
+
+
+if __name__ == "__main__":
+    main()
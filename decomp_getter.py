@@ -7,31 +7,115 @@
 # asm-differ is also in the public domain (unlicense)
 
 import argparse
+import array
+import collections.abc
+import io
+import itertools
+import mmap
+import multiprocessing.context
 from pathlib import Path
 import shutil
+import sys
 import os
+import concurrent.futures
 import re
 import json
+import hashlib
+import time
+import traceback
+
+try:
+    import fcntl
+except ImportError:  # windows
+    pass
 
 from typing import (
     Tuple,
     Dict,
+    List,
+    Optional,
     Iterable,
+    Iterator,
     Generator,
 )
 
+import headerbundle
+import headerdeps
+import profiling
+import symhistory
+import symsdb
+
+
+# top-level output sections starting with this come after all the loadable segments,
+# and only hold debugging information (which can be most of the map file)
+MAP_DEBUG_SECTIONS_PREFIX = ".debug_"
+
+MAP_READ_BUFFER_SIZE = 1024 * 1024
+
+
+def iter_map_file_lines(map_path: Path) -> Generator[str, None, None]:
+    """
+    Reads the map file at `map_path` line by line, without holding it all in memory.
+
+    Stops at the first debug section, as nothing after it is of interest.
+    """
+    with map_path.open(buffering=MAP_READ_BUFFER_SIZE) as f:
+        for line in f:
+            if line.startswith(MAP_DEBUG_SECTIONS_PREFIX):
+                break
+            yield line
+
+
+# matches the most common lines in the map, which can be handled without tokenizing:
+# symbol lines, .text/.data/.rodata/.bss input section lines, and fill lines.
+# Anything else (or anything slightly different) goes through the tokenizing path.
+# The groups are (address, symbol, section, objfile), see parse_map_file
+MAP_FAST_LINE_PATTERN = re.compile(
+    r"[ \t]+(?:"
+    r"0x([0-9A-Fa-f]+)[ \t]+([A-Za-z_][0-9A-Za-z_]*)"
+    r"|(\.text|\.data|\.rodata|\.bss)"
+    r"[ \t]+0x[0-9A-Fa-f]+[ \t]+0x[0-9A-Fa-f]+[ \t]+([!-~]+)"
+    r"|\*fill\*[ \t]+0x[0-9A-Fa-f]+[ \t]+0x[0-9A-Fa-f]+(?:[ \t]+[0-9A-Fa-f]+)?"
+    r")\s*\Z",
+    re.ASCII,
+)
+
 
 def parse_map_file(
     mapfile_lines: Iterable[str],
+    use_fast_path: bool = True,
 ) -> Generator[Tuple[str, str, int, int, str], None, None]:
 
     symbol_pattern = re.compile(r"[a-zA-Z_][0-9a-zA-Z_]*")
+    fast_line_match = MAP_FAST_LINE_PATTERN.match
 
     cur_section = None
     cur_objfile = None
     ram_to_rom = None
 
     for line in mapfile_lines:
+        if use_fast_path:
+            fast_line_m = fast_line_match(line)
+            if fast_line_m is not None:
+                address_str, symbol_name, section, objfile = fast_line_m.groups()
+                if symbol_name is not None:
+                    offset = int(address_str, 16)
+                    if ram_to_rom is None:
+                        yield (cur_objfile, cur_section, None, offset, symbol_name)
+                    else:
+                        yield (
+                            cur_objfile,
+                            cur_section,
+                            offset,
+                            offset + ram_to_rom,
+                            symbol_name,
+                        )
+                elif objfile is not None:
+                    cur_objfile = objfile
+                    cur_section = section
+                # else, fill line: nothing to do
+                continue
+
         tokens = line.split()
 
         if not tokens:
@@ -42,7 +126,8 @@ def parse_map_file(
         if (
             tokens == ["Memory", "Configuration"]
             or tokens[0] == "LOAD"
-            or tokens == ["OUTPUT(zelda_ocarina_mq_dbg.elf", "elf32-tradbigmips)"]
+            # for example OUTPUT(zelda_ocarina_mq_dbg.elf elf32-tradbigmips)
+            or (len(tokens) == 2 and tokens[0].startswith("OUTPUT("))
             or tokens == ["*(.debug_info", ".gnu.linkonce.wi.*)"]
         ):
             continue
@@ -98,17 +183,122 @@ def parse_map_file(
                     raise Exception(f"Could not parse {tokens}")
 
 
-def read_and_organize_symbols(mapfile_lines):
-    symbols: Dict[str, Dict[str, Dict[str, Tuple[int, int]]]] = dict()
-
-    for objfile, section, ram, rom, symbol in parse_map_file(mapfile_lines):
-        if objfile not in symbols:
-            symbols[objfile] = dict()
-        if section not in symbols[objfile]:
-            symbols[objfile][section] = dict()
-        if symbol in symbols[objfile][section]:
-            raise Exception("Duplicate symbol", symbol)
-        symbols[objfile][section][symbol] = (ram, rom)
+# stands for a None address in SectionSymbols
+NO_ADDRESS = 0xFFFFFFFF
+
+
+class SectionSymbols(collections.abc.Mapping):
+    """
+    The symbols of a section of a .o file, stored as columns: the names,
+    and arrays of the ram and rom addresses (NO_ADDRESS standing for None)
+
+    Reads like a {symbol: (ram, rom)} dict, in the order the symbols were added
+    """
+
+    __slots__ = ("names", "rams", "roms", "_names_index")
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.rams = array.array("I")
+        self.roms = array.array("I")
+        # {symbol: index in the columns}, built on the first lookup by name
+        self._names_index: Optional[Dict[str, int]] = None
+
+    def __reduce__(self):
+        # pickle the columns as a string of the names (which can't hold newlines)
+        # and the arrays as bytes, which is much faster (for process pools)
+        return (
+            _unpickle_section_symbols,
+            ("\n".join(self.names), self.rams.tobytes(), self.roms.tobytes()),
+        )
+
+    def append(self, name: str, ram: Optional[int], rom: Optional[int]):
+        self.names.append(name)
+        self.rams.append(ram if ram is not None else NO_ADDRESS)
+        self.roms.append(rom if rom is not None else NO_ADDRESS)
+        self._names_index = None
+
+    def extend(self, other: "SectionSymbols"):
+        self.names.extend(other.names)
+        self.rams.extend(other.rams)
+        self.roms.extend(other.roms)
+        self._names_index = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __getitem__(self, name: str) -> Tuple[Optional[int], Optional[int]]:
+        if self._names_index is None:
+            self._names_index = {name: i for i, name in enumerate(self.names)}
+        i = self._names_index[name]
+        ram = self.rams[i]
+        rom = self.roms[i]
+        return (
+            ram if ram != NO_ADDRESS else None,
+            rom if rom != NO_ADDRESS else None,
+        )
+
+    def items(self) -> Iterator[Tuple[str, Tuple[Optional[int], Optional[int]]]]:
+        for name, ram, rom in zip(self.names, self.rams, self.roms):
+            yield name, (
+                ram if ram != NO_ADDRESS else None,
+                rom if rom != NO_ADDRESS else None,
+            )
+
+
+def _unpickle_section_symbols(
+    names_str: str, rams_bytes: bytes, roms_bytes: bytes
+) -> SectionSymbols:
+    section_symbols = SectionSymbols()
+    section_symbols.names = names_str.split("\n") if names_str else []
+    section_symbols.rams.frombytes(rams_bytes)
+    section_symbols.roms.frombytes(roms_bytes)
+    return section_symbols
+
+
+Symbols = Dict[str, Dict[str, SectionSymbols]]
+
+# not an objfile or section, which can be None
+_UNSET = object()
+
+
+def organize_symbols(parsed_symbols, check_duplicates: bool = True) -> Symbols:
+    """
+    Organizes the (objfile, section, ram, rom, symbol) tuples from `parse_map_file`
+    into {objfile: {section: SectionSymbols}}, with interned .o file
+    and section names
+
+    Raises if a section has duplicate symbols, unless `check_duplicates` is False
+    (see `check_duplicate_symbols`)
+    """
+    symbols: Symbols = dict()
+
+    # the columns of the previous symbol's section, which usually is the same
+    prev_objfile = prev_section = _UNSET
+    names_append = rams_append = roms_append = None
+
+    for objfile, section, ram, rom, symbol in parsed_symbols:
+        if objfile is not prev_objfile or section is not prev_section:
+            objfile_symbols = symbols.get(objfile)
+            if objfile_symbols is None:
+                objfile_symbols = symbols[
+                    sys.intern(objfile) if objfile is not None else None
+                ] = dict()
+            section_symbols = objfile_symbols.get(section)
+            if section_symbols is None:
+                section_symbols = SectionSymbols()
+                objfile_symbols[
+                    sys.intern(section) if section is not None else None
+                ] = section_symbols
+            prev_objfile = objfile
+            prev_section = section
+            names_append = section_symbols.names.append
+            rams_append = section_symbols.rams.append
+            roms_append = section_symbols.roms.append
+        names_append(symbol)
         # print(objfile, section, ram, rom, symbol)
         if ram is None:
             if symbol not in {"entrypoint"}:
@@ -116,147 +306,788 @@ def read_and_organize_symbols(mapfile_lines):
                     "the only expected symbol without a load address is entrypoint, encountered another one",
                     symbol,
                 )
+            rams_append(NO_ADDRESS)
         else:
-            pass
+            rams_append(ram)
+        roms_append(rom if rom is not None else NO_ADDRESS)
+
+    if check_duplicates:
+        check_duplicate_symbols(symbols)
 
     return symbols
 
 
-def update_z64hdr(
+def check_duplicate_symbols(symbols: Symbols):
+    """
+    Raises on the first symbol found twice in a section of a .o file
+    """
+    for objfile_symbols in symbols.values():
+        for section_symbols in objfile_symbols.values():
+            if len(set(section_symbols.names)) != len(section_symbols):
+                seen_names = set()
+                for symbol in section_symbols.names:
+                    if symbol in seen_names:
+                        raise Exception("Duplicate symbol", symbol)
+                    seen_names.add(symbol)
+
+
+def merge_symbols(symbols: Symbols, more_symbols: Symbols):
+    """
+    Adds `more_symbols` into `symbols`, after the symbols already there
+    (like if `organize_symbols` had been given the symbols of both at once,
+    without checking for duplicates)
+    """
+    for objfile, more_objfile_symbols in more_symbols.items():
+        objfile_symbols = symbols.get(objfile)
+        if objfile_symbols is None:
+            objfile_symbols = symbols[
+                sys.intern(objfile) if objfile is not None else None
+            ] = dict()
+        for section, more_section_symbols in more_objfile_symbols.items():
+            section_symbols = objfile_symbols.get(section)
+            if section_symbols is None:
+                objfile_symbols[
+                    sys.intern(section) if section is not None else None
+                ] = more_section_symbols
+            else:
+                section_symbols.extend(more_section_symbols)
+
+
+def read_and_organize_symbols(mapfile_lines):
+    return organize_symbols(parse_map_file(mapfile_lines))
+
+
+# maps smaller than this are parsed in a single process
+MAP_SHARDED_MIN_SIZE = 4 * 1024 * 1024
+
+# the map is split in this many shards per process, to even out
+# the segments' sizes (the code segment is much bigger than most overlays)
+MAP_SHARDS_PER_PROCESS = 4
+
+MAP_LOAD_ADDRESS = b"load address"
+
+
+def find_map_segments(map_path: Path) -> Tuple[List[int], int]:
+    """
+    Finds where each segment starts in the map file at `map_path`,
+    without parsing it
+
+    Returns the byte offsets of the segments' first line (the "load address" line,
+    or the line before it holding the segment name if it was too long),
+    and the byte offset of the first debug section (or the size of the file)
+
+    `parse_map_file` resets its state on "load address" lines, so each segment
+    can be parsed on its own
+    """
+    with map_path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return [], 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            debug_prefix = MAP_DEBUG_SECTIONS_PREFIX.encode()
+            if m[: len(debug_prefix)] == debug_prefix:
+                return [], 0
+            end = m.find(b"\n" + debug_prefix)
+            end = len(m) if end < 0 else end + 1
+
+            segments_starts = []
+            pos = m.find(MAP_LOAD_ADDRESS, 0, end)
+            while pos >= 0:
+                line_start = m.rfind(b"\n", 0, pos) + 1
+                line_end = m.find(b"\n", pos, end)
+                if line_end < 0:
+                    line_end = end
+                if line_start > 0 and len(m[line_start:line_end].split()) == 5:
+                    # long segment names are put in the previous line
+                    name_line_start = m.rfind(b"\n", 0, line_start - 1) + 1
+                    if not segments_starts or name_line_start > segments_starts[-1]:
+                        line_start = name_line_start
+                segments_starts.append(line_start)
+                pos = m.find(MAP_LOAD_ADDRESS, line_end, end)
+
+    return segments_starts, end
+
+
+def get_map_shards(
+    segments_starts: List[int], end: int, n_shards: int
+) -> List[Tuple[int, int]]:
+    """
+    Groups consecutive segments (see `find_map_segments`) into about `n_shards`
+    shards of similar sizes
+
+    Returns the (start, end) byte offsets of the shards, which cover the map
+    from its start to `end`
+    """
+    shard_size = end / n_shards
+    shards = []
+    shard_start = 0
+    for segment_start in segments_starts:
+        if segment_start - shard_start >= shard_size:
+            shards.append((shard_start, segment_start))
+            shard_start = segment_start
+    shards.append((shard_start, end))
+    return shards
+
+
+def _parse_map_shard(map_path: Path, start: int, end: int) -> Tuple[Symbols, int]:
+    with map_path.open("rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # decoded like by iter_map_file_lines
+    mapfile_lines = list(io.TextIOWrapper(io.BytesIO(data)))
+    symbols = organize_symbols(parse_map_file(mapfile_lines), check_duplicates=False)
+    return symbols, len(mapfile_lines)
+
+
+def read_symbols_sharded(
+    map_path: Path,
+    processes: int,
+    mp_context: Optional[multiprocessing.context.BaseContext] = None,
+) -> Symbols:
+    """
+    Like `read_symbols`, but parses the map by groups of segments
+    (see `find_map_segments`) in a pool of `processes` processes
+    (started with `mp_context`, see `concurrent.futures.ProcessPoolExecutor`),
+    then merges the symbols in the order of the map
+    """
+    with profiling.stage("find_map_segments"):
+        segments_starts, end = find_map_segments(map_path)
+        shards = get_map_shards(
+            segments_starts, end, processes * MAP_SHARDS_PER_PROCESS
+        )
+    profiling.count("map_segments", len(segments_starts))
+    profiling.count("map_bytes", end)
+
+    symbols: Symbols = dict()
+    with profiling.stage("parse_map"):
+        with concurrent.futures.ProcessPoolExecutor(
+            min(processes, len(shards)), mp_context=mp_context
+        ) as executor:
+            for shard_symbols, n_lines in executor.map(
+                _parse_map_shard,
+                itertools.repeat(map_path),
+                *zip(*shards),
+            ):
+                profiling.count("map_lines", n_lines)
+                merge_symbols(symbols, shard_symbols)
+    with profiling.stage("check_duplicate_symbols"):
+        check_duplicate_symbols(symbols)
+    if profiling.is_profiling():
+        profiling.count(
+            "map_symbols",
+            sum(
+                len(section_symbols)
+                for objfile_symbols in symbols.values()
+                for section_symbols in objfile_symbols.values()
+            ),
+        )
+        profiling.count("objfiles", len(symbols))
+    return symbols
+
+
+def read_symbols(
+    map_path: Path,
+    processes: Optional[int] = 1,
+    mp_context: Optional[multiprocessing.context.BaseContext] = None,
+):
+    """
+    Reads, parses and organizes the symbols of the map file at `map_path`
+
+    If `processes` isn't 1, maps big enough are parsed in a pool of `processes`
+    processes (defaults to the amount of CPUs), started with `mp_context`,
+    see `read_symbols_sharded`
+
+    When profiling, the stages are run one after the other instead of
+    streaming lines through them, so that they can be measured separately
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes > 1 and map_path.stat().st_size >= MAP_SHARDED_MIN_SIZE:
+        return read_symbols_sharded(map_path, processes, mp_context)
+
+    if not profiling.is_profiling():
+        return read_and_organize_symbols(iter_map_file_lines(map_path))
+
+    with profiling.stage("read_map"):
+        mapfile_lines = list(iter_map_file_lines(map_path))
+    profiling.count("map_lines", len(mapfile_lines))
+    profiling.count("map_bytes", sum(map(len, mapfile_lines)))
+    with profiling.stage("parse_map"):
+        parsed_symbols = list(parse_map_file(mapfile_lines))
+    profiling.count("map_symbols", len(parsed_symbols))
+    with profiling.stage("organize_symbols"):
+        symbols = organize_symbols(parsed_symbols)
+    profiling.count("objfiles", len(symbols))
+    return symbols
+
+
+LD_FILE_NAMES = (
+    "src",
+    "assets_scenes",
+    "assets_objects",
+    "assets_others",
+    "others",
+)
+
+HEADERS_FOLDERS = ("assets", "include", "src")
+
+SYMS_MANIFEST_FILE_NAME = "syms_manifest.json"
+SYMS_MANIFEST_VERSION = 1
+
+
+# which syms_*.ld file the symbols of .o files go to, by path prefix
+# (None if the symbols are not used), the longest matching prefix is used
+# prefixes not ending with "/" must match the whole .o file path
+OBJFILE_LD_FILE_NAMES = (
+    # we don't need the symbols from overlays
+    # and because they get relocated using them usually makes little sense
+    ("build/src/overlays/", None),
+    # this is data which symbols aren't used directly
+    ("build/src/elf_message/", None),
+    # skip `entrypoint` symbol
+    ("build/asm/entry.o", None),
+    # decomp 4775fd4a7ea8077f603900def093124f8aa7cec6 :
+    # asm/entry.s -> src/makerom/entry.s
+    ("build/src/makerom/entry.o", None),
+    ("build/src/", "src"),
+    ("build/assets/scenes/", "assets_scenes"),
+    ("build/assets/objects/", "assets_objects"),
+    ("build/assets/", "assets_others"),
+)
+OBJFILE_LD_FILE_NAME_DEFAULT = "others"
+
+
+def build_path_prefix_trie(prefixes: Iterable[Tuple[str, Optional[str]]]) -> dict:
+    """
+    Builds a trie of path components from (prefix, value) pairs,
+    for use with `lookup_path_prefix_trie`
+    """
+    trie = dict()
+    for prefix, value in prefixes:
+        node = trie
+        components = prefix.split("/")
+        is_dir_prefix = components[-1] == ""
+        if is_dir_prefix:
+            components.pop()
+        for component in components:
+            node = node.setdefault(component, dict())
+        # use tuples as keys, they can't collide with path components
+        node[(is_dir_prefix,)] = value
+    return trie
+
+
+def lookup_path_prefix_trie(trie: dict, path: str, default):
+    """
+    Returns the value of the longest prefix of `path` in `trie`, or `default`
+    """
+    value = default
+    node = trie
+    components = path.split("/")
+    for i_component, component in enumerate(components, 1):
+        node = node.get(component)
+        if node is None:
+            break
+        if i_component < len(components):
+            # a directory
+            value = node.get((True,), value)
+        else:
+            # the whole path
+            value = node.get((False,), value)
+    return value
+
+
+OBJFILE_LD_FILE_NAMES_TRIE = build_path_prefix_trie(OBJFILE_LD_FILE_NAMES)
+
+
+def get_objfile_ld_file_name(objfile: Optional[str]) -> Optional[str]:
+    """
+    Returns to which syms_*.ld file this .o file's symbols go,
+    or None if its symbols are not used (like symbols outside of any .o file)
+    """
+    if objfile is None:
+        return None
+    return lookup_path_prefix_trie(
+        OBJFILE_LD_FILE_NAMES_TRIE, objfile, OBJFILE_LD_FILE_NAME_DEFAULT
+    )
+
+
+def hash_file(path: Path) -> str:
+    h = hashlib.sha1()
+    with path.open("rb") as f:
+        while True:
+            chunk = f.read(MAP_READ_BUFFER_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_file_fingerprint(path: Path, previous_fingerprint: Optional[dict]) -> dict:
+    """
+    Returns the size, mtime and sha1 of the file at `path`
+
+    The file is only read and hashed again if its size or mtime differ
+    from `previous_fingerprint`
+    """
+    stat = path.stat()
+    if (
+        previous_fingerprint is not None
+        and previous_fingerprint["size"] == stat.st_size
+        and previous_fingerprint["mtime_ns"] == stat.st_mtime_ns
+    ):
+        return previous_fingerprint
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha1": hash_file(path),
+    }
+
+
+def read_syms_manifest(output_path_syms: Path) -> Optional[dict]:
+    manifest_path = output_path_syms / SYMS_MANIFEST_FILE_NAME
+    if not manifest_path.exists():
+        return None
+    with manifest_path.open() as f:
+        manifest = json.load(f)
+    if manifest.get("version") != SYMS_MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def iter_headers_entries(
+    oot_decomp_repo_path: Path,
+) -> Iterator[Tuple[str, os.DirEntry]]:
+    """
+    Yields the paths, relative to `oot_decomp_repo_path`, and directory entries
+    of the .h files in decomp's assets, include and src
+    """
+    for folder in HEADERS_FOLDERS:
+        dirs_to_scan = [folder]
+        while dirs_to_scan:
+            dir_relpath = dirs_to_scan.pop()
+            with os.scandir(oot_decomp_repo_path / dir_relpath) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        dirs_to_scan.append(f"{dir_relpath}/{entry.name}")
+                    elif entry.name.endswith(".h"):
+                        yield f"{dir_relpath}/{entry.name}", entry
+
+
+def find_headers(oot_decomp_repo_path: Path) -> List[str]:
+    """
+    Returns the paths, relative to `oot_decomp_repo_path`, of the .h files
+    in decomp's assets, include and src
+    """
+    headers = [header for header, _ in iter_headers_entries(oot_decomp_repo_path)]
+    headers.sort()
+    return headers
+
+
+HEADERS_LINK_MODES = ("copy", "hardlink", "reflink")
+
+# ioctl request to clone a file's contents (linux, only works on some filesystems)
+FICLONE = 0x40049409
+
+
+def copy_header_file(src: Path, dst: Path, link_mode: str):
+    """
+    Puts a copy of `src` at `dst`, replacing `dst` if it exists
+
+    `link_mode` is one of HEADERS_LINK_MODES:
+    "copy" copies the file,
+    "hardlink" hardlinks it,
+    "reflink" makes a copy-on-write clone of it.
+    If linking isn't possible (for example across filesystems) it is copied instead.
+    """
+    if dst.exists() or dst.is_symlink():
+        # don't write through an existing hardlink
+        dst.unlink()
+
+    if link_mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    elif link_mode == "reflink":
+        try:
+            with src.open("rb") as f_src, dst.open("wb") as f_dst:
+                fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+            shutil.copystat(src, dst)
+            return
+        except (OSError, NameError):  # NameError: no fcntl (windows)
+            pass
+
+    shutil.copy2(src, dst)
+
+
+def copy_header_files(
     oot_decomp_repo_path: Path,
-    output_path_syms: Path,
     output_path_includes: Path,
+    headers: Iterable[str],
+    link_mode: str = "copy",
 ):
     """
-    `oot_decomp_repo_path` should be a `Path` to the oot decomp repo
-        for example `Path("/home/dragorn421/Documents/oot/")`
+    Copies the `headers` (paths relative to `oot_decomp_repo_path`)
+    to the same paths relative to `output_path_includes`, using a thread pool.
 
-    Writes syms_*.ld files under `output_path_syms`,
-        and copies undefined_syms.txt there,
-        and dumps the parsed symbols from the map to syms.json
+    Only the directories containing headers are created.
+    """
+    headers = list(headers)
+    profiling.count("headers_copied", len(headers))
+    if profiling.is_profiling():
+        profiling.count(
+            "headers_bytes_copied",
+            sum((oot_decomp_repo_path / header).stat().st_size for header in headers),
+        )
+    for dir_relpath in {os.path.dirname(header) for header in headers}:
+        (output_path_includes / dir_relpath).mkdir(parents=True, exist_ok=True)
 
-    Copies .h files from decomp's assets, include and src into `output_path_includes`
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        for future in [
+            executor.submit(
+                copy_header_file,
+                oot_decomp_repo_path / header,
+                output_path_includes / header,
+                link_mode,
+            )
+            for header in headers
+        ]:
+            # raise exceptions if any
+            future.result()
+
+
+def update_headers_incremental(
+    oot_decomp_repo_path: Path,
+    output_path_includes: Path,
+    found_headers: List[str],
+    previous_headers: Dict[str, dict],
+    link_mode: str = "copy",
+) -> Dict[str, dict]:
     """
+    Only copies the `found_headers` which changed since `previous_headers`,
+    and removes the ones which aren't in `found_headers` anymore.
 
-    for empty_dir_path in (output_path_syms, output_path_includes):
-        if empty_dir_path.exists():
-            while (
-                input(
-                    f"Delete directory {empty_dir_path.absolute()} ? 'yes' to confirm: "
-                )
-                != "yes"
+    Returns the new headers fingerprints
+    """
+    headers = dict()
+    headers_to_copy = []
+    with profiling.stage("fingerprint_headers"):
+        for header in found_headers:
+            previous_fingerprint = previous_headers.get(header)
+            fingerprint = get_file_fingerprint(
+                oot_decomp_repo_path / header, previous_fingerprint
+            )
+            headers[header] = fingerprint
+            if (
+                previous_fingerprint is None
+                or previous_fingerprint["sha1"] != fingerprint["sha1"]
+                or not (output_path_includes / header).exists()
             ):
-                pass
-            shutil.rmtree(empty_dir_path)
-
-        empty_dir_path.mkdir(parents=True, exist_ok=True)
-
-    # read map
-    with (oot_decomp_repo_path / "build" / "z64.map").open() as f:
-        mapfile_lines = f.readlines()
-    new_symbols = read_and_organize_symbols(mapfile_lines)
-
-    syms_dump = dict()
-
-    # write new linker script
-
-    # one out_lines_* per syms_*.ld file
-    out_lines_src = []
-    out_lines_assets_scenes = []
-    out_lines_assets_objects = []
-    out_lines_assets_others = []
-    out_lines_others = []
-
-    for objfile, objfile_symbols in new_symbols.items():
-        # decide to which syms_*.ld file append this .o file's symbols
-        out_lines = None
-        skip = False
-        if objfile.startswith("build/src/overlays/"):
-            # we don't need the symbols from overlays
-            # and because they get relocated using them usually makes little sense
-            skip = True
-        elif objfile.startswith("build/src/elf_message/"):
-            # this is data which symbols aren't used directly
-            skip = True
-        elif (
-            objfile == "build/asm/entry.o"
-            # decomp 4775fd4a7ea8077f603900def093124f8aa7cec6 : asm/entry.s -> src/makerom/entry.s
-            or objfile == "build/src/makerom/entry.o"
-        ):
-            # skip `entrypoint` symbol
-            skip = True
-        elif objfile.startswith("build/src/"):
-            out_lines = out_lines_src
-        elif objfile.startswith("build/assets/scenes/"):
-            out_lines = out_lines_assets_scenes
-        elif objfile.startswith("build/assets/objects/"):
-            out_lines = out_lines_assets_objects
-        elif objfile.startswith("build/assets/"):
-            out_lines = out_lines_assets_others
-        else:
-            out_lines = out_lines_others
-
-        syms_dump[objfile] = {
-            section: {
-                symbol: {
-                    "ram": f"0x{ram:08X}" if ram is not None else None,
-                    "rom": (
-                        f"0x{rom:08X}"
-                        if rom is not None and section != ".bss"
-                        else None
-                    ),
-                    "used": not skip,
-                }
-                for symbol, (ram, rom) in section_symbols.items()
-            }
-            for section, section_symbols in objfile_symbols.items()
-        }
+                headers_to_copy.append(header)
 
-        if skip:
-            continue
+    with profiling.stage("copy_headers"):
+        copy_header_files(
+            oot_decomp_repo_path, output_path_includes, headers_to_copy, link_mode
+        )
 
-        # append symbols
-        out_lines.append(f"/* {objfile} */")
-        for section in (".text", ".data", ".rodata", ".bss"):
-            section_symbols = objfile_symbols.get(section)
-            if section_symbols:
-                out_lines.append(f" /* {section} */")
-                symbol_pad = max(len(symbol) for symbol in section_symbols.keys())
-                for symbol, (ram, rom) in section_symbols.items():
-                    try:
-                        line = f"  {symbol:<{symbol_pad}} = 0x{ram:08X};"
-                        if section != ".bss":
-                            line += f"  /* ROM: 0x{rom:08X} */"
-                    except:
-                        print(
-                            "Couldn't format line",
-                            repr(symbol),
-                            repr(ram),
-                            repr(rom),
-                            repr(symbol_pad),
-                            repr(section),
-                            repr(objfile),
+    with profiling.stage("delete_headers"):
+        for header in previous_headers.keys() - headers.keys():
+            output_header_path = output_path_includes / header
+            if output_header_path.exists():
+                output_header_path.unlink()
+                profiling.count("headers_deleted")
+            # remove directories left empty
+            output_dir_path = output_header_path.parent
+            while output_dir_path != output_path_includes and not any(
+                output_dir_path.iterdir()
+            ):
+                output_dir_path.rmdir()
+                profiling.count("empty_dirs_pruned")
+                output_dir_path = output_dir_path.parent
+
+    return headers
+
+
+def select_headers(
+    oot_decomp_repo_path: Path,
+    output_path_syms: Path,
+    headers_roots: Optional[List[Path]],
+) -> List[str]:
+    """
+    Returns the headers to copy: all of decomp's headers, or if `headers_roots`
+    is set only the ones reachable from them through #include directives
+
+    The dependency graph of the reachable headers is written to headers_deps.json
+    in `output_path_syms` (see headerdeps.py)
+    """
+    with profiling.stage("find_headers"):
+        headers = find_headers(oot_decomp_repo_path)
+
+    headers_deps_path = output_path_syms / headerdeps.HEADERS_DEPS_FILE_NAME
+    if headers_roots is None:
+        if headers_deps_path.exists():
+            headers_deps_path.unlink()
+        return headers
+
+    with profiling.stage("find_headers_deps"):
+        headers_deps = headerdeps.find_headers_deps(
+            oot_decomp_repo_path, headers_roots, headers
+        )
+        headerdeps.write_headers_deps(headers_deps_path, headers_deps)
+    profiling.count("headers_found", len(headers))
+    profiling.count("headers_reachable", len(headers_deps["headers"]))
+    return list(headers_deps["headers"].keys())
+
+
+# sections written to the syms_*.ld files, in order
+LD_SECTIONS = (".text", ".data", ".rodata", ".bss")
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+def json_encode_key(key: Optional[str]) -> str:
+    # like json.dump, which writes None keys as "null"
+    if key is None:
+        return '"null"'
+    return json.encoder.encode_basestring_ascii(key)
+
+
+def json_format_chunks(chunks: List[str], indent: str) -> str:
+    """
+    Formats a json object like `json.dump(..., indent=1)` from the `chunks`
+    of its formatted items, `indent` being the indent of the object itself
+    """
+    if not chunks:
+        return "{}"
+    return "{\n" + ",\n".join(chunks) + f"\n{indent}}}"
+
+
+def format_objfile_syms(
+    objfile: str,
+    objfile_symbols: Dict[str, SectionSymbols],
+    used: bool,
+) -> Tuple[str, str]:
+    """
+    Formats the symbols of `objfile` in a single pass,
+    both for syms.json (as an item of the top-level object)
+    and for a syms_*.ld file (empty if not `used`)
+    """
+    used_json = "true" if used else "false"
+
+    objfile_json_chunks = []
+    ld_chunks_by_section = dict()
+    for section, section_symbols in objfile_symbols.items():
+        is_bss = section == ".bss"
+        section_json_chunks = []
+        section_ld_lines = []
+        if used and section in LD_SECTIONS and section_symbols:
+            symbol_pad = max(map(len, section_symbols.names))
+            section_ld_lines.append(f" /* {section} */\n")
+        else:
+            symbol_pad = None
+        try:
+            # read the columns directly
+            for symbol, ram, rom in zip(
+                section_symbols.names, section_symbols.rams, section_symbols.roms
+            ):
+                ram_json = f'"0x{ram:08X}"' if ram != NO_ADDRESS else "null"
+                rom_json = (
+                    f'"0x{rom:08X}"' if rom != NO_ADDRESS and not is_bss else "null"
+                )
+                section_json_chunks.append(
+                    f"   {json_encode_key(symbol)}: {{\n"
+                    f'    "ram": {ram_json},\n'
+                    f'    "rom": {rom_json},\n'
+                    f'    "used": {used_json}\n'
+                    "   }"
+                )
+                if symbol_pad is not None:
+                    if ram == NO_ADDRESS or (rom == NO_ADDRESS and not is_bss):
+                        raise ValueError("Missing address")
+                    if is_bss:
+                        section_ld_lines.append(
+                            f"  {symbol:<{symbol_pad}} = 0x{ram:08X};\n"
+                        )
+                    else:
+                        section_ld_lines.append(
+                            f"  {symbol:<{symbol_pad}} = 0x{ram:08X};"
+                            f"  /* ROM: 0x{rom:08X} */\n"
                         )
-                        raise
-                    out_lines.append(line)
-        out_lines.append("")
+        except (TypeError, ValueError) as e:
+            raise Exception(
+                "Couldn't format symbol", symbol, ram, rom, section, objfile
+            ) from e
+        profiling.count(f"symbols[{section}]", len(section_symbols))
+        objfile_json_chunks.append(
+            f"  {json_encode_key(section)}: "
+            + json_format_chunks(section_json_chunks, "  ")
+        )
+        if section_ld_lines:
+            ld_chunks_by_section[section] = "".join(section_ld_lines)
+
+    syms_json_chunk = f" {json_encode_key(objfile)}: " + json_format_chunks(
+        objfile_json_chunks, " "
+    )
+
+    if not used:
+        return syms_json_chunk, ""
+
+    ld_chunk = "".join(
+        [f"/* {objfile} */\n"]
+        + [
+            ld_chunks_by_section[section]
+            for section in LD_SECTIONS
+            if section in ld_chunks_by_section
+        ]
+        + ["\n"]
+    )
+    return syms_json_chunk, ld_chunk
 
-    with (output_path_syms / "syms.json").open("w") as f:
-        json.dump(syms_dump, f, indent=1)
+
+def iter_symbols_tuples(
+    symbols: Symbols,
+) -> Iterator[Tuple[str, str, str, Optional[int], Optional[int], bool]]:
+    """
+    Yields the (objfile, section, symbol, ram, rom, used) tuples of `symbols`,
+    like in syms.json (see symsdb.py)
+    """
+    for objfile, objfile_symbols in symbols.items():
+        used = get_objfile_ld_file_name(objfile) is not None
+        for section, section_symbols in objfile_symbols.items():
+            for symbol, (ram, rom) in section_symbols.items():
+                yield (
+                    objfile,
+                    section,
+                    symbol,
+                    ram,
+                    rom if section != ".bss" else None,
+                    used,
+                )
+
+
+def write_syms(
+    new_symbols: Symbols,
+    output_path_syms: Path,
+    previous_objfiles_digests: Dict[str, str],
+    previous_ld_files_digests: Dict[str, str],
+    manifest: dict,
+    syms_db: bool = False,
+):
+    """
+    Writes syms.json and the syms_*.ld files from `new_symbols`,
+    and syms.bin (see symsdb.py) if `syms_db` is set
+
+    Files are only written if their contents changed compared to
+    the previous digests, and `manifest` is updated with the new digests
+    """
+
+    # syms.json is written by hand, formatted like `json.dump(..., indent=1)`,
+    # one chunk per .o file as soon as it is formatted, to a temporary file
+    # which only replaces syms.json if the symbols changed
+    syms_json_path = output_path_syms / "syms.json"
+    syms_json_temp_path = output_path_syms / "syms.json.tmp"
+    objfiles_digests = dict()
+
+    # one list of chunks per syms_*.ld file
+    ld_chunks_by_ld_file = {ld_file_name: [] for ld_file_name in LD_FILE_NAMES}
+    # the digests of the .o files in each syms_*.ld file
+    ld_files_hashes = {
+        ld_file_name: hashlib.sha1() for ld_file_name in LD_FILE_NAMES
+    }
+
+    try:
+        with profiling.stage("format_syms"), syms_json_temp_path.open(
+            "w", buffering=WRITE_BUFFER_SIZE
+        ) as syms_json_file:
+            syms_json_file.write("{")
+            for objfile, objfile_symbols in new_symbols.items():
+                # decide to which syms_*.ld file append this .o file's symbols
+                ld_file_name = get_objfile_ld_file_name(objfile)
+
+                syms_json_chunk, ld_chunk = format_objfile_syms(
+                    objfile, objfile_symbols, ld_file_name is not None
+                )
+                syms_json_file.write(
+                    (",\n" if objfiles_digests else "\n") + syms_json_chunk
+                )
+                objfiles_digests[objfile] = hashlib.sha1(
+                    syms_json_chunk.encode()
+                ).hexdigest()
+
+                if ld_file_name is None:
+                    continue
+
+                ld_files_hashes[ld_file_name].update(
+                    f"{objfile} {objfiles_digests[objfile]}\n".encode()
+                )
+                ld_chunks_by_ld_file[ld_file_name].append(ld_chunk)
+            syms_json_file.write("\n}" if objfiles_digests else "}")
+            syms_json_size = syms_json_file.tell()
+    except BaseException:
+        syms_json_temp_path.unlink(missing_ok=True)
+        raise
+
+    manifest["objfiles"] = objfiles_digests
+    manifest["ld_files"] = {
+        ld_file_name: ld_file_hash.hexdigest()
+        for ld_file_name, ld_file_hash in ld_files_hashes.items()
+    }
+
+    # compare items lists to also catch .o files being reordered
+    syms_changed = list(objfiles_digests.items()) != list(
+        previous_objfiles_digests.items()
+    )
+
+    if syms_changed or not syms_json_path.exists():
+        syms_json_temp_path.replace(syms_json_path)
+        profiling.count("bytes_written", syms_json_size)
+    else:
+        syms_json_temp_path.unlink()
+
+    if syms_db and (syms_changed or not (output_path_syms / "syms.bin").exists()):
+        with profiling.stage("write_syms_db"):
+            symsdb.write_syms_db(
+                output_path_syms / "syms.bin", iter_symbols_tuples(new_symbols)
+            )
+        if profiling.is_profiling():
+            profiling.count(
+                "bytes_written", (output_path_syms / "syms.bin").stat().st_size
+            )
 
     # write syms_*.ld files
 
-    for out_file_name, out_lines in (
-        ("src", out_lines_src),
-        ("assets_scenes", out_lines_assets_scenes),
-        ("assets_objects", out_lines_assets_objects),
-        ("assets_others", out_lines_assets_others),
-        ("others", out_lines_others),
-    ):
-        with (output_path_syms / f"syms_{out_file_name}.ld").open("w") as f:
-            f.writelines(f"{line}\n" for line in out_lines)
+    for ld_file_name, ld_chunks in ld_chunks_by_ld_file.items():
+        ld_file_path = output_path_syms / f"syms_{ld_file_name}.ld"
+        if (
+            manifest["ld_files"][ld_file_name]
+            == previous_ld_files_digests.get(ld_file_name)
+            and ld_file_path.exists()
+        ):
+            continue
+        with profiling.stage(f"write_syms_{ld_file_name}_ld"):
+            with ld_file_path.open("w", buffering=WRITE_BUFFER_SIZE) as f:
+                f.writelines(ld_chunks)
+                profiling.count("bytes_written", f.tell())
+
+
+def make_empty_dir(empty_dir_path: Path, ask_before_delete: bool = True):
+    """
+    Deletes `empty_dir_path` if it exists (asking first if `ask_before_delete`)
+    and creates it again
+    """
+    if empty_dir_path.exists():
+        while ask_before_delete and (
+            input(f"Delete directory {empty_dir_path.absolute()} ? 'yes' to confirm: ")
+            != "yes"
+        ):
+            pass
+        shutil.rmtree(empty_dir_path)
 
-    with (oot_decomp_repo_path / "undefined_syms.txt").open() as f:
+    empty_dir_path.mkdir(parents=True, exist_ok=True)
+
+
+def write_undefined_syms(undefined_syms_path: Path, output_path_syms: Path):
+    with undefined_syms_path.open() as f:
         undefined_syms = f.read()
 
     # convert single-line comments like `// abc` to `/* abc */`
@@ -266,32 +1097,320 @@ def update_z64hdr(
     with (output_path_syms / "undefined_syms.txt").open("w") as f:
         f.write(undefined_syms)
 
+
+def update_z64hdr(
+    oot_decomp_repo_path: Path,
+    output_path_syms: Path,
+    output_path_includes: Path,
+    incremental: bool = False,
+    headers_link_mode: str = "copy",
+    syms_db: bool = False,
+    ask_before_delete: bool = True,
+    map_path: Optional[Path] = None,
+    headers_roots: Optional[List[Path]] = None,
+    previous_manifest: Optional[dict] = None,
+    processes: Optional[int] = None,
+    history_path: Optional[Path] = None,
+    history_version: Optional[str] = None,
+    headers_bundle_root: Optional[Path] = None,
+    mp_context: Optional[multiprocessing.context.BaseContext] = None,
+) -> dict:
+    """
+    `oot_decomp_repo_path` should be a `Path` to the oot decomp repo
+        for example `Path("/home/dragorn421/Documents/oot/")`
+
+    Writes syms_*.ld files under `output_path_syms`,
+        and copies undefined_syms.txt there,
+        and dumps the parsed symbols from the map to syms.json
+
+    Copies .h files from decomp's assets, include and src into `output_path_includes`
+
+    If `incremental` is set and the outputs of a previous run are there,
+        only the files that changed are written again
+        (based on the manifest of the previous incremental run, which is only
+        written next to syms.json if `incremental` is set)
+
+    `headers_link_mode` is how headers are copied, see `copy_header_file`
+
+    If `syms_db` is set, also writes the parsed symbols to syms.bin,
+        a compact binary symbol database (see symsdb.py),
+        otherwise deletes syms.bin if a previous run wrote it
+
+    Output directories are deleted before a full rebuild, after asking
+        for confirmation unless `ask_before_delete` is False
+
+    `map_path` is the map file to parse, relative to `oot_decomp_repo_path`
+        (build/z64.map by default)
+
+    If `headers_roots` is set, only the headers reachable from these headers
+        through #include directives are copied (see `select_headers`)
+
+    `previous_manifest` is the manifest returned by the previous run, to use
+        instead of reading it from syms_manifest.json if `incremental` is set
+
+    `processes` is the amount of processes to parse the map with
+        (defaults to the amount of CPUs), started with `mp_context`,
+        see `read_symbols`
+
+    If `history_path` is set, the symbols are also added to that symbol history
+        database (see symhistory.py) as version `history_version`
+        (by default, "map-" and the beginning of the map file's sha1),
+        unless it already has that version
+
+    If `headers_bundle_root` is set, the headers it includes are also amalgamated
+        into a single header in `output_path_includes` (see headerbundle.py),
+        only made again when one of them changed. With `headers_roots`,
+        it is also one of the roots.
+
+    Returns the manifest
+    """
+
+    if map_path is None:
+        map_path = Path("build") / "z64.map"
+    map_path = oot_decomp_repo_path / map_path
+    undefined_syms_path = oot_decomp_repo_path / "undefined_syms.txt"
+
+    if not incremental or not output_path_includes.exists():
+        previous_manifest = None
+    elif previous_manifest is None:
+        previous_manifest = read_syms_manifest(output_path_syms)
+
+    if previous_manifest is None:
+        with profiling.stage("empty_output_dirs"):
+            for empty_dir_path in (output_path_syms, output_path_includes):
+                make_empty_dir(empty_dir_path, ask_before_delete)
+
+        previous_manifest = {
+            "version": SYMS_MANIFEST_VERSION,
+            "inputs": dict(),
+            "objfiles": dict(),
+            "ld_files": dict(),
+            "headers": None,
+        }
+
+    manifest = {
+        "version": SYMS_MANIFEST_VERSION,
+        "inputs": dict(),
+        "objfiles": previous_manifest["objfiles"],
+        "ld_files": previous_manifest["ld_files"],
+        "headers": None,
+    }
+
+    manifest["inputs"]["z64.map"] = get_file_fingerprint(
+        map_path, previous_manifest["inputs"].get("z64.map")
+    )
+
+    if manifest["inputs"]["z64.map"] != previous_manifest["inputs"].get(
+        "z64.map"
+    ) or not all(
+        (output_path_syms / file_name).exists()
+        for file_name in (
+            "syms.json",
+            *(f"syms_{ld_file_name}.ld" for ld_file_name in LD_FILE_NAMES),
+            *(("syms.bin",) if syms_db else ()),
+        )
+    ):
+        symbols = read_symbols(map_path, processes, mp_context)
+        write_syms(
+            symbols,
+            output_path_syms,
+            previous_manifest["objfiles"],
+            previous_manifest["ld_files"],
+            manifest,
+            syms_db,
+        )
+    else:
+        symbols = None
+
+    if not syms_db:
+        # left by a previous run with `syms_db`, it would not be kept up to date
+        (output_path_syms / "syms.bin").unlink(missing_ok=True)
+
+    if history_path is not None:
+        if history_version is None:
+            history_version = "map-" + manifest["inputs"]["z64.map"]["sha1"][:12]
+        with profiling.stage("add_to_history"), symhistory.SymbolHistory(
+            history_path
+        ) as history:
+            if not history.has_version(history_version):
+                if symbols is None:
+                    symbols = read_symbols(map_path, processes, mp_context)
+                history.add_version(history_version, iter_symbols_tuples(symbols))
+                print("Added version", history_version, "to", history_path)
+
+    manifest["inputs"]["undefined_syms.txt"] = get_file_fingerprint(
+        undefined_syms_path, previous_manifest["inputs"].get("undefined_syms.txt")
+    )
+
+    if (
+        manifest["inputs"]["undefined_syms.txt"]
+        != previous_manifest["inputs"].get("undefined_syms.txt")
+        or not (output_path_syms / "undefined_syms.txt").exists()
+    ):
+        with profiling.stage("write_undefined_syms"):
+            write_undefined_syms(undefined_syms_path, output_path_syms)
+
     # copy headers
 
-    def copytree_ignore_onlycopyheaders(dir, entries: Iterable[str]):
-        ignored_entries = []
-        dirpath = Path(dir)
-        for entry in entries:
-            path = dirpath / entry
-            if not (path.is_dir() or entry.endswith(".h")):
-                ignored_entries.append(entry)
-        return ignored_entries
-
-    for folder in ("assets", "include", "src"):
-        shutil.copytree(
-            oot_decomp_repo_path / folder,
-            output_path_includes / folder,
-            ignore=copytree_ignore_onlycopyheaders,
+    if headers_roots is not None and headers_bundle_root is not None:
+        headers_roots = headers_roots + [headers_bundle_root]
+
+    headers = select_headers(oot_decomp_repo_path, output_path_syms, headers_roots)
+
+    if previous_manifest["headers"] is not None:
+        with profiling.stage("update_headers"):
+            manifest["headers"] = update_headers_incremental(
+                oot_decomp_repo_path,
+                output_path_includes,
+                headers,
+                previous_manifest["headers"],
+                headers_link_mode,
+            )
+    else:
+        with profiling.stage("copy_headers"):
+            copy_header_files(
+                oot_decomp_repo_path, output_path_includes, headers, headers_link_mode
+            )
+        with profiling.stage("fingerprint_headers"):
+            manifest["headers"] = {
+                header: get_file_fingerprint(oot_decomp_repo_path / header, None)
+                for header in headers
+            }
+
+    headers_bundle_cache_path = (
+        output_path_syms / headerbundle.HEADERS_BUNDLE_CACHE_FILE_NAME
+    )
+    if headers_bundle_root is not None:
+        with profiling.stage("write_headers_bundle"):
+            if headerbundle.write_headers_bundle(
+                oot_decomp_repo_path,
+                headers_bundle_root,
+                headers,
+                output_path_includes
+                / headerbundle.get_headers_bundle_name(headers_bundle_root),
+                headers_bundle_cache_path,
+            ):
+                profiling.count("headers_bundle_written")
+    else:
+        headerbundle.remove_headers_bundle(
+            headers_bundle_cache_path, output_path_includes
         )
-        cont = True
-        while cont:
-            empty_dirs = []
-            for dirpath, dirnames, filenames in os.walk(output_path_includes / folder):
-                if len(dirnames) == 0 and len(filenames) == 0:
-                    empty_dirs.append(dirpath)
-            cont = len(empty_dirs) != 0
-            for empty_dir in empty_dirs:
-                os.rmdir(empty_dir)
+
+    if incremental and manifest != previous_manifest:
+        with profiling.stage("write_manifest"):
+            with (output_path_syms / SYMS_MANIFEST_FILE_NAME).open("w") as f:
+                json.dump(manifest, f, indent=1)
+
+    return manifest
+
+
+def get_inputs_snapshot(
+    oot_decomp_repo_path: Path, map_path: Path
+) -> Dict[str, Tuple[int, int]]:
+    """
+    Returns the size and mtime of the files `update_z64hdr` reads (the map file,
+    undefined_syms.txt and the headers), by path relative to `oot_decomp_repo_path`
+
+    Missing files are left out
+    """
+    snapshot = dict()
+    for input_path in (map_path, Path("undefined_syms.txt")):
+        try:
+            stat = (oot_decomp_repo_path / input_path).stat()
+        except FileNotFoundError:
+            continue
+        snapshot[input_path.as_posix()] = (stat.st_size, stat.st_mtime_ns)
+    for header, entry in iter_headers_entries(oot_decomp_repo_path):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        snapshot[header] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+def watch_z64hdr(
+    oot_decomp_repo_path: Path,
+    output_path_syms: Path,
+    output_path_includes: Path,
+    headers_link_mode: str = "copy",
+    syms_db: bool = False,
+    map_path: Optional[Path] = None,
+    headers_roots: Optional[List[Path]] = None,
+    poll_interval: float = 1,
+    debounce: float = 2,
+    processes: Optional[int] = None,
+    history_path: Optional[Path] = None,
+    headers_bundle_root: Optional[Path] = None,
+):
+    """
+    Runs `update_z64hdr` incrementally, then again every time the files it reads
+    change, until interrupted
+
+    The files are polled every `poll_interval` seconds. Once a change is seen,
+    they must stay the same for `debounce` seconds (such as until the decomp build
+    is done) before updating. The manifest is kept in memory between updates.
+
+    Updates that fail are reported and the next change is waited for.
+    """
+    if map_path is None:
+        map_path = Path("build") / "z64.map"
+
+    manifest = None
+    updated_snapshot = None
+    while True:
+        snapshot = get_inputs_snapshot(oot_decomp_repo_path, map_path)
+        if snapshot == updated_snapshot:
+            time.sleep(poll_interval)
+            continue
+
+        if updated_snapshot is not None:
+            # wait for the changes to settle
+            while True:
+                time.sleep(debounce)
+                settled_snapshot = get_inputs_snapshot(oot_decomp_repo_path, map_path)
+                if settled_snapshot == snapshot:
+                    break
+                snapshot = settled_snapshot
+            changed_paths = sorted(
+                path
+                for path in snapshot.keys() | updated_snapshot.keys()
+                if snapshot.get(path) != updated_snapshot.get(path)
+            )
+            changes_description = ", ".join(changed_paths[:5])
+            if len(changed_paths) > 5:
+                changes_description += f" and {len(changed_paths) - 5} more"
+            print("Changed:", changes_description)
+
+        if map_path.as_posix() not in snapshot:
+            print("Waiting for", oot_decomp_repo_path / map_path)
+        else:
+            start = time.perf_counter()
+            try:
+                manifest = update_z64hdr(
+                    oot_decomp_repo_path,
+                    output_path_syms,
+                    output_path_includes,
+                    incremental=True,
+                    headers_link_mode=headers_link_mode,
+                    syms_db=syms_db,
+                    # only ask on the first update
+                    ask_before_delete=updated_snapshot is None,
+                    map_path=map_path,
+                    headers_roots=headers_roots,
+                    previous_manifest=manifest,
+                    processes=processes,
+                    history_path=history_path,
+                    headers_bundle_root=headers_bundle_root,
+                )
+                print(f"Updated in {time.perf_counter() - start:.3f} s")
+            except Exception:
+                traceback.print_exc()
+                print("Update failed, waiting for the next change")
+                # read the manifest of the last successful update next time
+                manifest = None
+        updated_snapshot = snapshot
+        time.sleep(poll_interval)
 
 
 def main():
@@ -299,12 +1418,145 @@ def main():
     parser.add_argument("oot_decomp_repo_path")
     parser.add_argument("output_path_syms")
     parser.add_argument("output_path_includes")
-    args = parser.parse_args()
-    update_z64hdr(
-        oot_decomp_repo_path=Path(args.oot_decomp_repo_path),
-        output_path_syms=Path(args.output_path_syms),
-        output_path_includes=Path(args.output_path_includes),
+    parser.add_argument(
+        "--map",
+        dest="map_path",
+        type=Path,
+        help=(
+            "Map file to parse, relative to oot_decomp_repo_path"
+            " (default: build/z64.map)"
+        ),
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only rewrite the outputs that changed since the previous run",
+    )
+    parser.add_argument(
+        "--headers-link-mode",
+        choices=HEADERS_LINK_MODES,
+        default="copy",
+        help="How to copy headers (hardlink and reflink fall back to copy if needed)",
+    )
+    parser.add_argument(
+        "--syms-db",
+        action="store_true",
+        help="Also write the symbols to syms.bin, a compact binary symbol database",
+    )
+    parser.add_argument(
+        "--headers-roots",
+        nargs="+",
+        type=Path,
+        metavar="HEADER",
+        help=(
+            "Only copy the headers reachable from these headers through #include"
+            " (relative to oot_decomp_repo_path, or outside of it like z64hdr.h)"
+        ),
+    )
+    parser.add_argument(
+        "--headers-bundle",
+        dest="headers_bundle_root",
+        type=Path,
+        metavar="HEADER",
+        help=(
+            "Also amalgamate the headers included from this header into a single"
+            " header, like HEADER_bundle.h in output_path_includes"
+            " (relative to oot_decomp_repo_path, or outside of it like z64hdr.h)"
+        ),
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "Keep running, and update the outputs when the map file, undefined_syms.txt"
+            " or headers change (implies --incremental)"
+        ),
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1,
+        metavar="SECONDS",
+        help="With --watch, how often to check for changes (default: 1)",
     )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=2,
+        metavar="SECONDS",
+        help=(
+            "With --watch, how long files must stay unchanged before updating"
+            " (default: 2)"
+        ),
+    )
+    parser.add_argument(
+        "--history",
+        dest="history_path",
+        type=Path,
+        metavar="HISTORY_PATH",
+        help=(
+            "Also add the symbols to this symbol history database (see symhistory.py)"
+        ),
+    )
+    parser.add_argument(
+        "--history-version",
+        metavar="VERSION",
+        help=(
+            "Name of the version in the symbol history"
+            " (default: map- and the beginning of the map's sha1)"
+        ),
+    )
+    parser.add_argument(
+        "-j",
+        "--processes",
+        type=int,
+        help=(
+            "Amount of processes to parse the map with, for big maps"
+            " (default: amount of CPUs)"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        metavar="REPORT_PATH",
+        help="Write a json report of how long each stage took, memory and counters",
+    )
+    args = parser.parse_args()
+
+    with profiling.profile("decomp_getter", args.profile):
+        if args.watch:
+            try:
+                watch_z64hdr(
+                    oot_decomp_repo_path=Path(args.oot_decomp_repo_path),
+                    output_path_syms=Path(args.output_path_syms),
+                    output_path_includes=Path(args.output_path_includes),
+                    headers_link_mode=args.headers_link_mode,
+                    syms_db=args.syms_db,
+                    map_path=args.map_path,
+                    headers_roots=args.headers_roots,
+                    poll_interval=args.poll_interval,
+                    debounce=args.debounce,
+                    processes=args.processes,
+                    history_path=args.history_path,
+                    headers_bundle_root=args.headers_bundle_root,
+                )
+            except KeyboardInterrupt:
+                print("Stopped watching")
+        else:
+            update_z64hdr(
+                oot_decomp_repo_path=Path(args.oot_decomp_repo_path),
+                output_path_syms=Path(args.output_path_syms),
+                output_path_includes=Path(args.output_path_includes),
+                incremental=args.incremental,
+                headers_link_mode=args.headers_link_mode,
+                syms_db=args.syms_db,
+                map_path=args.map_path,
+                headers_roots=args.headers_roots,
+                processes=args.processes,
+                history_path=args.history_path,
+                history_version=args.history_version,
+                headers_bundle_root=args.headers_bundle_root,
+            )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,227 @@
+#!/bin/env python3
+
+# SPDX-License-Identifier: CC0-1.0 OR Unlicense
+
+import argparse
+import concurrent.futures
+import json
+from pathlib import Path
+
+from typing import Dict, List, Optional
+
+import decomp_getter
+
+
+class DecompVersion:
+    def __init__(
+        self,
+        name: str,
+        oot_decomp_repo_path: Path,
+        map_path: Optional[Path] = None,
+    ):
+        """
+        Version `name` (like oot_mq_debug) built in decomp at `oot_decomp_repo_path`,
+        with the map file at `map_path` (relative to the decomp repo,
+        defaults to build/z64.map)
+        """
+        self.name = name
+        self.oot_decomp_repo_path = oot_decomp_repo_path
+        if map_path is None:
+            map_path = Path("build") / "z64.map"
+        self.map_path = oot_decomp_repo_path / map_path
+
+
+def build_version_syms(
+    version: DecompVersion,
+    output_path_syms: Path,
+    syms_db: bool = False,
+):
+    """
+    Parses the map of `version` and writes its syms_*.ld, syms.json
+    and undefined_syms.txt files to `output_path_syms`
+
+    Returns the parsed symbols
+    """
+    symbols = decomp_getter.read_and_organize_symbols(
+        decomp_getter.iter_map_file_lines(version.map_path)
+    )
+    decomp_getter.write_syms(symbols, output_path_syms, {}, {}, dict(), syms_db)
+    decomp_getter.write_undefined_syms(
+        version.oot_decomp_repo_path / "undefined_syms.txt", output_path_syms
+    )
+    return symbols
+
+
+def update_z64hdr_batch(
+    versions: List[DecompVersion],
+    output_path: Path,
+    output_path_includes: Path,
+    processes: Optional[int] = None,
+    headers_link_mode: str = "copy",
+    syms_db: bool = False,
+    ask_before_delete: bool = True,
+):
+    """
+    Like `decomp_getter.update_z64hdr`, for several versions at once
+
+    The maps are parsed in parallel, using a pool of `processes` processes,
+    and the symbols of each version are written to `output_path`/syms_<version>
+
+    Headers are copied once per decomp repo (not once per version):
+    to `output_path_includes` if all versions use the same decomp repo,
+    to `output_path_includes`/<version> otherwise
+    (with <version> the first version using that decomp repo)
+
+    Also writes a cross-version address table to `output_path`/syms_versions.json:
+    {
+        "versions": [version, ...],
+        "headers": {version: headers folder, ...},
+        "symbols": {o_file: {section: {symbol: {version: {"ram": ..., "rom": ...}}}}},
+    }
+    """
+
+    versions_by_repo: Dict[Path, List[DecompVersion]] = dict()
+    for version in versions:
+        versions_by_repo.setdefault(version.oot_decomp_repo_path.resolve(), []).append(
+            version
+        )
+
+    output_path.mkdir(parents=True, exist_ok=True)
+    for version in versions:
+        decomp_getter.make_empty_dir(
+            output_path / f"syms_{version.name}", ask_before_delete
+        )
+    decomp_getter.make_empty_dir(output_path_includes, ask_before_delete)
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        futures = [
+            executor.submit(
+                build_version_syms,
+                version,
+                output_path / f"syms_{version.name}",
+                syms_db,
+            )
+            for version in versions
+        ]
+
+        # copy headers while the maps are being parsed
+        headers_paths = dict()
+        for repo_versions in versions_by_repo.values():
+            if len(versions_by_repo) == 1:
+                repo_output_path_includes = output_path_includes
+            else:
+                repo_output_path_includes = output_path_includes / repo_versions[0].name
+            print(
+                "Copy headers for",
+                ", ".join(version.name for version in repo_versions),
+                "to",
+                repo_output_path_includes,
+            )
+            oot_decomp_repo_path = repo_versions[0].oot_decomp_repo_path
+            decomp_getter.copy_header_files(
+                oot_decomp_repo_path,
+                repo_output_path_includes,
+                decomp_getter.find_headers(oot_decomp_repo_path),
+                headers_link_mode,
+            )
+            for version in repo_versions:
+                headers_paths[version.name] = str(repo_output_path_includes)
+
+        symbols_by_version = [future.result() for future in futures]
+
+    syms_versions = dict()
+    for version, symbols in zip(versions, symbols_by_version):
+        for objfile, objfile_symbols in symbols.items():
+            objfile_syms_versions = syms_versions.setdefault(objfile, dict())
+            for section, section_symbols in objfile_symbols.items():
+                section_syms_versions = objfile_syms_versions.setdefault(
+                    section, dict()
+                )
+                for symbol, (ram, rom) in section_symbols.items():
+                    section_syms_versions.setdefault(symbol, dict())[version.name] = {
+                        "ram": f"0x{ram:08X}" if ram is not None else None,
+                        "rom": (
+                            f"0x{rom:08X}"
+                            if rom is not None and section != ".bss"
+                            else None
+                        ),
+                    }
+
+    with (output_path / "syms_versions.json").open("w") as f:
+        json.dump(
+            {
+                "versions": [version.name for version in versions],
+                "headers": headers_paths,
+                "symbols": syms_versions,
+            },
+            f,
+            indent=1,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run decomp_getter.py for several versions at once"
+    )
+    parser.add_argument(
+        "output_path",
+        type=Path,
+        help="Where to write the syms_<version> folders and syms_versions.json",
+    )
+    parser.add_argument("output_path_includes", type=Path)
+    parser.add_argument(
+        "-d",
+        "--decomp-version",
+        dest="versions",
+        action="append",
+        nargs="+",
+        metavar="VERSION DECOMP_PATH [MAP_PATH]",
+        required=True,
+        help=(
+            "A version to build, for example `-d oot_mq_debug ~/Documents/oot/`"
+            " (MAP_PATH is relative to DECOMP_PATH, default build/z64.map)"
+        ),
+    )
+    parser.add_argument(
+        "-j",
+        "--processes",
+        type=int,
+        help="Amount of processes to parse maps with (default: amount of CPUs)",
+    )
+    parser.add_argument(
+        "--headers-link-mode",
+        choices=decomp_getter.HEADERS_LINK_MODES,
+        default="copy",
+        help="How to copy headers (hardlink and reflink fall back to copy if needed)",
+    )
+    parser.add_argument(
+        "--syms-db",
+        action="store_true",
+        help="Also write the symbols to syms.bin, a compact binary symbol database",
+    )
+    args = parser.parse_args()
+
+    versions = []
+    for version_args in args.versions:
+        if len(version_args) not in {2, 3}:
+            parser.error(f"Expected VERSION DECOMP_PATH [MAP_PATH], got {version_args}")
+        versions.append(
+            DecompVersion(
+                version_args[0],
+                Path(version_args[1]),
+                Path(version_args[2]) if len(version_args) == 3 else None,
+            )
+        )
+
+    update_z64hdr_batch(
+        versions,
+        args.output_path,
+        args.output_path_includes,
+        processes=args.processes,
+        headers_link_mode=args.headers_link_mode,
+        syms_db=args.syms_db,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,64 +3,339 @@
 # SPDX-License-Identifier: CC0-1.0 OR Unlicense
 
 import argparse
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import csv
+import html
+import itertools
 import json
+import multiprocessing.context
+import os
 from pathlib import Path
+import re
 
-
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    "old_syms_json_path",
-    help="Path to .json with old symbols",
-    type=Path,
-)
-parser.add_argument(
-    "new_syms_json_path",
-    help="Path to .json with new symbols",
-    type=Path,
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    TextIO,
+    Tuple,
+    Union,
 )
-parser.add_argument(
-    "output_dir_path",
-    help="Path to directory to write output files into",
-    type=Path,
-)
-args = parser.parse_args()
 
-with open(args.old_syms_json_path) as f:
-    old_syms = json.load(f)
-assert isinstance(old_syms, dict)
+import profiling
+import symsdb
 
-with open(args.new_syms_json_path) as f:
-    new_syms = json.load(f)
-assert isinstance(new_syms, dict)
+# .o files are compared in batches of this many, using a process pool
+# once there is at least one full batch
+COMPARE_BATCH_SIZE = 64
 
-# find differences
-changes = dict()
+# syms.json files are read by chunks of (at least) this size
+READ_CHUNK_SIZE = 1024 * 1024
 
-new_o_files = new_syms.keys() - old_syms.keys()
-removed_o_files = old_syms.keys() - new_syms.keys()
-common_files = old_syms.keys() & new_syms.keys()
+JSON_WHITESPACE_PATTERN = re.compile(r"[ \t\n\r]*")
 
-# TODO handle file renames
-changes["files"] = {
-    "new": list(new_o_files),
-    "removed": list(removed_o_files),
-}
 
-consider_if_used = True
-changed_syms = dict()
-changes["symbols"] = changed_syms
+def load_syms(syms_json_path: Path) -> dict:
+    """
+    Loads a syms.json file, or a syms.bin symbol database file (see symsdb.py)
+    """
+    if syms_json_path.suffix == ".bin":
+        return symsdb.load_syms_db(syms_json_path)
+    with open(syms_json_path) as f:
+        syms = json.load(f)
+    assert isinstance(syms, dict)
+    return syms
+
+
+class _JsonObjectReader:
+    """
+    Reads the items of the top-level json object of a file one at a time,
+    only keeping the current item's text in memory
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self):
+        if self.eof:
+            raise Exception("Unexpected end of json file", self.f.name)
+        # read at least as much as what is left, so that large values
+        # don't get decoded again for every chunk
+        chunk = self.f.read(max(READ_CHUNK_SIZE, len(self.buffer) - self.pos))
+        self.eof = not chunk
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+
+    def skip_whitespace(self):
+        while True:
+            self.pos = JSON_WHITESPACE_PATTERN.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return
+            self.read_more()
+
+    def expect(self, chars: str) -> str:
+        self.skip_whitespace()
+        char = self.buffer[self.pos]
+        if char not in chars:
+            raise Exception(
+                "Unexpected character in json file", char, chars, self.f.name
+            )
+        self.pos += 1
+        return char
+
+    def decode(self):
+        self.skip_whitespace()
+        while True:
+            try:
+                value, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+                return value
+            except json.JSONDecodeError:
+                # the value may not have been read entirely yet
+                if self.eof:
+                    raise
+                self.read_more()
+
+    def __iter__(self):
+        self.expect("{")
+        self.skip_whitespace()
+        if self.buffer[self.pos] == "}":
+            return
+        while True:
+            key = self.decode()
+            self.expect(":")
+            yield key, self.decode()
+            if self.expect(",}") == "}":
+                return
+
+
+def iter_syms_json(syms_json_path: Path) -> Iterator[Tuple[str, dict]]:
+    """
+    Yields the (o_file, symbols by section) items of a syms.json file,
+    one .o file at a time instead of loading the whole file
+    """
+    with open(syms_json_path) as f:
+        for o_file, syms_by_section in _JsonObjectReader(f):
+            assert isinstance(syms_by_section, dict)
+            yield o_file, syms_by_section
+
+
+def iter_syms(syms_json_path: Path) -> Iterator[Tuple[str, dict]]:
+    """
+    Like `iter_syms_json`, also for syms.bin symbol database files (see symsdb.py)
+    """
+    if syms_json_path.suffix == ".bin":
+        with symsdb.SymsDb(syms_json_path) as syms_db:
+            yield from syms_db.iter_objfiles_syms()
+    else:
+        yield from iter_syms_json(syms_json_path)
+
+
+def walk_syms(
+    old_syms_items: Iterable[Tuple[str, dict]],
+    new_syms_items: Iterable[Tuple[str, dict]],
+) -> Iterator[Tuple[str, Optional[dict], Optional[dict]]]:
+    """
+    Pairs up the .o files of the old and new symbols, reading both in lockstep
+
+    Yields (o_file, old symbols by section, new symbols by section)
+    for each .o file in both as soon as it has been read from both,
+    then the removed .o files (with None new symbols)
+    and the new .o files (with None old symbols), sorted.
+
+    .o files are held until they are found on the other side, so when
+    both are in the same order only about one .o file of each is held at a time
+    """
+    pending_old_syms = dict()
+    pending_new_syms = dict()
+    for old_item, new_item in itertools.zip_longest(old_syms_items, new_syms_items):
+        if old_item is not None:
+            o_file, old_syms_by_section = old_item
+            if o_file in pending_new_syms:
+                yield o_file, old_syms_by_section, pending_new_syms.pop(o_file)
+            else:
+                pending_old_syms[o_file] = old_syms_by_section
+        if new_item is not None:
+            o_file, new_syms_by_section = new_item
+            if o_file in pending_old_syms:
+                yield o_file, pending_old_syms.pop(o_file), new_syms_by_section
+            else:
+                pending_new_syms[o_file] = new_syms_by_section
+    for o_file in sorted(pending_old_syms):
+        yield o_file, pending_old_syms.pop(o_file), None
+    for o_file in sorted(pending_new_syms):
+        yield o_file, None, pending_new_syms.pop(o_file)
+
+
+def _get_syms_in_address_order(syms_syms: dict) -> List[Tuple[int, str]]:
+    return sorted(
+        (int(sym_info["ram"], 16), sym_name)
+        for sym_name, sym_info in syms_syms.items()
+        if sym_info["ram"] is not None
+    )
+
+
+def get_anchor_syms(
+    old_syms_in_order: List[Tuple[int, str]], new_syms_in_order: List[Tuple[int, str]]
+) -> set:
+    """
+    Returns the names of the symbols that are in both the old and new section,
+    and stayed in the same order: the longest such sequence of symbols
+    (like patience diff), so that symbols that moved elsewhere aren't anchors
+    """
+    new_syms_ranks = {sym_name: i for i, (_, sym_name) in enumerate(new_syms_in_order)}
+    common_syms_names = [
+        sym_name for _, sym_name in old_syms_in_order if sym_name in new_syms_ranks
+    ]
+    ranks = [new_syms_ranks[sym_name] for sym_name in common_syms_names]
+    if all(map(int.__lt__, ranks, itertools.islice(ranks, 1, None))):
+        # usually, none moved
+        return set(common_syms_names)
+
+    # longest increasing subsequence of the ranks in the new section
+    # tails_ranks[k] is the smallest rank ending an increasing subsequence
+    # of length k + 1, and tails[k] the index of that symbol
+    tails = []
+    tails_ranks = []
+    previous_in_subsequence = []
+    for i, rank in enumerate(ranks):
+        k = bisect.bisect_left(tails_ranks, rank)
+        previous_in_subsequence.append(tails[k - 1] if k > 0 else -1)
+        if k == len(tails):
+            tails.append(i)
+            tails_ranks.append(rank)
+        else:
+            tails[k] = i
+            tails_ranks[k] = rank
 
-for o_file in common_files:
-    old_syms_by_section = old_syms[o_file]
+    anchors = set()
+    i = tails[-1] if tails else -1
+    while i >= 0:
+        anchors.add(common_syms_names[i])
+        i = previous_in_subsequence[i]
+    return anchors
+
+
+def _get_syms_by_anchor(
+    syms_in_order: List[Tuple[int, str]], anchors: set, unmatched_syms_names: set
+) -> Tuple[Dict[tuple, List[str]], Dict[tuple, List[str]]]:
+    """
+    Goes through the symbols of a section in address (ram) order, and indexes
+    the `unmatched_syms_names` symbols by their offset from the previous anchor
+    symbol and by their distance to the next anchor symbol
+
+    Returns ({(anchor, offset from anchor): [symbol names]},
+    {(anchor, offset to anchor): [symbol names]}). Symbols before the first anchor
+    are indexed by their address, with a None anchor.
+    """
+    syms_by_previous_anchor = dict()
+    syms_by_next_anchor = dict()
+    previous_anchor = None
+    previous_anchor_address = 0
+    # the unmatched symbols since the previous anchor
+    pending_syms = []
+    for address, sym_name in syms_in_order:
+        if sym_name in anchors:
+            for pending_address, pending_sym_name in pending_syms:
+                syms_by_next_anchor.setdefault(
+                    (sym_name, address - pending_address), []
+                ).append(pending_sym_name)
+            pending_syms = []
+            previous_anchor = sym_name
+            previous_anchor_address = address
+        elif sym_name in unmatched_syms_names:
+            syms_by_previous_anchor.setdefault(
+                (previous_anchor, address - previous_anchor_address), []
+            ).append(sym_name)
+            pending_syms.append((address, sym_name))
+    return syms_by_previous_anchor, syms_by_next_anchor
+
+
+def align_renamed_syms(
+    old_syms_syms: dict,
+    new_syms_syms: dict,
+    removed_syms_names: Iterable[str],
+    new_syms_names: Iterable[str],
+) -> Dict[str, str]:
+    """
+    Finds renamed symbols in a section whose symbols may have moved,
+    such as after a code size change before them
+
+    The symbols whose names are in both the old and new section, in the same order
+    (see `get_anchor_syms`), are used as anchors: a removed symbol and a new symbol
+    at the same offset from the previous anchor (or else, to the next anchor)
+    are considered renamed. This is done in a single pass over each section's
+    symbols in address order.
+    Several removed symbols at the same offset are only matched if there are
+    as many new symbols at that offset, in address order.
+
+    Returns {removed symbol: new symbol}
+    """
+    if not removed_syms_names or not new_syms_names:
+        return dict()
+
+    old_syms_in_order = _get_syms_in_address_order(old_syms_syms)
+    new_syms_in_order = _get_syms_in_address_order(new_syms_syms)
+    anchors = get_anchor_syms(old_syms_in_order, new_syms_in_order)
+    old_syms_by_anchor = _get_syms_by_anchor(
+        old_syms_in_order, anchors, set(removed_syms_names)
+    )
+    new_syms_by_anchor = _get_syms_by_anchor(
+        new_syms_in_order, anchors, set(new_syms_names)
+    )
+
+    renamed_syms_names = dict()
+    renamed_to_syms_names = set()
+    for old_syms_by_key, new_syms_by_key in zip(
+        old_syms_by_anchor, new_syms_by_anchor
+    ):
+        for key, old_syms_names in old_syms_by_key.items():
+            new_syms_names_at_key = new_syms_by_key.get(key)
+            if new_syms_names_at_key is None:
+                continue
+            old_syms_names = [v for v in old_syms_names if v not in renamed_syms_names]
+            new_syms_names_at_key = [
+                v for v in new_syms_names_at_key if v not in renamed_to_syms_names
+            ]
+            # leave ambiguous renames to the matching by address
+            if len(old_syms_names) != len(new_syms_names_at_key):
+                continue
+            for old_sym_name, new_sym_name in zip(
+                old_syms_names, new_syms_names_at_key
+            ):
+                renamed_syms_names[old_sym_name] = new_sym_name
+                renamed_to_syms_names.add(new_sym_name)
+    return renamed_syms_names
+
+
+def compare_objfile_syms(
+    o_file: str,
+    old_syms_by_section: dict,
+    new_syms_by_section: dict,
+    consider_if_used: bool = True,
+) -> Optional[dict]:
+    """
+    Compares the symbols of .o file `o_file` from the old and new syms.json
+
+    Returns the changes by section, or None if there are no changes
+    """
     assert isinstance(old_syms_by_section, dict)
-    new_syms_by_section = new_syms[o_file]
     assert isinstance(new_syms_by_section, dict)
 
     if old_syms_by_section == new_syms_by_section:
-        continue
+        return None
 
     file_changed_syms = dict()
-    changed_syms[o_file] = file_changed_syms
 
     if new_syms_by_section.keys() != old_syms_by_section.keys():
         file_changed_syms["sections"] = {
@@ -85,9 +360,59 @@ for o_file in common_files:
                 removed_syms_names = [
                     v for v in removed_syms_names if old_syms_syms[v]["used"]
                 ]
-            renamed_syms_names = dict()
 
-            for removed_sym_name in removed_syms_names.copy():
+            # the symbols that kept their name but not their address
+            moved_syms_names = {
+                sym_name
+                for sym_name, new_sym_info in new_syms_syms.items()
+                if sym_name in old_syms_syms
+                and old_syms_syms[sym_name] != new_sym_info
+                and (
+                    old_syms_syms[sym_name]["ram"] != new_sym_info["ram"]
+                    or old_syms_syms[sym_name]["rom"] != new_sym_info["rom"]
+                )
+            }
+
+            if moved_syms_names:
+                # first align the symbols around the symbols that kept their name,
+                # which finds renamed symbols even if their address changed
+                # (otherwise, renamed symbols are at the same address)
+                renamed_syms_names = align_renamed_syms(
+                    old_syms_syms, new_syms_syms, removed_syms_names, new_syms_names
+                )
+            else:
+                renamed_syms_names = dict()
+            renamed_to_syms_names = set(renamed_syms_names.values())
+
+            # then look for the other renamed symbols by address
+
+            # index the new symbols by address,
+            # to find renamed symbols without going through all new symbols each time
+            # (leaving out the symbols that kept their name but moved, that are now
+            # at the address of another symbol)
+            new_syms_names_by_address = {"ram": dict(), "rom": dict()}
+            for new_sym_name, new_sym_name_info in new_syms_syms.items():
+                if consider_if_used and not new_sym_name_info["used"]:
+                    continue
+                if (
+                    new_sym_name in renamed_to_syms_names
+                    or new_sym_name in moved_syms_names
+                ):
+                    continue
+                for (
+                    comp_info_key,
+                    names_by_address,
+                ) in new_syms_names_by_address.items():
+                    address = new_sym_name_info[comp_info_key]
+                    if address is not None:
+                        names_by_address.setdefault(address, []).append(new_sym_name)
+
+            new_syms_names_left = set(new_syms_names) - renamed_to_syms_names
+            renamed_removed_syms_names = set(renamed_syms_names.keys())
+
+            for removed_sym_name in removed_syms_names:
+                if removed_sym_name in renamed_removed_syms_names:
+                    continue
                 removed_sym_name_info = old_syms_syms[removed_sym_name]
                 if consider_if_used and not removed_sym_name_info["used"]:
                     continue
@@ -103,59 +428,57 @@ for o_file in common_files:
                     )
                     comp_info_key = "rom"
                 found_new_candidate = False
-                for (
-                    new_sym_name_candidate,
-                    new_sym_name_candidate_info,
-                ) in new_syms_syms.items():
-                    if consider_if_used and not new_sym_name_candidate_info["used"]:
+                for new_sym_name_candidate in new_syms_names_by_address[
+                    comp_info_key
+                ].get(removed_sym_name_info[comp_info_key], ()):
+                    if found_new_candidate:
+                        print(
+                            "Found other new candidate symbol for renaming",
+                            removed_sym_name,
+                        )
+                        if isinstance(renamed_syms_names[removed_sym_name], str):
+                            renamed_syms_names[removed_sym_name] = [
+                                renamed_syms_names[removed_sym_name]
+                            ]
+                        renamed_syms_names[removed_sym_name].append(
+                            new_sym_name_candidate
+                        )
                         continue
-                    if (
-                        removed_sym_name_info[comp_info_key]
-                        == new_sym_name_candidate_info[comp_info_key]
-                    ):
-                        if found_new_candidate:
-                            print(
-                                "Found other new candidate symbol for renaming",
-                                removed_sym_name,
-                            )
-                            if isinstance(renamed_syms_names[removed_sym_name], str):
-                                renamed_syms_names[removed_sym_name] = [
-                                    renamed_syms_names[removed_sym_name]
-                                ]
-                            renamed_syms_names[removed_sym_name].append(
-                                removed_sym_name
-                            )
-                            continue
-                        found_new_candidate = True
-                        renamed_syms_names[removed_sym_name] = new_sym_name_candidate
-                        removed_syms_names.remove(removed_sym_name)
-                        try:
-                            new_syms_names.remove(new_sym_name_candidate)
-                        except ValueError:  # not in list
-                            print(
-                                "Found that old symbol",
-                                removed_sym_name,
-                                removed_sym_name_info,
-                            )
-                            print(
-                                "was renamed to",
-                                new_sym_name_candidate,
-                                new_sym_name_candidate_info,
-                            )
-                            print(
-                                "But",
-                                new_sym_name_candidate,
-                                "already was a symbol? not in the new syms list",
-                            )
-                            print("Or other old symbols already map to this symbol:")
-                            print(
-                                [
-                                    from_sym
-                                    for from_sym, to_sym in renamed_syms_names.items()
-                                    if to_sym == new_sym_name_candidate
-                                ]
-                            )
-                            print("Continuing...")
+                    found_new_candidate = True
+                    renamed_syms_names[removed_sym_name] = new_sym_name_candidate
+                    renamed_removed_syms_names.add(removed_sym_name)
+                    if new_sym_name_candidate in new_syms_names_left:
+                        new_syms_names_left.remove(new_sym_name_candidate)
+                    else:
+                        print(
+                            "Found that old symbol",
+                            removed_sym_name,
+                            removed_sym_name_info,
+                        )
+                        print(
+                            "was renamed to",
+                            new_sym_name_candidate,
+                            new_syms_syms[new_sym_name_candidate],
+                        )
+                        print(
+                            "But",
+                            new_sym_name_candidate,
+                            "already was a symbol? not in the new syms list",
+                        )
+                        print("Or other old symbols already map to this symbol:")
+                        print(
+                            [
+                                from_sym
+                                for from_sym, to_sym in renamed_syms_names.items()
+                                if to_sym == new_sym_name_candidate
+                            ]
+                        )
+                        print("Continuing...")
+
+            removed_syms_names = [
+                v for v in removed_syms_names if v not in renamed_removed_syms_names
+            ]
+            new_syms_names = [v for v in new_syms_names if v in new_syms_names_left]
 
             file_changed_syms[section] = {
                 "new": new_syms_names,
@@ -163,47 +486,515 @@ for o_file in common_files:
                 "renamed": renamed_syms_names,
             }
 
+    return file_changed_syms
+
+
+def _get_sym_address_key(sym_info: dict) -> Tuple[str, Optional[str]]:
+    # like for renames in a .o file, compare ram if there is one, rom otherwise
+    if sym_info["ram"] is not None:
+        return ("ram", sym_info["ram"])
+    else:
+        return ("rom", sym_info["rom"])
+
+
+def get_gone_and_arrived_syms(
+    o_file: str,
+    old_syms_by_section: Optional[dict],
+    new_syms_by_section: Optional[dict],
+    file_changed_syms: Optional[dict],
+    consider_if_used: bool = True,
+) -> Tuple[Dict[tuple, dict], Dict[tuple, dict]]:
+    """
+    Collects the symbols left unexplained by the comparison of .o file `o_file`
+    (`file_changed_syms` from `compare_objfile_syms`), for `find_moved_syms`:
+    all symbols of removed (None new symbols) and new (None old symbols) .o files,
+    of removed and new sections, and the removed and new symbols.
+
+    Returns the gone and arrived symbols, as {(o_file, section, symbol name): info}
+    """
+    gone_syms = dict()
+    arrived_syms = dict()
+
+    def add_syms(syms, syms_by_section, sections):
+        for section in sections:
+            for sym_name, sym_info in syms_by_section[section].items():
+                if consider_if_used and not sym_info["used"]:
+                    continue
+                syms[(o_file, section, sym_name)] = sym_info
+
+    if new_syms_by_section is None:
+        add_syms(gone_syms, old_syms_by_section, old_syms_by_section.keys())
+        return gone_syms, arrived_syms
+    if old_syms_by_section is None:
+        add_syms(arrived_syms, new_syms_by_section, new_syms_by_section.keys())
+        return gone_syms, arrived_syms
+    if file_changed_syms is None:
+        return gone_syms, arrived_syms
+
+    if "sections" in file_changed_syms:
+        add_syms(
+            gone_syms, old_syms_by_section, file_changed_syms["sections"]["removed"]
+        )
+        add_syms(
+            arrived_syms, new_syms_by_section, file_changed_syms["sections"]["new"]
+        )
+    for section, changes_in_section in file_changed_syms.items():
+        if section == "sections":
+            continue
+        for sym_name in changes_in_section["removed"]:
+            gone_syms[(o_file, section, sym_name)] = old_syms_by_section[section][
+                sym_name
+            ]
+        for sym_name in changes_in_section["new"]:
+            arrived_syms[(o_file, section, sym_name)] = new_syms_by_section[section][
+                sym_name
+            ]
+    return gone_syms, arrived_syms
+
+
+def find_moved_syms(
+    gone_syms: Dict[tuple, dict],
+    arrived_syms: Dict[tuple, dict],
+    changes: dict,
+):
+    """
+    Finds symbols that moved between .o files, and .o files that were renamed,
+    from the symbols left unexplained by the per-.o file comparison in `changes`
+    (see `get_gone_and_arrived_syms`).
+
+    Old symbols that disappeared from their .o file are matched by name
+    (moved symbol) or else by address (moved and renamed symbol)
+    against new symbols that appeared in another .o file, using indexes
+    over all .o files instead of comparing all pairs.
+
+    A removed .o file whose symbols mostly went to a single new .o file
+    is considered renamed to it.
+
+    Updates `changes` in place:
+    - adds changes["files"]["renamed"] as {old o_file: new o_file},
+        and takes renamed files out of the new and removed files
+    - adds changes["moved"] as
+        {old o_file: {new o_file: {section: {"moved": [...], "renamed": {...}}}}}
+        (symbols that moved along with a renamed file are not listed in "moved")
+    - takes the symbols that moved out of the new and removed symbols
+    """
+
+    # index the arrived symbols by name and by address
+    arrived_syms_by_name = dict()
+    arrived_syms_by_address = dict()
+    for arrived_sym, sym_info in arrived_syms.items():
+        o_file, section, sym_name = arrived_sym
+        arrived_syms_by_name.setdefault(sym_name, []).append(arrived_sym)
+        for comp_info_key in ("ram", "rom"):
+            if sym_info[comp_info_key] is not None:
+                arrived_syms_by_address.setdefault(
+                    (section, comp_info_key, sym_info[comp_info_key]), []
+                ).append(arrived_sym)
+
+    matched_arrived_syms = set()
+    # (gone symbol, arrived symbol) pairs
+    moves = []
+
+    def find_match(gone_sym, candidates):
+        gone_o_file, gone_section, _ = gone_sym
+        best = None
+        for arrived_sym in candidates:
+            if arrived_sym[0] == gone_o_file or arrived_sym in matched_arrived_syms:
+                continue
+            if arrived_sym[1] == gone_section:
+                return arrived_sym
+            if best is None:
+                best = arrived_sym
+        return best
+
+    unmatched_gone_syms = []
+    for gone_sym in gone_syms:
+        arrived_sym = find_match(gone_sym, arrived_syms_by_name.get(gone_sym[2], ()))
+        if arrived_sym is None:
+            unmatched_gone_syms.append(gone_sym)
+        else:
+            matched_arrived_syms.add(arrived_sym)
+            moves.append((gone_sym, arrived_sym))
+    for gone_sym in unmatched_gone_syms:
+        o_file, section, sym_name = gone_sym
+        comp_info_key, address = _get_sym_address_key(gone_syms[gone_sym])
+        arrived_sym = find_match(
+            gone_sym,
+            arrived_syms_by_address.get((section, comp_info_key, address), ()),
+        )
+        if arrived_sym is not None:
+            matched_arrived_syms.add(arrived_sym)
+            moves.append((gone_sym, arrived_sym))
+
+    # find renamed files
+
+    removed_o_files = set(changes["files"]["removed"])
+    new_o_files = set(changes["files"]["new"])
+    # all the symbols of removed .o files are gone symbols
+    n_syms_by_removed_o_file = dict()
+    for o_file, _, _ in gone_syms:
+        if o_file in removed_o_files:
+            n_syms_by_removed_o_file[o_file] = (
+                n_syms_by_removed_o_file.get(o_file, 0) + 1
+            )
+    moves_count_by_files = dict()
+    for (gone_o_file, _, _), (arrived_o_file, _, _) in moves:
+        if gone_o_file in removed_o_files and arrived_o_file in new_o_files:
+            files = (gone_o_file, arrived_o_file)
+            moves_count_by_files[files] = moves_count_by_files.get(files, 0) + 1
+
+    renamed_o_files = dict()
+    renamed_to_o_files = set()
+    for (gone_o_file, arrived_o_file), moves_count in sorted(
+        moves_count_by_files.items(), key=lambda item: item[1], reverse=True
+    ):
+        if gone_o_file in renamed_o_files or arrived_o_file in renamed_to_o_files:
+            continue
+        if moves_count * 2 >= n_syms_by_removed_o_file[gone_o_file]:
+            renamed_o_files[gone_o_file] = arrived_o_file
+            renamed_to_o_files.add(arrived_o_file)
+
+    changes["files"]["new"] = [
+        o_file for o_file in changes["files"]["new"] if o_file not in renamed_to_o_files
+    ]
+    changes["files"]["removed"] = [
+        o_file
+        for o_file in changes["files"]["removed"]
+        if o_file not in renamed_o_files
+    ]
+    changes["files"]["renamed"] = renamed_o_files
+
+    # list moved symbols
+
+    moved_syms = dict()
+    moved_gone_syms_by_o_file_section = dict()
+    moved_arrived_syms_by_o_file_section = dict()
+    for gone_sym, arrived_sym in moves:
+        gone_o_file, gone_section, gone_sym_name = gone_sym
+        arrived_o_file, arrived_section, arrived_sym_name = arrived_sym
+        moved_gone_syms_by_o_file_section.setdefault(
+            (gone_o_file, gone_section), set()
+        ).add(gone_sym_name)
+        moved_arrived_syms_by_o_file_section.setdefault(
+            (arrived_o_file, arrived_section), set()
+        ).add(arrived_sym_name)
+        if gone_sym_name == arrived_sym_name:
+            if renamed_o_files.get(gone_o_file) == arrived_o_file:
+                # moved along with its file
+                continue
+            changes_in_section = (
+                moved_syms.setdefault(gone_o_file, dict())
+                .setdefault(arrived_o_file, dict())
+                .setdefault(arrived_section, {"moved": [], "renamed": dict()})
+            )
+            changes_in_section["moved"].append(gone_sym_name)
+        else:
+            changes_in_section = (
+                moved_syms.setdefault(gone_o_file, dict())
+                .setdefault(arrived_o_file, dict())
+                .setdefault(arrived_section, {"moved": [], "renamed": dict()})
+            )
+            changes_in_section["renamed"][gone_sym_name] = arrived_sym_name
+    changes["moved"] = moved_syms
+
+    # take moved symbols out of the symbols changes
+
+    for o_file, file_changed_syms in changes["symbols"].items():
+        for section, changes_in_section in file_changed_syms.items():
+            if section == "sections":
+                continue
+            moved_gone_syms = moved_gone_syms_by_o_file_section.get(
+                (o_file, section)
+            )
+            if moved_gone_syms:
+                changes_in_section["removed"] = [
+                    sym_name
+                    for sym_name in changes_in_section["removed"]
+                    if sym_name not in moved_gone_syms
+                ]
+            moved_arrived_syms = moved_arrived_syms_by_o_file_section.get(
+                (o_file, section)
+            )
+            if moved_arrived_syms:
+                changes_in_section["new"] = [
+                    sym_name
+                    for sym_name in changes_in_section["new"]
+                    if sym_name not in moved_arrived_syms
+                ]
+
+
+def _compare_objfiles_syms(
+    compare_args: List[Tuple[str, dict, dict, bool]]
+) -> List[Tuple[str, Optional[dict], Dict[tuple, dict], Dict[tuple, dict]]]:
+    """
+    Compares the symbols of a batch of .o files
+
+    Returns (o_file, changes, gone symbols, arrived symbols) for each .o file
+    """
+    results = []
+    for o_file, old_syms_by_section, new_syms_by_section, consider_if_used in (
+        compare_args
+    ):
+        file_changed_syms = compare_objfile_syms(
+            o_file, old_syms_by_section, new_syms_by_section, consider_if_used
+        )
+        results.append(
+            (o_file, file_changed_syms)
+            + get_gone_and_arrived_syms(
+                o_file,
+                old_syms_by_section,
+                new_syms_by_section,
+                file_changed_syms,
+                consider_if_used,
+            )
+        )
+    return results
+
+
+def _count_syms(syms_by_section: dict) -> int:
+    return sum(map(len, syms_by_section.values()))
+
 
-print(changes)
+def compare_syms_iter(
+    old_syms_items: Iterable[Tuple[str, dict]],
+    new_syms_items: Iterable[Tuple[str, dict]],
+    consider_if_used: bool = True,
+    processes: Optional[int] = None,
+    mp_context: Optional[multiprocessing.context.BaseContext] = None,
+) -> dict:
+    """
+    Compares two syms.json documents, given as (o_file, symbols by section) items
+    (like from `iter_syms`), reading them one .o file at a time (see `walk_syms`)
 
-if not args.output_dir_path.exists():
-    args.output_dir_path.mkdir()
+    Returns the changes, as written to changelog.json:
+    {
+        "files": {"new": [...], "removed": [...], "renamed": {...}},
+        "symbols": {
+            o_file: {section: {"new": [...], "removed": [...], "renamed": {...}}},
+        },
+        "moved": {
+            o_file: {o_file: {section: {"moved": [...], "renamed": {...}}}},
+        },
+    }
 
-with open(args.output_dir_path / "changelog.json", "w") as f:
-    json.dump(changes, f)
+    When comparing many .o files, they are spread across a pool of `processes`
+    processes (defaults to the amount of CPUs), unless `processes` is 1,
+    started with `mp_context` (see `concurrent.futures.ProcessPoolExecutor`)
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
 
-with open(args.output_dir_path / "changelog.md", "w") as f:
+    new_o_files = []
+    removed_o_files = []
+    changed_syms = dict()
+    # the symbols of removed and new .o files go first in find_moved_syms
+    files_gone_syms = dict()
+    files_arrived_syms = dict()
+    gone_syms = dict()
+    arrived_syms = dict()
+
+    def add_results(results):
+        for o_file, file_changed_syms, o_file_gone_syms, o_file_arrived_syms in (
+            results
+        ):
+            if file_changed_syms is not None:
+                changed_syms[o_file] = file_changed_syms
+            gone_syms.update(o_file_gone_syms)
+            arrived_syms.update(o_file_arrived_syms)
+
+    with profiling.stage("compare_objfiles"), contextlib.ExitStack() as exit_stack:
+        executor = None
+        futures = collections.deque()
+        compare_args = []
+        n_objfiles_compared = 0
+        for o_file, old_syms_by_section, new_syms_by_section in walk_syms(
+            old_syms_items, new_syms_items
+        ):
+            if profiling.is_profiling():
+                if old_syms_by_section is not None:
+                    profiling.count("old_symbols", _count_syms(old_syms_by_section))
+                if new_syms_by_section is not None:
+                    profiling.count("new_symbols", _count_syms(new_syms_by_section))
+
+            if old_syms_by_section is None or new_syms_by_section is None:
+                if new_syms_by_section is None:
+                    removed_o_files.append(o_file)
+                else:
+                    new_o_files.append(o_file)
+                o_file_gone_syms, o_file_arrived_syms = get_gone_and_arrived_syms(
+                    o_file,
+                    old_syms_by_section,
+                    new_syms_by_section,
+                    None,
+                    consider_if_used,
+                )
+                files_gone_syms.update(o_file_gone_syms)
+                files_arrived_syms.update(o_file_arrived_syms)
+                continue
+
+            n_objfiles_compared += 1
+            compare_args.append(
+                (o_file, old_syms_by_section, new_syms_by_section, consider_if_used)
+            )
+            if processes == 1:
+                add_results(_compare_objfiles_syms(compare_args))
+                compare_args = []
+            elif len(compare_args) >= COMPARE_BATCH_SIZE:
+                if executor is None:
+                    executor = exit_stack.enter_context(
+                        concurrent.futures.ProcessPoolExecutor(
+                            processes, mp_context=mp_context
+                        )
+                    )
+                futures.append(executor.submit(_compare_objfiles_syms, compare_args))
+                compare_args = []
+                # don't read too far ahead of the comparisons
+                while len(futures) > 2 * processes:
+                    add_results(futures.popleft().result())
+        while futures:
+            add_results(futures.popleft().result())
+        add_results(_compare_objfiles_syms(compare_args))
+    profiling.count("objfiles_compared", n_objfiles_compared)
+
+    changes = {
+        "files": {"new": new_o_files, "removed": removed_o_files},
+        "symbols": dict(sorted(changed_syms.items())),
+    }
+
+    with profiling.stage("find_moved_syms"):
+        files_gone_syms.update(gone_syms)
+        files_arrived_syms.update(arrived_syms)
+        find_moved_syms(files_gone_syms, files_arrived_syms, changes)
+
+    return changes
+
+
+def compare_syms(
+    old_syms: dict,
+    new_syms: dict,
+    consider_if_used: bool = True,
+    processes: Optional[int] = None,
+    mp_context: Optional[multiprocessing.context.BaseContext] = None,
+) -> dict:
+    """
+    Compares two syms.json documents (as loaded with `load_syms`),
+    see `compare_syms_iter`
+    """
+    return compare_syms_iter(
+        old_syms.items(), new_syms.items(), consider_if_used, processes, mp_context
+    )
+
+
+class SectionChanges(NamedTuple):
+    section: str
+    new: List[str]
+    removed: List[str]
+    # (name, new name), or (name, [candidate new names]) if ambiguous
+    renamed: List[Tuple[str, Union[str, List[str]]]]
+    moved: List[str]
+
+
+class ObjfileChanges(NamedTuple):
+    o_file: str
+    # the .o file the symbols moved to, for moved symbols
+    to_o_file: Optional[str]
+    sections: List[SectionChanges]
+
+
+class Changelog(NamedTuple):
+    """
+    The changes from `compare_syms`, with only the non-empty changes
+    of .o files and sections, in the order they are rendered
+    """
+
+    changes: dict
+    new_files: List[str]
+    removed_files: List[str]
+    renamed_files: List[Tuple[str, str]]
+    symbols: List[ObjfileChanges]
+    moved: List[ObjfileChanges]
+
+
+def build_changelog(changes: dict) -> Changelog:
+    """
+    Builds the `Changelog` the changelog files are rendered from,
+    from the `changes` from `compare_syms`
+    """
+    symbols = []
+    for o_file, changes_by_section in changes["symbols"].items():
+        sections = [
+            SectionChanges(
+                section,
+                changes_in_section.get("new", []),
+                changes_in_section.get("removed", []),
+                list(changes_in_section.get("renamed", {}).items()),
+                [],
+            )
+            for section, changes_in_section in changes_by_section.items()
+            if any(changes_in_section.values())
+        ]
+        if sections:
+            symbols.append(ObjfileChanges(o_file, None, sections))
+
+    moved = [
+        ObjfileChanges(
+            o_file_from,
+            o_file_to,
+            [
+                SectionChanges(
+                    section,
+                    [],
+                    [],
+                    list(changes_in_section["renamed"].items()),
+                    changes_in_section["moved"],
+                )
+                for section, changes_in_section in changes_by_section.items()
+            ],
+        )
+        for o_file_from, changes_by_o_file_to in changes["moved"].items()
+        for o_file_to, changes_by_section in changes_by_o_file_to.items()
+    ]
+
+    return Changelog(
+        changes,
+        changes["files"]["new"],
+        changes["files"]["removed"],
+        list(changes["files"]["renamed"].items()),
+        symbols,
+        moved,
+    )
+
+
+def render_changelog_json(changelog: Changelog, f: TextIO):
+    json.dump(changelog.changes, f)
+
+
+def render_changelog_md(changelog: Changelog, f: TextIO):
     f.write("# Files\n")
     f.write("## New Files\n")
-    f.writelines(f"- `{o_file}`\n" for o_file in changes["files"]["new"])
+    f.writelines(f"- `{o_file}`\n" for o_file in changelog.new_files)
     f.write("## Removed Files\n")
-    f.writelines(f"- `{o_file}`\n" for o_file in changes["files"]["removed"])
+    f.writelines(f"- `{o_file}`\n" for o_file in changelog.removed_files)
+    f.write("## Renamed Files\n")
+    f.writelines(
+        f"- `{o_file_from}` -> `{o_file_to}`\n"
+        for o_file_from, o_file_to in changelog.renamed_files
+    )
     f.write("# Symbols\n")
-    for o_file, changes_by_section in changes["symbols"].items():
-        if not any(
-            any(changes_in_section.values())
-            for changes_in_section in changes_by_section.values()
-        ):
-            continue
-        f.write(f"## `{o_file}`\n")
-        for section, changes_in_section in changes_by_section.items():
-            if not any(changes_in_section.values()):
-                continue
-            f.write(f"### `{section}`\n")
-            if changes_in_section.get("new"):
-                f.write(f"#### Added\n")
-                f.writelines(
-                    f"- `{change_new_elem}`\n"
-                    for change_new_elem in changes_in_section["new"]
-                )
-            if changes_in_section.get("removed"):
-                f.write(f"#### Removed\n")
+    for objfile_changes in changelog.symbols:
+        f.write(f"## `{objfile_changes.o_file}`\n")
+        for section_changes in objfile_changes.sections:
+            f.write(f"### `{section_changes.section}`\n")
+            if section_changes.new:
+                f.write("#### Added\n")
+                f.writelines(f"- `{sym_name}`\n" for sym_name in section_changes.new)
+            if section_changes.removed:
+                f.write("#### Removed\n")
                 f.writelines(
-                    f"- `{change_new_elem}`\n"
-                    for change_new_elem in changes_in_section["removed"]
+                    f"- `{sym_name}`\n" for sym_name in section_changes.removed
                 )
-            if changes_in_section.get("renamed"):
-                f.write(f"#### Renamed\n")
+            if section_changes.renamed:
+                f.write("#### Renamed\n")
                 f.writelines(
                     f"- `{change_from}` -> `{change_to}`\n"
                     if isinstance(change_to, str)
@@ -214,46 +1005,372 @@ with open(args.output_dir_path / "changelog.md", "w") as f:
                         )
                         + "\n"
                     )
-                    for change_from, change_to in changes_in_section["renamed"].items()
+                    for change_from, change_to in section_changes.renamed
+                )
+    f.write("# Moved Symbols\n")
+    for objfile_changes in changelog.moved:
+        f.write(f"## `{objfile_changes.o_file}` -> `{objfile_changes.to_o_file}`\n")
+        for section_changes in objfile_changes.sections:
+            f.write(f"### `{section_changes.section}`\n")
+            if section_changes.moved:
+                f.write("#### Moved\n")
+                f.writelines(f"- `{sym_name}`\n" for sym_name in section_changes.moved)
+            if section_changes.renamed:
+                f.write("#### Renamed\n")
+                f.writelines(
+                    f"- `{change_from}` -> `{change_to}`\n"
+                    for change_from, change_to in section_changes.renamed
                 )
 
-with open(args.output_dir_path / "changelog.txt", "w") as f:
+
+def render_changelog_txt(changelog: Changelog, f: TextIO):
     f.write("Files\n")
-    f.writelines(f" +{o_file}\n" for o_file in changes["files"]["new"])
-    f.writelines(f" -{o_file}\n" for o_file in changes["files"]["removed"])
+    f.writelines(f" +{o_file}\n" for o_file in changelog.new_files)
+    f.writelines(f" -{o_file}\n" for o_file in changelog.removed_files)
+    f.writelines(
+        f" {o_file_from} -> {o_file_to}\n"
+        for o_file_from, o_file_to in changelog.renamed_files
+    )
     f.write("\n")
     f.write("Symbols\n")
-    for o_file, changes_by_section in changes["symbols"].items():
-        if not any(
-            any(changes_in_section.values())
-            for changes_in_section in changes_by_section.values()
-        ):
-            continue
-        f.write(f" {o_file}\n")
-        for section, changes_in_section in changes_by_section.items():
-            if not any(changes_in_section.values()):
-                continue
-            f.write(f"  {section}\n")
-            if changes_in_section.get("new"):
-                f.writelines(
-                    f"   +{change_new_elem}\n"
-                    for change_new_elem in changes_in_section["new"]
+    for objfile_changes in changelog.symbols:
+        f.write(f" {objfile_changes.o_file}\n")
+        for section_changes in objfile_changes.sections:
+            f.write(f"  {section_changes.section}\n")
+            f.writelines(f"   +{sym_name}\n" for sym_name in section_changes.new)
+            f.writelines(f"   -{sym_name}\n" for sym_name in section_changes.removed)
+            f.writelines(
+                f"   {change_from} -> {change_to}\n"
+                if isinstance(change_to, str)
+                else f"   {change_from} -> ? " + ", ".join(change_to) + "\n"
+                for change_from, change_to in section_changes.renamed
+            )
+    f.write("\n")
+    f.write("Moved symbols\n")
+    for objfile_changes in changelog.moved:
+        f.write(f" {objfile_changes.o_file} -> {objfile_changes.to_o_file}\n")
+        for section_changes in objfile_changes.sections:
+            f.write(f"  {section_changes.section}\n")
+            f.writelines(f"   {sym_name}\n" for sym_name in section_changes.moved)
+            f.writelines(
+                f"   {change_from} -> {change_to}\n"
+                for change_from, change_to in section_changes.renamed
+            )
+
+
+def render_changelog_html(changelog: Changelog, f: TextIO):
+    def write_list(items: Iterable[str]):
+        f.write("<ul>\n")
+        f.writelines(f"<li>{item}</li>\n" for item in items)
+        f.write("</ul>\n")
+
+    def code(name: str) -> str:
+        return f"<code>{html.escape(name)}</code>"
+
+    def format_renamed(change_from: str, change_to: Union[str, List[str]]) -> str:
+        if isinstance(change_to, str):
+            return f"{code(change_from)} -&gt; {code(change_to)}"
+        return f"{code(change_from)} -&gt; ? " + ", ".join(map(code, change_to))
+
+    f.write(
+        "<!DOCTYPE html>\n"
+        '<html>\n<head>\n<meta charset="utf-8">\n<title>Changelog</title>\n'
+        "</head>\n<body>\n"
+    )
+    f.write("<h1>Files</h1>\n")
+    f.write("<h2>New Files</h2>\n")
+    write_list(map(code, changelog.new_files))
+    f.write("<h2>Removed Files</h2>\n")
+    write_list(map(code, changelog.removed_files))
+    f.write("<h2>Renamed Files</h2>\n")
+    write_list(
+        f"{code(o_file_from)} -&gt; {code(o_file_to)}"
+        for o_file_from, o_file_to in changelog.renamed_files
+    )
+    f.write("<h1>Symbols</h1>\n")
+    for objfile_changes in changelog.symbols:
+        f.write(f"<h2>{code(objfile_changes.o_file)}</h2>\n")
+        for section_changes in objfile_changes.sections:
+            f.write(f"<h3>{code(section_changes.section)}</h3>\n")
+            if section_changes.new:
+                f.write("<h4>Added</h4>\n")
+                write_list(map(code, section_changes.new))
+            if section_changes.removed:
+                f.write("<h4>Removed</h4>\n")
+                write_list(map(code, section_changes.removed))
+            if section_changes.renamed:
+                f.write("<h4>Renamed</h4>\n")
+                write_list(
+                    format_renamed(change_from, change_to)
+                    for change_from, change_to in section_changes.renamed
                 )
-            if changes_in_section.get("removed"):
-                f.writelines(
-                    f"   -{change_new_elem}\n"
-                    for change_new_elem in changes_in_section["removed"]
+    f.write("<h1>Moved Symbols</h1>\n")
+    for objfile_changes in changelog.moved:
+        f.write(
+            f"<h2>{code(objfile_changes.o_file)}"
+            f" -&gt; {code(objfile_changes.to_o_file)}</h2>\n"
+        )
+        for section_changes in objfile_changes.sections:
+            f.write(f"<h3>{code(section_changes.section)}</h3>\n")
+            if section_changes.moved:
+                f.write("<h4>Moved</h4>\n")
+                write_list(map(code, section_changes.moved))
+            if section_changes.renamed:
+                f.write("<h4>Renamed</h4>\n")
+                write_list(
+                    format_renamed(change_from, change_to)
+                    for change_from, change_to in section_changes.renamed
                 )
-            if changes_in_section.get("renamed"):
-                f.writelines(
-                    f"   {change_from} -> {change_to}\n"
-                    if isinstance(change_to, str)
-                    else (
-                        f"   {change_from} -> ? "
-                        + ", ".join(
-                            f"{change_to_elem}" for change_to_elem in change_to
-                        )
-                        + "\n"
-                    )
-                    for change_from, change_to in changes_in_section["renamed"].items()
+    f.write("</body>\n</html>\n")
+
+
+def render_changelog_csv(changelog: Changelog, f: TextIO):
+    """
+    One row per change:
+    kind (file, symbol, moved), change (new, removed, renamed, moved),
+    .o file, new .o file (renamed files, moved symbols), section,
+    symbol, new symbol name (renamed symbols)
+
+    Ambiguous symbol renames are listed as one "renamed?" row per candidate
+    """
+    writer = csv.writer(f, lineterminator="\n")
+    writer.writerow(
+        ("kind", "change", "o_file", "to_o_file", "section", "symbol", "to_symbol")
+    )
+
+    def renamed_rows(kind, o_file, to_o_file, section_changes: SectionChanges):
+        for change_from, change_to in section_changes.renamed:
+            if isinstance(change_to, str):
+                yield (
+                    kind,
+                    "renamed",
+                    o_file,
+                    to_o_file,
+                    section_changes.section,
+                    change_from,
+                    change_to,
                 )
+            else:
+                for change_to_elem in change_to:
+                    yield (
+                        kind,
+                        "renamed?",
+                        o_file,
+                        to_o_file,
+                        section_changes.section,
+                        change_from,
+                        change_to_elem,
+                    )
+
+    writer.writerows(
+        ("file", "new", o_file, "", "", "", "") for o_file in changelog.new_files
+    )
+    writer.writerows(
+        ("file", "removed", o_file, "", "", "", "")
+        for o_file in changelog.removed_files
+    )
+    writer.writerows(
+        ("file", "renamed", o_file_from, o_file_to, "", "", "")
+        for o_file_from, o_file_to in changelog.renamed_files
+    )
+    for objfile_changes in changelog.symbols:
+        o_file = objfile_changes.o_file
+        for section_changes in objfile_changes.sections:
+            section = section_changes.section
+            writer.writerows(
+                ("symbol", "new", o_file, "", section, sym_name, "")
+                for sym_name in section_changes.new
+            )
+            writer.writerows(
+                ("symbol", "removed", o_file, "", section, sym_name, "")
+                for sym_name in section_changes.removed
+            )
+            writer.writerows(renamed_rows("symbol", o_file, "", section_changes))
+    for objfile_changes in changelog.moved:
+        o_file, to_o_file = objfile_changes.o_file, objfile_changes.to_o_file
+        for section_changes in objfile_changes.sections:
+            section = section_changes.section
+            writer.writerows(
+                ("moved", "moved", o_file, to_o_file, section, sym_name, "")
+                for sym_name in section_changes.moved
+            )
+            writer.writerows(renamed_rows("moved", o_file, to_o_file, section_changes))
+
+
+# format: (file name, renderer)
+CHANGELOG_FORMATS: Dict[str, Tuple[str, Callable[[Changelog, TextIO], None]]] = {
+    "json": ("changelog.json", render_changelog_json),
+    "md": ("changelog.md", render_changelog_md),
+    "txt": ("changelog.txt", render_changelog_txt),
+    "html": ("changelog.html", render_changelog_html),
+    "csv": ("changelog.csv", render_changelog_csv),
+}
+
+DEFAULT_CHANGELOG_FORMATS = ("json", "md", "txt")
+
+
+def _render_changelog_file(changelog: Changelog, format: str, output_dir_path: Path):
+    file_name, render = CHANGELOG_FORMATS[format]
+    with open(output_dir_path / file_name, "w") as f:
+        render(changelog, f)
+
+
+def write_changelog(
+    changes: dict,
+    output_dir_path: Path,
+    formats: Iterable[str] = DEFAULT_CHANGELOG_FORMATS,
+):
+    """
+    Writes the `changes` from `compare_syms` to changelog files
+    in `output_dir_path`, one per format of `formats` (see `CHANGELOG_FORMATS`,
+    by default changelog.json, changelog.md and changelog.txt)
+
+    The files are rendered concurrently from one `Changelog` (see `build_changelog`)
+    """
+    formats = list(formats)
+    for format in formats:
+        if format not in CHANGELOG_FORMATS:
+            raise Exception("Unknown changelog format", format)
+
+    if not output_dir_path.exists():
+        output_dir_path.mkdir()
+
+    changelog = build_changelog(changes)
+
+    if len(formats) <= 1:
+        for format in formats:
+            _render_changelog_file(changelog, format, output_dir_path)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(len(formats)) as executor:
+        futures = [
+            executor.submit(_render_changelog_file, changelog, format, output_dir_path)
+            for format in formats
+        ]
+        for future in futures:
+            future.result()
+
+
+def gen_changelog(
+    old_syms_json_path: Path,
+    new_syms_json_path: Path,
+    output_dir_path: Path,
+    processes: Optional[int] = None,
+    formats: Iterable[str] = DEFAULT_CHANGELOG_FORMATS,
+    mp_context: Optional[multiprocessing.context.BaseContext] = None,
+) -> dict:
+    """
+    Compares the syms.json files and writes the changelog files in `output_dir_path`,
+    in the `formats` (see `write_changelog`)
+
+    `processes` and `mp_context` are for the process pool, see `compare_syms_iter`
+
+    Returns the changes
+    """
+    with profiling.stage("compare_syms"):
+        changes = compare_syms_iter(
+            iter_syms(old_syms_json_path),
+            iter_syms(new_syms_json_path),
+            processes=processes,
+            mp_context=mp_context,
+        )
+    with profiling.stage("write_changelog"):
+        write_changelog(changes, output_dir_path, formats)
+
+    if profiling.is_profiling():
+        count_changes(changes, output_dir_path, formats)
+
+    return changes
+
+
+def count_changes(
+    changes: dict,
+    output_dir_path: Path,
+    formats: Iterable[str] = DEFAULT_CHANGELOG_FORMATS,
+):
+    """
+    Adds the amounts of changes to the profiling counters
+    """
+    for change_type in ("new", "removed", "renamed"):
+        profiling.count(f"files_{change_type}", len(changes["files"][change_type]))
+        profiling.count(
+            f"symbols_{change_type}",
+            sum(
+                len(changes_in_section.get(change_type, ()))
+                for changes_by_section in changes["symbols"].values()
+                for changes_in_section in changes_by_section.values()
+            ),
+        )
+    profiling.count(
+        "symbols_moved",
+        sum(
+            len(changes_in_section["moved"]) + len(changes_in_section["renamed"])
+            for changes_by_o_file_to in changes["moved"].values()
+            for changes_by_section in changes_by_o_file_to.values()
+            for changes_in_section in changes_by_section.values()
+        ),
+    )
+    for format in formats:
+        file_name, _ = CHANGELOG_FORMATS[format]
+        profiling.count("bytes_written", (output_dir_path / file_name).stat().st_size)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "old_syms_json_path",
+        help="Path to .json (or .bin symbol database) with old symbols",
+        type=Path,
+    )
+    parser.add_argument(
+        "new_syms_json_path",
+        help="Path to .json (or .bin symbol database) with new symbols",
+        type=Path,
+    )
+    parser.add_argument(
+        "output_dir_path",
+        help="Path to directory to write output files into",
+        type=Path,
+    )
+    parser.add_argument(
+        "-j",
+        "--processes",
+        help="Amount of processes to compare .o files with (default: amount of CPUs)",
+        type=int,
+    )
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        choices=CHANGELOG_FORMATS.keys(),
+        default=DEFAULT_CHANGELOG_FORMATS,
+        metavar="FORMAT",
+        help=(
+            "Changelog files to write, among "
+            + ", ".join(CHANGELOG_FORMATS.keys())
+            + " (default: "
+            + " ".join(DEFAULT_CHANGELOG_FORMATS)
+            + ")"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        metavar="REPORT_PATH",
+        help="Write a json report of how long each stage took, memory and counters",
+    )
+    args = parser.parse_args()
+
+    with profiling.profile("gen_changelog", args.profile):
+        changes = gen_changelog(
+            args.old_syms_json_path,
+            args.new_syms_json_path,
+            args.output_dir_path,
+            processes=args.processes,
+            formats=args.formats,
+        )
+
+    print(changes)
+
+
+if __name__ == "__main__":
+    main()
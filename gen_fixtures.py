@@ -0,0 +1,396 @@
+#!/bin/env python3
+
+# SPDX-License-Identifier: CC0-1.0 OR Unlicense
+
+# Generates synthetic data looking like decomp's, for benchmarks
+# (no decomp build needed): map files, header trees and pairs of syms.json files
+
+import argparse
+import json
+from pathlib import Path
+import random
+
+from typing import Tuple, List, Iterator, Generator
+
+# (.o file path prefix, relative weight)
+OBJFILE_KINDS = (
+    ("build/src/boot/", 2),
+    ("build/src/code/", 20),
+    ("build/src/libultra/", 10),
+    ("build/src/overlays/actors/ovl_", 30),
+    ("build/src/overlays/effects/ovl_Effect_Ss_", 5),
+    ("build/src/elf_message/", 1),
+    ("build/assets/scenes/", 10),
+    ("build/assets/objects/object_", 15),
+    ("build/assets/textures/", 3),
+    ("build/data/", 4),
+)
+
+HEADERS_FOLDERS = ("assets", "include", "src")
+
+
+def _format_input_section_line(section: str, ram: int, size: int, objfile: str):
+    size_str = f"0x{size:x}"
+    return f" {section:<14} 0x{ram:016x} {size_str:>10} {objfile}\n"
+
+
+def _format_symbol_line(ram: int, symbol: str):
+    return f"                0x{ram:016x}                {symbol}\n"
+
+
+def _iter_segment_lines(
+    rng: random.Random,
+    segment_name: str,
+    objfiles: List[str],
+    ram: int,
+    rom: int,
+) -> Generator[str, None, Tuple[int, int]]:
+    """
+    Yields the map lines of a segment at `ram` and `rom`
+
+    Returns the ram and rom addresses after the segment
+    """
+    load_address_line = f"0x{ram:016x}     0x1000 load address 0x{rom:016x}\n"
+    if len(segment_name) >= 15:
+        # long names are put alone on their line
+        yield f"{segment_name}\n"
+        yield f"                {load_address_line}"
+    else:
+        yield f"{segment_name:<15} {load_address_line}"
+    segment_symbol_name = segment_name[2:]
+    yield _format_symbol_line(ram, f"_{segment_symbol_name}SegmentStart = .")
+    has_input_sections = False
+    for objfile in objfiles:
+        if rng.random() < 0.1:
+            sections = (".bss",)
+        else:
+            sections = tuple(
+                section
+                for section in (".text", ".data", ".rodata", ".bss")
+                if rng.random() < 0.8
+            )
+        for section in sections:
+            yield f" {objfile}({section})\n"
+            symbols = []
+            size = 0
+            for _ in range(rng.randrange(0, 25)):
+                symbol_ram = ram + size
+                if section == ".text":
+                    symbol = f"func_{symbol_ram:08X}"
+                elif section == ".bss":
+                    symbol = f"B_{symbol_ram:08X}"
+                else:
+                    symbol = f"D_{symbol_ram:08X}"
+                symbols.append((symbol_ram, symbol))
+                size += rng.randrange(1, 16) * 4
+            if section == ".bss" and has_input_sections and rng.random() < 0.1:
+                # COMMON symbols end up in the previous input section
+                yield _format_input_section_line("COMMON", ram, size, objfile)
+            else:
+                yield _format_input_section_line(section, ram, size, objfile)
+            has_input_sections = True
+            for symbol_ram, symbol in symbols:
+                yield _format_symbol_line(symbol_ram, symbol)
+                if rng.random() < 0.01:
+                    yield _format_symbol_line(symbol_ram, f"{symbol}_end = .")
+            if rng.random() < 0.2:
+                yield f" *fill*         0x{ram + size:016x}        0x4 \n"
+                size += 4
+            ram += size
+            if section != ".bss":
+                rom += size
+        yield _format_input_section_line(".pdr", 0, 0x40, objfile)
+    yield _format_symbol_line(rom, f"_{segment_symbol_name}SegmentRomEnd = .")
+    yield "\n"
+    return ram, rom
+
+
+def iter_map_lines(
+    n_objfiles: int, seed: int = 0, n_debug_lines: int = 10_000
+) -> Iterator[str]:
+    """
+    Yields the lines of a map file looking like decomp's, with `n_objfiles` .o files
+    in segments with a load address (some with long names wrapped on two lines),
+    .bss-only .o files, `entrypoint`, overlays and elf_message,
+    followed by `n_debug_lines` lines of debug sections
+    """
+    rng = random.Random(seed)
+
+    yield "Archive member included to satisfy reference by file (symbol)\n"
+    yield "\n"
+    yield "Memory Configuration\n"
+    yield "\n"
+    yield "Name             Origin             Length             Attributes\n"
+    yield "*default*        0x0000000000000000 0xffffffffffffffff\n"
+    yield "\n"
+    yield "Linker script and memory map\n"
+    yield "\n"
+    yield "LOAD build/src/boot/boot_main.o\n"
+    yield "LOAD build/src/code/z_actor.o\n"
+    yield "                0x0000000000000000                _RomSize = 0x0\n"
+    yield "\n"
+    yield "..makerom        0x0000000000000000     0x1060\n"
+    yield " build/src/makerom/entry.o(.text)\n"
+    yield " .text          0x0000000000001000       0x60 build/src/makerom/entry.o\n"
+    yield "                0x0000000000001000                entrypoint\n"
+    yield "\n"
+
+    kinds = [kind for kind, _ in OBJFILE_KINDS]
+    weights = [weight for _, weight in OBJFILE_KINDS]
+    ram = 0x80000460
+    rom = 0x1060
+    i_objfile = 0
+    i_segment = 0
+    while i_objfile < n_objfiles:
+        kind = rng.choices(kinds, weights)[0]
+        if "/overlays/" in kind:
+            # one segment per overlay, some with names long enough to be wrapped
+            name = rng.choice(("Test", "Ishi", "Dead_Dd", "Horse_Link_Child"))
+            name = f"{name}_{i_segment}"
+            segment_name = f"..{kind.rsplit('/', 1)[1]}{name}"
+            objfiles = [f"{kind}{name}/z_{name.lower()}.o"]
+        else:
+            segment_name = f"..{kind.split('/')[-2]}_{i_segment}"
+            objfiles = [
+                f"{kind}seg{i_segment}/file_{i}.o" for i in range(rng.randrange(1, 30))
+            ]
+        objfiles = objfiles[: n_objfiles - i_objfile]
+        ram, rom = yield from _iter_segment_lines(
+            rng, segment_name, objfiles, ram, rom
+        )
+        ram = (ram + 0x100F) & ~0xF
+        rom = (rom + 0xF) & ~0xF
+        i_objfile += len(objfiles)
+        i_segment += 1
+
+    yield ".comment        0x0000000000000000      0x100\n"
+    yield " .comment       0x0000000000000000       0x12 build/src/boot/boot_main.o\n"
+    yield "\n"
+    yield ".debug_info     0x0000000000000000   0x123456\n"
+    yield " *(.debug_info .gnu.linkonce.wi.*)\n"
+    for i in range(n_debug_lines):
+        yield (
+            f" .debug_info    0x{i * 16:016x}       0x10"
+            f" build/src/code/z_file_{i % 1000}.o\n"
+        )
+    yield "OUTPUT(zelda_ocarina_mq_dbg.elf elf32-tradbigmips)\n"
+
+
+def make_map_lines(
+    n_objfiles: int, seed: int = 0, n_debug_lines: int = 10_000
+) -> List[str]:
+    return list(iter_map_lines(n_objfiles, seed, n_debug_lines))
+
+
+def _get_include_name(header: str) -> str:
+    # how decomp includes headers, with -Iinclude -Isrc -I.
+    folder, _, path_in_folder = header.partition("/")
+    if folder in {"include", "src"}:
+        return path_in_folder
+    return header
+
+
+def write_header_tree(root: Path, n_headers: int, seed: int = 0):
+    """
+    Writes `n_headers` headers in nested folders of assets, include and src
+    in `root`, including each other like in decomp,
+    along with some files which aren't headers
+    """
+    rng = random.Random(seed)
+    headers = []
+    for i_header in range(n_headers):
+        folder = rng.choice(HEADERS_FOLDERS)
+        dir_path = f"{folder}/dir_{rng.randrange(20)}"
+        if rng.random() < 0.5:
+            dir_path += f"/sub_{rng.randrange(10)}"
+        headers.append(f"{dir_path}/header_{i_header}.h")
+
+    for i_header, header in enumerate(headers):
+        header_path = root / header
+        header_path.parent.mkdir(parents=True, exist_ok=True)
+        guard = f"HEADER_{i_header}_H"
+        lines = [f"#ifndef {guard}\n", f"#define {guard}\n", "\n"]
+        for i_include in range(rng.randrange(0, 4)):
+            # mostly include headers declared after this one, like a hierarchy
+            included_header = headers[
+                min(n_headers - 1, i_header + 1 + int(rng.expovariate(0.05)))
+            ]
+            if included_header == header:
+                continue
+            if rng.random() < 0.2:
+                lines.append(f"#include <{_get_include_name(included_header)}>\n")
+            else:
+                lines.append(f'#include "{_get_include_name(included_header)}"\n')
+        lines.append("\n")
+        for i_line in range(rng.randrange(10, 200)):
+            lines.append(
+                f"void func_{i_header}_{i_line}(s32 arg0, void* arg1, f32 arg2);\n"
+            )
+        lines.append("\n#endif\n")
+        header_path.write_text("".join(lines))
+        if rng.random() < 0.2:
+            # not a header, not copied
+            header_path.with_name(f"source_{i_header}.c").write_text(
+                f'#include "{header_path.name}"\n'
+            )
+
+
+def write_decomp_tree(
+    root: Path, n_objfiles: int, n_headers: int, seed: int = 0
+) -> Path:
+    """
+    Writes a fake decomp repo in `root`, with a map file, undefined_syms.txt
+    and headers, which can be used with decomp_getter.py
+
+    Returns the path to the map file
+    """
+    map_path = root / "build" / "z64.map"
+    map_path.parent.mkdir(parents=True, exist_ok=True)
+    with map_path.open("w") as f:
+        f.writelines(iter_map_lines(n_objfiles, seed, n_debug_lines=n_objfiles * 20))
+    with (root / "undefined_syms.txt").open("w") as f:
+        f.write("// hardware registers\n")
+        for i in range(100):
+            f.write(f"D_A4{i:06X} = 0xA4{i:06X}; // register {i}\n")
+    write_header_tree(root, n_headers, seed)
+    return map_path
+
+
+def make_syms_pair(
+    n_symbols: int,
+    n_objfiles: int = 1,
+    renamed_ratio: float = 0.2,
+    seed: int = 0,
+    shift: bool = False,
+) -> Tuple[dict, dict, int]:
+    """
+    Makes old and new syms.json-like dicts,
+    with `n_objfiles` .o files each having sections of `n_symbols` symbols,
+    where about `renamed_ratio` of the symbols are renamed (and some are added/removed)
+
+    If `shift` is set, the new symbols after a random point of each section
+    are moved by a few bytes, like after a code size change
+
+    Returns (old_syms, new_syms, number of renamed symbols)
+    """
+    rng = random.Random(seed)
+
+    old_syms = dict()
+    new_syms = dict()
+    n_renamed = 0
+
+    for i_objfile in range(n_objfiles):
+        objfile = f"build/src/code/file_{i_objfile}.o"
+        old_syms[objfile] = dict()
+        new_syms[objfile] = dict()
+        for i_section, section in enumerate((".text", ".data", ".bss")):
+            old_section_syms = dict()
+            new_section_syms = dict()
+            if shift:
+                shift_start = rng.randrange(n_symbols)
+                shift_size = rng.randrange(1, 16) * 4
+            for i in range(n_symbols):
+                ram = 0x80000000 + (i_objfile * 3 + i_section) * 0x100000 + i * 4
+                info = {
+                    "ram": f"0x{ram:08X}",
+                    "rom": None if section == ".bss" else f"0x{ram - 0x7F000000:08X}",
+                    "used": True,
+                }
+                name = f"sym_{i_objfile}_{i_section}_{i}"
+                old_section_syms[name] = info
+                if shift and i >= shift_start:
+                    ram += shift_size
+                    info = {
+                        "ram": f"0x{ram:08X}",
+                        "rom": (
+                            None if section == ".bss" else f"0x{ram - 0x7F000000:08X}"
+                        ),
+                        "used": True,
+                    }
+                r = rng.random()
+                if r < renamed_ratio:
+                    new_section_syms[f"renamed_{name}"] = info
+                    n_renamed += 1
+                elif r < renamed_ratio + 0.02:
+                    # removed
+                    pass
+                elif r < renamed_ratio + 0.04:
+                    new_section_syms[f"new_{name}"] = dict(info, ram=f"0x{ram + 2:08X}")
+                else:
+                    new_section_syms[name] = info
+            old_syms[objfile][section] = old_section_syms
+            new_syms[objfile][section] = new_section_syms
+
+    return old_syms, new_syms, n_renamed
+
+
+def write_syms_pair(
+    out_dir: Path,
+    n_symbols: int,
+    n_objfiles: int = 1,
+    renamed_ratio: float = 0.2,
+    seed: int = 0,
+    shift: bool = False,
+) -> Tuple[Path, Path]:
+    """
+    Writes old_syms.json and new_syms.json from `make_syms_pair` in `out_dir`
+
+    Returns their paths
+    """
+    old_syms, new_syms, _ = make_syms_pair(
+        n_symbols, n_objfiles, renamed_ratio, seed, shift
+    )
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = (out_dir / "old_syms.json", out_dir / "new_syms.json")
+    for path, syms in zip(paths, (old_syms, new_syms)):
+        with path.open("w") as f:
+            json.dump(syms, f, indent=1)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic decomp-like data for benchmarks"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    decomp_parser = subparsers.add_parser(
+        "decomp",
+        help="Write a fake decomp repo (map file, undefined_syms.txt, headers)",
+    )
+    decomp_parser.add_argument("out_dir", type=Path)
+    decomp_parser.add_argument("--objfiles", type=int, default=3000)
+    decomp_parser.add_argument("--headers", type=int, default=2000)
+    syms_pair_parser = subparsers.add_parser(
+        "syms-pair", help="Write old_syms.json and new_syms.json"
+    )
+    syms_pair_parser.add_argument("out_dir", type=Path)
+    syms_pair_parser.add_argument("--symbols", type=int, default=1000)
+    syms_pair_parser.add_argument("--objfiles", type=int, default=100)
+    syms_pair_parser.add_argument("--renamed-ratio", type=float, default=0.2)
+    syms_pair_parser.add_argument(
+        "--shift",
+        action="store_true",
+        help="Move the new symbols after a random point of each section by a few bytes",
+    )
+    args = parser.parse_args()
+
+    if args.command == "decomp":
+        map_path = write_decomp_tree(
+            args.out_dir, args.objfiles, args.headers, args.seed
+        )
+        print("Wrote", map_path)
+    else:
+        for path in write_syms_pair(
+            args.out_dir,
+            args.symbols,
+            args.objfiles,
+            args.renamed_ratio,
+            args.seed,
+            args.shift,
+        ):
+            print("Wrote", path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+#!/bin/env python3
+
+# SPDX-License-Identifier: CC0-1.0 OR Unlicense
+
+# Amalgamates the decomp headers included from a root header (such as z64hdr.h)
+# into a single header, see decomp_getter.py --headers-bundle
+#
+# The #include directives resolved to decomp headers are replaced by the headers'
+# contents, with #line markers so that diagnostics point at the original headers.
+# Include guards are kept: a guarded header is only inlined again if it was first
+# included inside a conditional directive (#if...), which may have been skipped.
+# Headers without guards (such as x-macro tables) are inlined every time.
+# `#pragma once` lines are left out, as in the bundle they are in the main file.
+
+import argparse
+import hashlib
+import json
+from pathlib import Path
+import posixpath
+import re
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import headerdeps
+
+HEADERS_BUNDLE_CACHE_VERSION = 2
+
+HEADERS_BUNDLE_CACHE_FILE_NAME = "headers_bundle.json"
+
+# like gcc's limit
+MAX_INCLUDE_DEPTH = 200
+
+INCLUDE_LINE_PATTERN = re.compile(
+    rb'[ \t]*#[ \t]*include[ \t]*(?:"([^"\n]+)"|<([^>\n]+)>)'
+)
+
+CONDITIONAL_LINE_PATTERN = re.compile(
+    rb"^[ \t]*#[ \t]*(if|ifdef|ifndef|elif|else|endif)\b", re.MULTILINE
+)
+
+# whitespace and comments
+_BLANK = rb"(?:\s|//[^\n]*|/\*.*?\*/)*"
+
+INCLUDE_GUARD_START_PATTERN = re.compile(
+    _BLANK
+    + rb"#[ \t]*(?:ifndef[ \t]+(\w+)|if[ \t]+!\s*defined\s*\(?\s*(\w+)\s*\)?)"
+    + rb"[^\n]*\n"
+    + rb"\s*#[ \t]*define[ \t]+(\w+)\b",
+    re.DOTALL,
+)
+
+INCLUDE_GUARD_END_PATTERN = re.compile(rb"[^\n]*(?:\n" + _BLANK + rb")?", re.DOTALL)
+
+PRAGMA_ONCE_PATTERN = re.compile(rb"^[ \t]*#[ \t]*pragma[ \t]+once\b", re.MULTILINE)
+
+
+def get_include_guard_depth(data: bytes) -> Optional[int]:
+    """
+    Returns the conditional depth of the contents of the header `data` if it has
+    an include guard: 1 for `#ifndef X` `#define X` ... `#endif` around
+    the whole header, 0 for `#pragma once`
+
+    Returns None if the header has no include guard
+    """
+    match = INCLUDE_GUARD_START_PATTERN.match(data)
+    if match is not None and (match.group(1) or match.group(2)) == match.group(3):
+        depth = 0
+        for conditional_match in CONDITIONAL_LINE_PATTERN.finditer(
+            data, match.end()
+        ):
+            conditional = conditional_match.group(1)
+            if conditional == b"endif":
+                if depth == 0:
+                    # the guard's #endif, it must end the header
+                    end_match = INCLUDE_GUARD_END_PATTERN.match(
+                        data, conditional_match.end()
+                    )
+                    if end_match.end() == len(data):
+                        return 1
+                    break
+                depth -= 1
+            elif conditional in {b"elif", b"else"}:
+                if depth == 0:
+                    break
+            else:
+                depth += 1
+    if PRAGMA_ONCE_PATTERN.search(data) is not None:
+        return 0
+    return None
+
+
+def _format_line_marker(line_number: int, file_name: str) -> bytes:
+    escaped_file_name = file_name.replace("\\", "\\\\").replace('"', '\\"')
+    return f'#line {line_number} "{escaped_file_name}"\n'.encode()
+
+
+def _get_root_file_name(root: Path, headers: Set[str]) -> Tuple[str, bool]:
+    # the root's name in the bundle, and if it is a decomp header
+    root_header = root.as_posix()
+    if root_header in headers:
+        return root_header, True
+    return str(root), False
+
+
+def bundle_headers(
+    oot_decomp_repo_path: Path, root: Path, headers: Iterable[str]
+) -> Tuple[bytes, Dict[str, str]]:
+    """
+    Amalgamates the `headers` (paths relative to the decomp repo) included from
+    the `root` header (relative to the decomp repo, or outside of it like z64hdr.h)
+
+    Includes of other files are kept as they are.
+
+    Returns the bundle, and the sha1 of the files it was made from
+    (the root and the inlined headers, by name like in the #line markers)
+    """
+    resolver = headerdeps.IncludeResolver(headers)
+    chunks: List[bytes] = []
+    inputs_digests: Dict[str, str] = dict()
+    # guarded headers inlined outside of conditional directives
+    inlined_once: Set[str] = set()
+    includers: List[str] = []
+
+    def inline(
+        path: Path, file_name: str, includer_dir: Optional[str], conditional: bool
+    ):
+        """
+        Inlines the file at `path`, `conditional` being set if it is included
+        inside a conditional directive (or by a file that is)
+        """
+        if len(includers) >= MAX_INCLUDE_DEPTH:
+            raise Exception(
+                "#include nested too deeply", " -> ".join(includers + [file_name])
+            )
+        includers.append(file_name)
+        data = path.read_bytes()
+        inputs_digests[file_name] = hashlib.sha1(data).hexdigest()
+        guard_depth = get_include_guard_depth(data)
+        if guard_depth is not None and not conditional:
+            inlined_once.add(file_name)
+
+        chunks.append(_format_line_marker(1, file_name))
+        depth = 0
+        for line_number, line in enumerate(data.splitlines(keepends=True), 1):
+            if not line.endswith(b"\n"):
+                line += b"\n"
+
+            match = INCLUDE_LINE_PATTERN.match(line)
+            if match is not None:
+                quoted_name, angled_name = match.groups()
+                if quoted_name:
+                    header = resolver.resolve(includer_dir, quoted_name.decode())
+                else:
+                    header = resolver.resolve(None, angled_name.decode())
+                if header is None:
+                    chunks.append(line)
+                elif header in inlined_once:
+                    # blank instead, to keep the line numbers
+                    chunks.append(b"\n")
+                else:
+                    inline(
+                        oot_decomp_repo_path / header,
+                        header,
+                        posixpath.dirname(header),
+                        conditional or depth > (guard_depth or 0),
+                    )
+                    chunks.append(_format_line_marker(line_number + 1, file_name))
+                continue
+
+            if PRAGMA_ONCE_PATTERN.match(line) is not None:
+                # the header is only inlined once already (see `inlined_once`),
+                # and in the bundle it would be in the main file
+                chunks.append(b"\n")
+                continue
+
+            match = CONDITIONAL_LINE_PATTERN.match(line)
+            if match is not None:
+                if match.group(1) == b"endif":
+                    depth -= 1
+                elif match.group(1).startswith(b"if"):
+                    depth += 1
+            chunks.append(line)
+        includers.pop()
+
+    root_file_name, root_is_header = _get_root_file_name(root, resolver.headers)
+    if root_is_header:
+        inline(
+            oot_decomp_repo_path / root_file_name,
+            root_file_name,
+            posixpath.dirname(root_file_name),
+            False,
+        )
+    else:
+        inline(root, root_file_name, None, False)
+
+    return b"".join(chunks), inputs_digests
+
+
+def get_headers_bundle_name(root: Path) -> str:
+    """
+    Returns the file name of the bundle of `root`, for example z64hdr_bundle.h
+    """
+    return f"{root.stem}_bundle.h"
+
+
+def write_headers_bundle(
+    oot_decomp_repo_path: Path,
+    root: Path,
+    headers: Iterable[str],
+    bundle_path: Path,
+    cache_path: Path,
+) -> bool:
+    """
+    Writes the bundle of the `headers` included from `root` (see `bundle_headers`)
+    to `bundle_path`, unless none of the files it is made from changed
+
+    The sha1 of these files are kept in the cache file at `cache_path`
+    (the bundle is also made again if the set of `headers` changed, as includes
+    may then resolve to other headers)
+
+    Returns if the bundle was written
+    """
+    headers = sorted(headers)
+    headers_digest = hashlib.sha1("\n".join(headers).encode()).hexdigest()
+    root_file_name, root_is_header = _get_root_file_name(root, set(headers))
+
+    cache = None
+    if cache_path.exists():
+        with cache_path.open() as f:
+            cache = json.load(f)
+
+    if (
+        cache is not None
+        and cache.get("version") == HEADERS_BUNDLE_CACHE_VERSION
+        and cache["root"] == root_file_name
+        and cache["bundle"] == bundle_path.name
+        and cache["headers_digest"] == headers_digest
+        and bundle_path.exists()
+    ):
+        for file_name, digest in cache["inputs"].items():
+            if file_name == root_file_name and not root_is_header:
+                input_path = root
+            else:
+                input_path = oot_decomp_repo_path / file_name
+            if (
+                not input_path.exists()
+                or hashlib.sha1(input_path.read_bytes()).hexdigest() != digest
+            ):
+                break
+        else:
+            return False
+
+    if cache is not None and cache.get("bundle", bundle_path.name) != bundle_path.name:
+        # bundle of another root
+        previous_bundle_path = bundle_path.parent / cache["bundle"]
+        if previous_bundle_path.exists():
+            previous_bundle_path.unlink()
+
+    bundle, inputs_digests = bundle_headers(oot_decomp_repo_path, root, headers)
+    bundle_path.write_bytes(bundle)
+    with cache_path.open("w") as f:
+        json.dump(
+            {
+                "version": HEADERS_BUNDLE_CACHE_VERSION,
+                "root": root_file_name,
+                "bundle": bundle_path.name,
+                "headers_digest": headers_digest,
+                "inputs": inputs_digests,
+            },
+            f,
+            indent=1,
+        )
+    return True
+
+
+def remove_headers_bundle(cache_path: Path, bundle_dir_path: Path):
+    """
+    Removes the bundle in `bundle_dir_path` written with the cache file
+    at `cache_path`, and the cache file, if they exist
+    """
+    if not cache_path.exists():
+        return
+    with cache_path.open() as f:
+        cache = json.load(f)
+    bundle_path = bundle_dir_path / cache["bundle"]
+    if bundle_path.exists():
+        bundle_path.unlink()
+    cache_path.unlink()
+
+
+def main():
+    # decomp_getter imports this module
+    import decomp_getter
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Amalgamate the decomp headers included from a root header"
+            " into a single header"
+        )
+    )
+    parser.add_argument("oot_decomp_repo_path", type=Path)
+    parser.add_argument(
+        "root",
+        type=Path,
+        help="Root header, relative to oot_decomp_repo_path or outside of it",
+    )
+    parser.add_argument("bundle_path", type=Path)
+    parser.add_argument(
+        "--cache",
+        dest="cache_path",
+        type=Path,
+        help=(
+            "Cache file, to only make the bundle again if a header changed"
+            " (default: bundle_path with .json appended)"
+        ),
+    )
+    args = parser.parse_args()
+
+    cache_path = args.cache_path
+    if cache_path is None:
+        cache_path = args.bundle_path.with_name(args.bundle_path.name + ".json")
+
+    headers = decomp_getter.find_headers(args.oot_decomp_repo_path)
+    if write_headers_bundle(
+        args.oot_decomp_repo_path, args.root, headers, args.bundle_path, cache_path
+    ):
+        print("Wrote", args.bundle_path)
+    else:
+        print(args.bundle_path, "is up to date")
+
+
+if __name__ == "__main__":
+    main()
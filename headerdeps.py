@@ -0,0 +1,193 @@
+#!/bin/env python3
+
+# SPDX-License-Identifier: CC0-1.0 OR Unlicense
+
+# Finds the headers of decomp reachable through #include directives
+# from root headers (such as z64hdr.h), see decomp_getter.py --headers-roots
+
+import argparse
+import json
+from pathlib import Path
+import posixpath
+import re
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# decomp's include search paths (-I), relative to the decomp repo
+INCLUDE_DIRS = ("include", "include/libc", "src", ".")
+
+INCLUDE_DIRECTIVE_PATTERN = re.compile(
+    rb'^[ \t]*#[ \t]*include[ \t]*(?:"([^"\n]+)"|<([^>\n]+)>)', re.MULTILINE
+)
+
+HEADERS_DEPS_FILE_NAME = "headers_deps.json"
+
+
+def scan_includes(path: Path) -> List[Tuple[str, bool]]:
+    """
+    Returns the (included name, is quoted) of the #include directives
+    in the file at `path`, in order
+
+    Conditional directives (#if...) are not evaluated: all includes are returned.
+    Includes of macros (`#include SOME_HEADER`) are ignored.
+    """
+    return [
+        (quoted_name.decode(), True) if quoted_name else (angled_name.decode(), False)
+        for quoted_name, angled_name in INCLUDE_DIRECTIVE_PATTERN.findall(
+            path.read_bytes()
+        )
+    ]
+
+
+class IncludeResolver:
+    """
+    Resolves #include directives to headers like the compiler does
+    (the directory of the including file first for quoted includes,
+    then each of the `include_dirs`)
+
+    Headers are looked up in an index of the known `headers` (paths relative
+    to the decomp repo) instead of on disk, and resolutions are cached
+    by including directory.
+    """
+
+    def __init__(self, headers: Iterable[str], include_dirs=INCLUDE_DIRS):
+        self.headers = set(headers)
+        self.include_dirs = include_dirs
+        self._cache: Dict[Tuple[Optional[str], str], Optional[str]] = dict()
+
+    def resolve(self, includer_dir: Optional[str], name: str) -> Optional[str]:
+        """
+        Returns the header included as `name` from a file in `includer_dir`
+        (None for angle-bracket includes, or if the file isn't in the decomp repo),
+        or None if it isn't one of the known headers
+        """
+        key = (includer_dir, name)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        resolved_header = None
+        search_dirs = self.include_dirs
+        if includer_dir is not None:
+            search_dirs = (includer_dir,) + search_dirs
+        for search_dir in search_dirs:
+            header = posixpath.normpath(posixpath.join(search_dir, name))
+            if header in self.headers:
+                resolved_header = header
+                break
+
+        self._cache[key] = resolved_header
+        return resolved_header
+
+
+def find_headers_deps(
+    oot_decomp_repo_path: Path,
+    roots: Iterable[Path],
+    headers: Iterable[str],
+) -> dict:
+    """
+    Follows the #include directives from the `roots` files to find
+    the transitive closure of the `headers` (paths relative to the decomp repo)
+    they include
+
+    Roots that are one of the `headers` (relative to the decomp repo) are part
+    of the closure, other roots (such as z64hdr.h) are only scanned.
+
+    Returns the dependency graph:
+    {
+        "roots": [...],
+        "headers": {header: [included headers]},
+        "unresolved": {file: [names of includes not resolved to a header]},
+    }
+    with "headers" holding the closure, sorted
+    """
+    resolver = IncludeResolver(headers)
+    graph: Dict[str, List[str]] = dict()
+    unresolved: Dict[str, List[str]] = dict()
+    roots_names = []
+    headers_to_scan = []
+
+    def scan(path: Path, includer_dir: Optional[str], includer_name: str):
+        deps = []
+        for name, is_quoted in scan_includes(path):
+            header = resolver.resolve(includer_dir if is_quoted else None, name)
+            if header is None:
+                unresolved.setdefault(includer_name, []).append(name)
+                continue
+            if header not in deps:
+                deps.append(header)
+            if header not in graph:
+                # mark as found, its includes are filled in when scanned
+                graph[header] = []
+                headers_to_scan.append(header)
+        return deps
+
+    for root in roots:
+        root_header = root.as_posix()
+        if root_header in resolver.headers:
+            roots_names.append(root_header)
+            if root_header not in graph:
+                graph[root_header] = []
+                headers_to_scan.append(root_header)
+        else:
+            roots_names.append(str(root))
+            scan(root, None, str(root))
+
+    while headers_to_scan:
+        header = headers_to_scan.pop()
+        graph[header] = scan(
+            oot_decomp_repo_path / header, posixpath.dirname(header), header
+        )
+
+    return {
+        "roots": roots_names,
+        "headers": dict(sorted(graph.items())),
+        "unresolved": dict(sorted(unresolved.items())),
+    }
+
+
+def write_headers_deps(headers_deps_path: Path, headers_deps: dict):
+    """
+    Writes the dependency graph from `find_headers_deps`, if it changed
+    """
+    data = json.dumps(headers_deps, indent=1)
+    if headers_deps_path.exists() and headers_deps_path.read_text() == data:
+        return
+    headers_deps_path.write_text(data)
+
+
+def main():
+    # decomp_getter imports this module
+    import decomp_getter
+
+    parser = argparse.ArgumentParser(
+        description="List the decomp headers reachable from root headers"
+    )
+    parser.add_argument("oot_decomp_repo_path", type=Path)
+    parser.add_argument(
+        "roots",
+        nargs="+",
+        type=Path,
+        help="Root headers, relative to oot_decomp_repo_path or outside of it",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print the dependency graph as json"
+    )
+    args = parser.parse_args()
+
+    headers = decomp_getter.find_headers(args.oot_decomp_repo_path)
+    headers_deps = find_headers_deps(args.oot_decomp_repo_path, args.roots, headers)
+
+    if args.json:
+        print(json.dumps(headers_deps, indent=1))
+    else:
+        for header in headers_deps["headers"]:
+            print(header)
+        for file, names in headers_deps["unresolved"].items():
+            print("Unresolved includes in", file, ":", ", ".join(names))
+        print(len(headers_deps["headers"]), "of", len(headers), "headers reachable")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# SPDX-License-Identifier: CC0-1.0 OR Unlicense
+
+# Opt-in per-stage profiling (time, peak memory, counters), used by the
+# `--profile` option of decomp_getter.py, gen_changelog.py and upgrade_assist.py
+#
+# Code is instrumented with `with profiling.stage("name"):` and
+# `profiling.count("name", amount)`, which do nothing unless profiling
+# was started with `profiling.profile(...)`.
+#
+# Memory is measured with tracemalloc (python allocations only, and not those
+# of child processes). It is process-wide: stages running concurrently
+# in other threads count towards each other's peak memory.
+
+import contextlib
+import json
+from pathlib import Path
+import platform
+import threading
+import time
+import tracemalloc
+
+from typing import Dict, List, Optional
+
+
+class Stage:
+    def __init__(self, name: str):
+        self.name = name
+        self.time = 0.0
+        self.peak_memory = 0
+        self.stages: List[Stage] = []
+        # peak memory of the stage so far, before the last tracemalloc.reset_peak()
+        self._peak_memory_before_reset = 0
+
+    def to_dict(self) -> dict:
+        stage_dict = {
+            "name": self.name,
+            "time": self.time,
+            "peak_memory": self.peak_memory,
+        }
+        if self.stages:
+            stage_dict["stages"] = [stage.to_dict() for stage in self.stages]
+        return stage_dict
+
+
+class Profiler:
+    def __init__(self, tool: str):
+        self.tool = tool
+        self.root = Stage(tool)
+        self.counters: Dict[str, int] = dict()
+        self._lock = threading.Lock()
+        # the stack of stages being run, per thread
+        self._local = threading.local()
+
+    def _get_stack(self) -> List[Stage]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            # stages started in a new thread are top-level stages
+            stack = [self.root]
+            self._local.stack = stack
+        return stack
+
+    def _update_peak_memory(self, stack: List[Stage]):
+        """
+        Takes the tracemalloc peak into account for all the stages in `stack`,
+        and resets the peak
+        """
+        _, peak = tracemalloc.get_traced_memory()
+        for stage in stack:
+            stage._peak_memory_before_reset = max(
+                stage._peak_memory_before_reset, peak
+            )
+        tracemalloc.reset_peak()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        stack = self._get_stack()
+        stage = Stage(name)
+        with self._lock:
+            stack[-1].stages.append(stage)
+            self._update_peak_memory(stack)
+            stage._peak_memory_before_reset, _ = tracemalloc.get_traced_memory()
+        stack.append(stage)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.time = time.perf_counter() - start
+            with self._lock:
+                self._update_peak_memory(stack)
+                stage.peak_memory = stage._peak_memory_before_reset
+            stack.pop()
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def get_report(self) -> dict:
+        return {
+            "tool": self.tool,
+            "python": platform.python_version(),
+            "time": self.root.time,
+            "peak_memory": self.root.peak_memory,
+            "stages": [stage.to_dict() for stage in self.root.stages],
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+
+_profiler: Optional[Profiler] = None
+
+
+@contextlib.contextmanager
+def profile(tool: str, report_path: Optional[Path]):
+    """
+    Profiles the code run in the `with` block if `report_path` is set,
+    then writes the report as json to `report_path`
+    """
+    global _profiler
+    if report_path is None:
+        yield None
+        return
+    if _profiler is not None:
+        raise Exception("Already profiling", _profiler.tool)
+
+    profiler = Profiler(tool)
+    tracemalloc.start()
+    _profiler = profiler
+    start = time.perf_counter()
+    try:
+        yield profiler
+    finally:
+        profiler.root.time = time.perf_counter() - start
+        with profiler._lock:
+            profiler._update_peak_memory([profiler.root])
+        profiler.root.peak_memory = profiler.root._peak_memory_before_reset
+        _profiler = None
+        tracemalloc.stop()
+        with report_path.open("w") as f:
+            json.dump(profiler.get_report(), f, indent=1)
+        print("Wrote profile report to", report_path)
+
+
+def is_profiling() -> bool:
+    return _profiler is not None
+
+
+def stage(name: str):
+    """
+    Context manager for a stage named `name`, nested in the current stage
+    """
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.stage(name)
+
+
+def count(name: str, amount: int = 1):
+    """
+    Adds `amount` to the counter named `name`
+    """
+    if _profiler is not None:
+        _profiler.count(name, amount)
@@ -0,0 +1,467 @@
+#!/bin/env python3
+
+# SPDX-License-Identifier: CC0-1.0 OR Unlicense
+
+# Symbol history: an append-only SQLite database of the symbols of many versions
+# (builds) of decomp, to diff any two versions and follow symbols across versions
+# without keeping and re-parsing their syms.json files
+#
+# The symbols of a .o file are stored once for all the versions they are
+# the same in: each version maps its .o files to .o file contents (by digest),
+# which hold the symbols, indexed by name, ram and rom.
+
+import argparse
+import hashlib
+import itertools
+from pathlib import Path
+import sqlite3
+import sys
+import time
+
+from typing import (
+    Tuple,
+    Dict,
+    List,
+    Optional,
+    Iterable,
+    Iterator,
+    Union,
+)
+
+import gen_changelog
+
+SYMBOL_HISTORY_VERSION = 1
+
+SYMBOL_HISTORY_SCHEMA = """
+CREATE TABLE versions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    added INTEGER NOT NULL
+);
+CREATE TABLE objfile_contents (
+    id INTEGER PRIMARY KEY,
+    digest TEXT NOT NULL UNIQUE
+);
+CREATE TABLE version_objfiles (
+    version_id INTEGER NOT NULL REFERENCES versions(id),
+    objfile TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    content_id INTEGER NOT NULL REFERENCES objfile_contents(id),
+    PRIMARY KEY (version_id, objfile)
+) WITHOUT ROWID;
+CREATE INDEX version_objfiles_content ON version_objfiles(content_id, version_id);
+CREATE TABLE symbols (
+    content_id INTEGER NOT NULL REFERENCES objfile_contents(id),
+    position INTEGER NOT NULL,
+    section TEXT NOT NULL,
+    name TEXT NOT NULL,
+    ram INTEGER,
+    rom INTEGER,
+    used INTEGER NOT NULL,
+    PRIMARY KEY (content_id, position)
+) WITHOUT ROWID;
+CREATE INDEX symbols_name ON symbols(name);
+CREATE INDEX symbols_ram ON symbols(ram);
+CREATE INDEX symbols_rom ON symbols(rom);
+"""
+
+# (objfile, section, symbol, ram, rom, used), like in symsdb.py
+SymbolTuple = Tuple[str, str, str, Optional[int], Optional[int], bool]
+
+
+def _format_address(address: Optional[int]) -> Optional[str]:
+    # like in syms.json
+    return f"0x{address:08X}" if address is not None else None
+
+
+def get_objfile_digest(rows: List[Tuple[str, str, Optional[int], Optional[int], bool]]):
+    """
+    Returns the digest of the (section, symbol, ram, rom, used) `rows` of a .o file
+    """
+    digest = hashlib.sha1()
+    for row in rows:
+        digest.update(("\t".join(map(str, row)) + "\n").encode())
+    return digest.hexdigest()
+
+
+class SymbolHistory:
+    """
+    A symbol history database file, see the top of symhistory.py
+
+    Use as a context manager, or call `close()` when done
+    """
+
+    def __init__(self, path: Path):
+        self.connection = sqlite3.connect(path)
+        (user_version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if user_version == 0:
+            with self.connection:
+                self.connection.executescript(SYMBOL_HISTORY_SCHEMA)
+                self.connection.execute(
+                    f"PRAGMA user_version = {SYMBOL_HISTORY_VERSION}"
+                )
+        elif user_version != SYMBOL_HISTORY_VERSION:
+            raise Exception("Unsupported symbol history version", user_version, path)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_versions(self) -> List[str]:
+        """
+        Returns the names of the versions, in the order they were added
+        """
+        return [
+            name
+            for (name,) in self.connection.execute(
+                "SELECT name FROM versions ORDER BY id"
+            )
+        ]
+
+    def has_version(self, version: str) -> bool:
+        return (
+            self.connection.execute(
+                "SELECT 1 FROM versions WHERE name = ?", (version,)
+            ).fetchone()
+            is not None
+        )
+
+    def _get_version_id(self, version: str) -> int:
+        row = self.connection.execute(
+            "SELECT id FROM versions WHERE name = ?", (version,)
+        ).fetchone()
+        if row is None:
+            raise Exception("Unknown version", version)
+        return row[0]
+
+    def add_version(self, version: str, symbols: Iterable[SymbolTuple]) -> int:
+        """
+        Adds the `symbols` of version `version`, as (objfile, section, symbol, ram,
+        rom, used) tuples (the symbols of a .o file must be consecutive)
+
+        Only the .o files whose symbols aren't already stored (for another version)
+        are stored
+
+        Returns the amount of .o files that were stored
+        """
+        if self.has_version(version):
+            raise Exception("Version already in the symbol history", version)
+
+        n_objfiles_stored = 0
+        with self.connection:
+            version_id = self.connection.execute(
+                "INSERT INTO versions (name, added) VALUES (?, ?)",
+                (version, int(time.time())),
+            ).lastrowid
+            for position, (objfile, objfile_symbols) in enumerate(
+                itertools.groupby(symbols, key=lambda symbol: symbol[0])
+            ):
+                rows = [
+                    # None sections are "null" in syms.json
+                    (section if section is not None else "null", name, ram, rom, used)
+                    for _, section, name, ram, rom, used in objfile_symbols
+                ]
+                digest = get_objfile_digest(rows)
+                row = self.connection.execute(
+                    "SELECT id FROM objfile_contents WHERE digest = ?", (digest,)
+                ).fetchone()
+                if row is not None:
+                    (content_id,) = row
+                else:
+                    content_id = self.connection.execute(
+                        "INSERT INTO objfile_contents (digest) VALUES (?)", (digest,)
+                    ).lastrowid
+                    self.connection.executemany(
+                        "INSERT INTO symbols"
+                        " (content_id, position, section, name, ram, rom, used)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            (content_id, symbol_position) + row
+                            for symbol_position, row in enumerate(rows)
+                        ),
+                    )
+                    n_objfiles_stored += 1
+                self.connection.execute(
+                    "INSERT INTO version_objfiles"
+                    " (version_id, objfile, position, content_id)"
+                    " VALUES (?, ?, ?, ?)",
+                    # None .o files are "null" in syms.json too
+                    (
+                        version_id,
+                        objfile if objfile is not None else "null",
+                        position,
+                        content_id,
+                    ),
+                )
+        return n_objfiles_stored
+
+    def get_version_objfiles(self, version: str) -> Dict[str, int]:
+        """
+        Returns {objfile: content id} for the .o files of `version`, in order
+        """
+        return dict(
+            self.connection.execute(
+                "SELECT objfile, content_id FROM version_objfiles"
+                " WHERE version_id = ? ORDER BY position",
+                (self._get_version_id(version),),
+            )
+        )
+
+    def get_objfile_syms(self, content_id: int) -> dict:
+        """
+        Returns the symbols of a .o file content,
+        like in syms.json: {section: {symbol: {"ram": ..., "rom": ..., "used": ...}}}
+        """
+        syms_by_section = dict()
+        for section, name, ram, rom, used in self.connection.execute(
+            "SELECT section, name, ram, rom, used FROM symbols"
+            " WHERE content_id = ? ORDER BY position",
+            (content_id,),
+        ):
+            syms_by_section.setdefault(section, dict())[name] = {
+                "ram": _format_address(ram),
+                "rom": _format_address(rom),
+                "used": bool(used),
+            }
+        return syms_by_section
+
+    def iter_syms(
+        self, version: str, objfiles: Optional[Iterable[str]] = None
+    ) -> Iterator[Tuple[str, dict]]:
+        """
+        Yields the (objfile, symbols by section) items of `version`,
+        like `gen_changelog.iter_syms`, only for the `objfiles` if set
+        """
+        version_objfiles = self.get_version_objfiles(version)
+        if objfiles is not None:
+            objfiles = set(objfiles)
+        for objfile, content_id in version_objfiles.items():
+            if objfiles is None or objfile in objfiles:
+                yield objfile, self.get_objfile_syms(content_id)
+
+    def compare_versions(
+        self, old_version: str, new_version: str, processes: Optional[int] = 1
+    ) -> dict:
+        """
+        Compares the symbols of two versions, like `gen_changelog.compare_syms`
+
+        Only the .o files whose symbols differ are loaded and compared
+        """
+        old_objfiles = self.get_version_objfiles(old_version)
+        new_objfiles = self.get_version_objfiles(new_version)
+        changed_objfiles = {
+            objfile
+            for objfile in old_objfiles.keys() | new_objfiles.keys()
+            if old_objfiles.get(objfile) != new_objfiles.get(objfile)
+        }
+        return gen_changelog.compare_syms_iter(
+            self.iter_syms(old_version, changed_objfiles),
+            self.iter_syms(new_version, changed_objfiles),
+            processes=processes,
+        )
+
+    def get_symbol_history(
+        self, name: str
+    ) -> List[Tuple[str, str, str, Optional[int], Optional[int]]]:
+        """
+        Returns the (version, objfile, section, ram, rom) of the symbols named `name`
+        in all versions, in the order the versions were added
+        """
+        return self.connection.execute(
+            "SELECT versions.name, objfile, section, ram, rom FROM symbols"
+            " JOIN version_objfiles USING (content_id)"
+            " JOIN versions ON versions.id = version_id"
+            " WHERE symbols.name = ?"
+            " ORDER BY version_id, version_objfiles.position, symbols.position",
+            (name,),
+        ).fetchall()
+
+    def find_symbol_renames(
+        self, name: str
+    ) -> List[Tuple[str, str, str, Union[str, List[str]]]]:
+        """
+        Finds when the symbol `name` was renamed: for each version a .o file
+        stopped having the symbol, compares the .o file to the previous version
+        (see `gen_changelog.compare_objfile_syms`)
+
+        Returns (previous version, version, objfile, new name) tuples,
+        the new name being a list of candidates if ambiguous
+        """
+        versions = self.get_versions()
+        objfiles_by_version = dict()
+        for version, objfile, _, _, _ in self.get_symbol_history(name):
+            objfiles_by_version.setdefault(version, set()).add(objfile)
+
+        renames = []
+        for previous_version, version in zip(versions, versions[1:]):
+            gone_objfiles = objfiles_by_version.get(
+                previous_version, set()
+            ) - objfiles_by_version.get(version, set())
+            if not gone_objfiles:
+                continue
+            previous_objfiles = self.get_version_objfiles(previous_version)
+            version_objfiles = self.get_version_objfiles(version)
+            for objfile in sorted(gone_objfiles):
+                if objfile not in version_objfiles:
+                    continue
+                changes = gen_changelog.compare_objfile_syms(
+                    objfile,
+                    self.get_objfile_syms(previous_objfiles[objfile]),
+                    self.get_objfile_syms(version_objfiles[objfile]),
+                    consider_if_used=False,
+                )
+                for section, changes_in_section in changes.items():
+                    if section == "sections":
+                        continue
+                    new_name = changes_in_section["renamed"].get(name)
+                    if new_name is not None:
+                        renames.append((previous_version, version, objfile, new_name))
+        return renames
+
+    def lookup_address(
+        self, version: str, address: int, rom: bool = False
+    ) -> Optional[Tuple[str, str, str, Optional[int], Optional[int]]]:
+        """
+        Returns the (symbol, objfile, section, ram, rom) of the symbol of `version`
+        at or nearest below `address` (a rom address if `rom` is set, ram otherwise),
+        or None if there is none
+        """
+        address_column = "rom" if rom else "ram"
+        # go through the symbols of all versions from the address down, with the
+        # index, until one of `version` (instead of through all of `version`)
+        return self.connection.execute(
+            "SELECT symbols.name, objfile, section, ram, rom"
+            f" FROM symbols INDEXED BY symbols_{address_column}"
+            " CROSS JOIN version_objfiles"
+            " ON version_objfiles.content_id = symbols.content_id"
+            " AND version_objfiles.version_id = ?"
+            f" WHERE {address_column} <= ?"
+            f" ORDER BY {address_column} DESC LIMIT 1",
+            (self._get_version_id(version), address),
+        ).fetchone()
+
+
+def iter_syms_items_symbols(
+    syms_items: Iterable[Tuple[str, dict]]
+) -> Iterator[SymbolTuple]:
+    """
+    Yields (objfile, section, symbol, ram, rom, used) tuples
+    from (objfile, symbols by section) items (like from `gen_changelog.iter_syms`)
+    """
+    for objfile, syms_by_section in syms_items:
+        for section, syms_syms in syms_by_section.items():
+            for symbol, info in syms_syms.items():
+                yield (
+                    objfile,
+                    section,
+                    symbol,
+                    int(info["ram"], 16) if info["ram"] is not None else None,
+                    int(info["rom"], 16) if info["rom"] is not None else None,
+                    info["used"],
+                )
+
+
+def format_symbol_row(symbol_row) -> str:
+    return "\t".join(
+        value if isinstance(value, str) else (_format_address(value) or "-")
+        for value in symbol_row
+    )
+
+
+def main():
+    # decomp_getter imports this module
+    import decomp_getter
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Store the symbols of many versions in a database,"
+            " to diff them and follow symbols across versions"
+        )
+    )
+    parser.add_argument("history_path", type=Path, help="Symbol history database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_parser = subparsers.add_parser(
+        "add", help="Add the symbols of a version, from syms.json, syms.bin or a map"
+    )
+    add_parser.add_argument("version")
+    add_parser.add_argument("syms_path", type=Path)
+    subparsers.add_parser("versions", help="List the versions")
+    diff_parser = subparsers.add_parser(
+        "diff", help="Write the changelog between two versions"
+    )
+    diff_parser.add_argument("old_version")
+    diff_parser.add_argument("new_version")
+    diff_parser.add_argument("output_dir_path", type=Path)
+    diff_parser.add_argument(
+        "--formats",
+        nargs="+",
+        choices=gen_changelog.CHANGELOG_FORMATS.keys(),
+        default=gen_changelog.DEFAULT_CHANGELOG_FORMATS,
+        metavar="FORMAT",
+        help="Changelog files to write (see gen_changelog.py)",
+    )
+    history_parser = subparsers.add_parser(
+        "history", help="Show a symbol in all versions, and when it was renamed"
+    )
+    history_parser.add_argument("symbol")
+    addr_parser = subparsers.add_parser(
+        "addr", help="Look up the symbol at or nearest below an address in a version"
+    )
+    addr_parser.add_argument("version")
+    addr_parser.add_argument("address", type=lambda address: int(address, 16))
+    addr_parser.add_argument(
+        "--rom", action="store_true", help="The address is a rom address, not ram"
+    )
+    args = parser.parse_args()
+
+    with SymbolHistory(args.history_path) as history:
+        if args.command == "add":
+            if args.syms_path.suffix == ".map":
+                symbols = decomp_getter.iter_symbols_tuples(
+                    decomp_getter.read_symbols(args.syms_path)
+                )
+            else:
+                symbols = iter_syms_items_symbols(
+                    gen_changelog.iter_syms(args.syms_path)
+                )
+            n_objfiles_stored = history.add_version(args.version, symbols)
+            print(
+                "Added version",
+                args.version,
+                f"({n_objfiles_stored} new or changed .o files)",
+            )
+        elif args.command == "versions":
+            for version in history.get_versions():
+                print(version)
+        elif args.command == "diff":
+            changes = history.compare_versions(args.old_version, args.new_version)
+            gen_changelog.write_changelog(
+                changes, args.output_dir_path, args.formats
+            )
+        elif args.command == "history":
+            for symbol_row in history.get_symbol_history(args.symbol):
+                print(format_symbol_row(symbol_row))
+            for previous_version, version, objfile, new_name in (
+                history.find_symbol_renames(args.symbol)
+            ):
+                if not isinstance(new_name, str):
+                    new_name = "? " + ", ".join(new_name)
+                print(
+                    f"Renamed between {previous_version} and {version}"
+                    f" in {objfile}: {args.symbol} -> {new_name}"
+                )
+        elif args.command == "addr":
+            result = history.lookup_address(args.version, args.address, args.rom)
+            if result is None:
+                print("?")
+                sys.exit(1)
+            print(format_symbol_row(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/bin/env python3
+
+# SPDX-License-Identifier: CC0-1.0 OR Unlicense
+
+import argparse
+import bisect
+from pathlib import Path
+import sys
+
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import decomp_getter
+import gen_changelog
+import symsdb
+
+
+class Symbol(NamedTuple):
+    name: str
+    objfile: str
+    section: str
+    ram: Optional[int]
+    rom: Optional[int]
+
+
+class SymbolIndex:
+    """
+    Indexes symbols by address (ram and rom) and by name
+
+    Addresses are looked up by bisecting sorted arrays of the symbols' addresses,
+    and names with a dict
+    """
+
+    def __init__(self, symbols: Iterable[Symbol]):
+        self.symbols = list(symbols)
+
+        self.names_index = dict()
+        for i, symbol in enumerate(self.symbols):
+            self.names_index.setdefault(symbol.name, []).append(i)
+
+        # sorted addresses, and the indices of the symbols at these addresses
+        self.ram_addresses, self.ram_symbols = self._sort_by_address(
+            (symbol.ram for symbol in self.symbols)
+        )
+        self.rom_addresses, self.rom_symbols = self._sort_by_address(
+            (symbol.rom for symbol in self.symbols)
+        )
+
+    @staticmethod
+    def _sort_by_address(
+        addresses: Iterable[Optional[int]],
+    ) -> Tuple[List[int], List[int]]:
+        addresses_and_indices = sorted(
+            (address, i) for i, address in enumerate(addresses) if address is not None
+        )
+        return (
+            [address for address, _ in addresses_and_indices],
+            [i for _, i in addresses_and_indices],
+        )
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def lookup_address(
+        self, address: int, rom: bool = False
+    ) -> Optional[Tuple[Symbol, int]]:
+        """
+        Returns the symbol at or nearest below `address` (a rom address if `rom`
+        is set, ram otherwise) and the offset of `address` from it,
+        or None if there is no symbol below `address`
+
+        If several symbols are at the same address, the last one is returned
+        """
+        if rom:
+            addresses, symbols_indices = self.rom_addresses, self.rom_symbols
+        else:
+            addresses, symbols_indices = self.ram_addresses, self.ram_symbols
+        i = bisect.bisect_right(addresses, address) - 1
+        if i < 0:
+            return None
+        return self.symbols[symbols_indices[i]], address - addresses[i]
+
+    def lookup_name(self, name: str) -> List[Symbol]:
+        """
+        Returns the symbols named `name`
+        (there may be several, for example static symbols)
+        """
+        return [self.symbols[i] for i in self.names_index.get(name, ())]
+
+
+def iter_syms_symbols(syms_path: Path) -> Iterator[Symbol]:
+    """
+    Yields the symbols from a syms.json file, a syms.bin symbol database
+    (see symsdb.py) or a map file (.map)
+    """
+    if syms_path.suffix == ".map":
+        for objfile, section, ram, rom, symbol in decomp_getter.parse_map_file(
+            decomp_getter.iter_map_file_lines(syms_path)
+        ):
+            # like in syms.json
+            if section == ".bss":
+                rom = None
+            yield Symbol(symbol, objfile, section, ram, rom)
+    elif syms_path.suffix == ".bin":
+        with symsdb.SymsDb(syms_path) as syms_db:
+            for objfile, section, symbol, ram, rom, _ in syms_db.iter_symbols():
+                yield Symbol(symbol, objfile, section, ram, rom)
+    else:
+        for objfile, syms_by_section in gen_changelog.iter_syms_json(syms_path):
+            for section, syms_syms in syms_by_section.items():
+                for symbol, info in syms_syms.items():
+                    yield Symbol(
+                        symbol,
+                        objfile,
+                        section,
+                        int(info["ram"], 16) if info["ram"] is not None else None,
+                        int(info["rom"], 16) if info["rom"] is not None else None,
+                    )
+
+
+def load_symbol_index(syms_path: Path) -> SymbolIndex:
+    return SymbolIndex(iter_syms_symbols(syms_path))
+
+
+def format_address(address: Optional[int]) -> str:
+    return f"0x{address:08X}" if address is not None else "-"
+
+
+def format_symbol(symbol: Symbol, offset: int = 0) -> str:
+    return "\t".join(
+        (
+            f"{symbol.name}+0x{offset:X}" if offset else symbol.name,
+            symbol.objfile,
+            symbol.section,
+            format_address(symbol.ram),
+            format_address(symbol.rom),
+        )
+    )
+
+
+def run_query(index: SymbolIndex, query: str, rom: bool = False) -> List[str]:
+    """
+    Looks up `query`, an address (hex, starting with 0x) or else a symbol name
+
+    Returns the result lines: the query, then the tab-separated
+    symbol (with the offset to the queried address, if any),
+    .o file, section, ram and rom. "?" if nothing was found.
+    """
+    address = None
+    if query[:2] in {"0x", "0X"}:
+        try:
+            address = int(query, 16)
+        except ValueError:
+            pass
+
+    if address is not None:
+        result = index.lookup_address(address, rom)
+        if result is None:
+            return [f"{query}\t?\n"]
+        symbol, offset = result
+        return [f"{query}\t{format_symbol(symbol, offset)}\n"]
+
+    symbols = index.lookup_name(query)
+    if not symbols:
+        return [f"{query}\t?\n"]
+    return [f"{query}\t{format_symbol(symbol)}\n" for symbol in symbols]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Look up symbols by address (nearest symbol below) or by name"
+            " in syms.json, syms.bin or a map file"
+        )
+    )
+    parser.add_argument("syms_path", type=Path, help="syms.json, syms.bin or .map")
+    parser.add_argument(
+        "queries",
+        nargs="*",
+        help=(
+            "Addresses (0x...) or symbol names to look up"
+            " (default: read them from stdin, one per line)"
+        ),
+    )
+    parser.add_argument(
+        "--rom", action="store_true", help="Addresses are rom addresses, not ram"
+    )
+    args = parser.parse_args()
+
+    index = load_symbol_index(args.syms_path)
+
+    if args.queries:
+        queries = args.queries
+    else:
+        queries = (line.strip() for line in sys.stdin)
+
+    out = sys.stdout
+    for query in queries:
+        if query:
+            out.writelines(run_query(index, query, args.rom))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+#!/bin/env python3
+
+# SPDX-License-Identifier: CC0-1.0 OR Unlicense
+
+# Compact binary symbol database, holding the same information as syms.json
+#
+# Layout (all integers are little-endian uint32, unless noted):
+#   header:
+#     magic (8 bytes), version,
+#     n_strings, strings_size, n_objfiles, n_sections, n_symbols
+#   string table (all names, interned):
+#     string offsets [n_strings + 1], string data (utf-8, padded to 4 bytes)
+#   objfiles:
+#     name string index [n_objfiles], first section index [n_objfiles + 1]
+#   sections:
+#     name string index [n_sections], first symbol index [n_sections + 1]
+#   symbols (columns):
+#     name string index [n_symbols], ram [n_symbols], rom [n_symbols],
+#     flags [n_symbols] (uint8, see SYMBOL_FLAG_*, padded to 4 bytes)
+
+import argparse
+import array
+import json
+import mmap
+from pathlib import Path
+import struct
+import sys
+
+from typing import (
+    Tuple,
+    Dict,
+    List,
+    Optional,
+    Iterable,
+    Iterator,
+)
+
+SYMS_DB_MAGIC = b"Z64SYMS\0"
+SYMS_DB_VERSION = 1
+
+SYMS_DB_HEADER = struct.Struct("<8s6I")
+
+SYMBOL_FLAG_USED = 1 << 0
+SYMBOL_FLAG_HAS_RAM = 1 << 1
+SYMBOL_FLAG_HAS_ROM = 1 << 2
+
+
+def _padding(size: int) -> bytes:
+    return b"\0" * (-size % 4)
+
+
+def _u32_array(values: Iterable[int]) -> bytes:
+    a = array.array("I", values)
+    assert a.itemsize == 4
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a.tobytes()
+
+
+def write_syms_db(
+    path: Path,
+    symbols: Iterable[Tuple[str, str, str, Optional[int], Optional[int], bool]],
+):
+    """
+    Writes the `symbols`, as (objfile, section, symbol, ram, rom, used) tuples,
+    to a symbol database file at `path`
+
+    `rom` should be None for .bss symbols, like in syms.json
+
+    The symbols of a section of an objfile must be consecutive
+    """
+    strings: List[str] = []
+    string_indices: Dict[str, int] = dict()
+
+    def intern(s: str):
+        string_index = string_indices.get(s)
+        if string_index is None:
+            string_index = len(strings)
+            string_indices[s] = string_index
+            strings.append(s)
+        return string_index
+
+    objfiles_names = []
+    objfiles_first_section = []
+    sections_names = []
+    sections_first_symbol = []
+    symbols_names = array.array("I")
+    symbols_ram = array.array("I")
+    symbols_rom = array.array("I")
+    symbols_flags = bytearray()
+
+    cur_objfile = None
+    cur_section = None
+    for objfile, section, symbol, ram, rom, used in symbols:
+        # None keys end up as "null" in syms.json, do the same
+        if objfile is None:
+            objfile = "null"
+        if section is None:
+            section = "null"
+        if objfile != cur_objfile:
+            cur_objfile = objfile
+            cur_section = None
+            objfiles_names.append(intern(objfile))
+            objfiles_first_section.append(len(sections_names))
+        if section != cur_section:
+            cur_section = section
+            sections_names.append(intern(section))
+            sections_first_symbol.append(len(symbols_names))
+        symbols_names.append(intern(symbol))
+        symbols_ram.append(ram if ram is not None else 0)
+        symbols_rom.append(rom if rom is not None else 0)
+        symbols_flags.append(
+            (SYMBOL_FLAG_USED if used else 0)
+            | (SYMBOL_FLAG_HAS_RAM if ram is not None else 0)
+            | (SYMBOL_FLAG_HAS_ROM if rom is not None else 0)
+        )
+    objfiles_first_section.append(len(sections_names))
+    sections_first_symbol.append(len(symbols_names))
+
+    encoded_strings = [s.encode() for s in strings]
+    strings_offsets = [0]
+    for encoded_string in encoded_strings:
+        strings_offsets.append(strings_offsets[-1] + len(encoded_string))
+    strings_data = b"".join(encoded_strings)
+
+    with path.open("wb") as f:
+        f.write(
+            SYMS_DB_HEADER.pack(
+                SYMS_DB_MAGIC,
+                SYMS_DB_VERSION,
+                len(strings),
+                len(strings_data),
+                len(objfiles_names),
+                len(sections_names),
+                len(symbols_names),
+            )
+        )
+        f.write(_u32_array(strings_offsets))
+        f.write(strings_data)
+        f.write(_padding(len(strings_data)))
+        f.write(_u32_array(objfiles_names))
+        f.write(_u32_array(objfiles_first_section))
+        f.write(_u32_array(sections_names))
+        f.write(_u32_array(sections_first_symbol))
+        f.write(_u32_array(symbols_names))
+        f.write(_u32_array(symbols_ram))
+        f.write(_u32_array(symbols_rom))
+        f.write(symbols_flags)
+        f.write(_padding(len(symbols_flags)))
+
+
+class SymsDb:
+    """
+    A symbol database file, memory-mapped
+
+    Use as a context manager, or call `close()` when done
+    """
+
+    def __init__(self, path: Path):
+        with path.open("rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+
+        (
+            magic,
+            version,
+            n_strings,
+            strings_size,
+            n_objfiles,
+            n_sections,
+            n_symbols,
+        ) = SYMS_DB_HEADER.unpack_from(self._buffer)
+        if magic != SYMS_DB_MAGIC:
+            raise Exception("Not a symbol database file", path)
+        if version != SYMS_DB_VERSION:
+            raise Exception("Unsupported symbol database version", version, path)
+
+        self._offset = SYMS_DB_HEADER.size
+        self._strings_offsets = self._read_u32_array(n_strings + 1)
+        self._strings_data = self._buffer[self._offset : self._offset + strings_size]
+        self._offset += strings_size + len(_padding(strings_size))
+        self.objfiles_names = self._read_u32_array(n_objfiles)
+        self.objfiles_first_section = self._read_u32_array(n_objfiles + 1)
+        self.sections_names = self._read_u32_array(n_sections)
+        self.sections_first_symbol = self._read_u32_array(n_sections + 1)
+        self.symbols_names = self._read_u32_array(n_symbols)
+        self.symbols_ram = self._read_u32_array(n_symbols)
+        self.symbols_rom = self._read_u32_array(n_symbols)
+        self.symbols_flags = self._buffer[self._offset : self._offset + n_symbols]
+
+        self._strings: Optional[List[str]] = None
+
+    def _read_u32_array(self, count: int):
+        size = 4 * count
+        view = self._buffer[self._offset : self._offset + size]
+        self._offset += size
+        if sys.byteorder == "little":
+            # no copy
+            return view.cast("I")
+        else:
+            a = array.array("I", view.tobytes())
+            a.byteswap()
+            return a
+
+    def close(self):
+        # release all views on the mmap before closing it
+        for name in (
+            "_strings_offsets",
+            "_strings_data",
+            "objfiles_names",
+            "objfiles_first_section",
+            "sections_names",
+            "sections_first_symbol",
+            "symbols_names",
+            "symbols_ram",
+            "symbols_rom",
+            "symbols_flags",
+        ):
+            value = getattr(self, name)
+            if isinstance(value, memoryview):
+                value.release()
+        self._buffer.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_strings(self) -> List[str]:
+        """
+        Returns the whole string table, decoded
+        """
+        if self._strings is None:
+            strings_data = self._strings_data.tobytes()
+            strings_offsets = self._strings_offsets
+            self._strings = [
+                strings_data[start:end].decode()
+                for start, end in zip(strings_offsets[:-1], strings_offsets[1:])
+            ]
+        return self._strings
+
+    def __len__(self):
+        return len(self.symbols_names)
+
+    def iter_symbols(
+        self,
+    ) -> Iterator[Tuple[str, str, str, Optional[int], Optional[int], bool]]:
+        """
+        Yields (objfile, section, symbol, ram, rom, used) tuples, in order
+        """
+        strings = self.get_strings()
+        for i_objfile in range(len(self.objfiles_names)):
+            objfile = strings[self.objfiles_names[i_objfile]]
+            for i_section in range(
+                self.objfiles_first_section[i_objfile],
+                self.objfiles_first_section[i_objfile + 1],
+            ):
+                section = strings[self.sections_names[i_section]]
+                for i_symbol in range(
+                    self.sections_first_symbol[i_section],
+                    self.sections_first_symbol[i_section + 1],
+                ):
+                    flags = self.symbols_flags[i_symbol]
+                    yield (
+                        objfile,
+                        section,
+                        strings[self.symbols_names[i_symbol]],
+                        (
+                            self.symbols_ram[i_symbol]
+                            if flags & SYMBOL_FLAG_HAS_RAM
+                            else None
+                        ),
+                        (
+                            self.symbols_rom[i_symbol]
+                            if flags & SYMBOL_FLAG_HAS_ROM
+                            else None
+                        ),
+                        bool(flags & SYMBOL_FLAG_USED),
+                    )
+
+    def iter_objfiles_syms(self) -> Iterator[Tuple[str, dict]]:
+        """
+        Yields (objfile, symbols by section) items with the same structure as
+        syms.json, one .o file at a time
+        """
+        strings = self.get_strings()
+        for i_objfile in range(len(self.objfiles_names)):
+            syms_by_section = dict()
+            for i_section in range(
+                self.objfiles_first_section[i_objfile],
+                self.objfiles_first_section[i_objfile + 1],
+            ):
+                start = self.sections_first_symbol[i_section]
+                end = self.sections_first_symbol[i_section + 1]
+                syms_by_section[strings[self.sections_names[i_section]]] = {
+                    strings[name]: {
+                        "ram": f"0x{ram:08X}" if flags & SYMBOL_FLAG_HAS_RAM else None,
+                        "rom": f"0x{rom:08X}" if flags & SYMBOL_FLAG_HAS_ROM else None,
+                        "used": bool(flags & SYMBOL_FLAG_USED),
+                    }
+                    for name, ram, rom, flags in zip(
+                        self.symbols_names[start:end],
+                        self.symbols_ram[start:end],
+                        self.symbols_rom[start:end],
+                        self.symbols_flags[start:end],
+                    )
+                }
+            yield strings[self.objfiles_names[i_objfile]], syms_by_section
+
+    def to_syms_dict(self) -> dict:
+        """
+        Returns the symbols with the same structure as syms.json
+        """
+        syms = dict()
+        for objfile, syms_by_section in self.iter_objfiles_syms():
+            syms.setdefault(objfile, dict()).update(syms_by_section)
+        return syms
+
+
+def load_syms_db(path: Path) -> dict:
+    """
+    Loads the symbol database file at `path`, with the same structure as syms.json
+    """
+    with SymsDb(path) as syms_db:
+        return syms_db.to_syms_dict()
+
+
+def iter_syms_dict_symbols(
+    syms: dict,
+) -> Iterator[Tuple[str, str, str, Optional[int], Optional[int], bool]]:
+    """
+    Yields (objfile, section, symbol, ram, rom, used) tuples from syms.json contents
+    """
+    for objfile, syms_by_section in syms.items():
+        for section, syms_syms in syms_by_section.items():
+            for symbol, info in syms_syms.items():
+                yield (
+                    objfile,
+                    section,
+                    symbol,
+                    int(info["ram"], 16) if info["ram"] is not None else None,
+                    int(info["rom"], 16) if info["rom"] is not None else None,
+                    info["used"],
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a syms.json file to a symbol database file, or back"
+    )
+    parser.add_argument("input_path", type=Path, help="syms.json or syms.bin file")
+    parser.add_argument("output_path", type=Path)
+    args = parser.parse_args()
+
+    if args.input_path.suffix == ".json":
+        with args.input_path.open() as f:
+            syms = json.load(f)
+        write_syms_db(args.output_path, iter_syms_dict_symbols(syms))
+    else:
+        with args.output_path.open("w") as f:
+            json.dump(load_syms_db(args.input_path), f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/bin/env python3
+
+# SPDX-License-Identifier: CC0-1.0 OR Unlicense
+
+# python3 -m unittest test_decomp_getter
+
+from pathlib import Path
+import tempfile
+import unittest
+
+import decomp_getter
+
+# a symbol after a "load address" line but before any input section line
+# has no .o file and section
+MAP_LINES = [
+    "..seg0          0x0000000080000400      0x100 load address 0x0000000000001000\n",
+    "                0x0000000080000400                foo\n",
+    " .text          0x0000000080000404       0x10 build/src/code/a.o\n",
+    "                0x0000000080000404                func_a\n",
+    "..seg1          0x0000000080000500      0x100 load address 0x0000000000001100\n",
+    "                0x0000000080000500                bar\n",
+    " .data          0x0000000080000504       0x10 build/src/code/a.o\n",
+    "                0x0000000080000504                D_a\n",
+]
+
+
+def to_tuples(symbols: decomp_getter.Symbols):
+    return {
+        objfile: {
+            section: list(
+                zip(section_symbols.names, section_symbols.rams, section_symbols.roms)
+            )
+            for section, section_symbols in objfile_symbols.items()
+        }
+        for objfile, objfile_symbols in symbols.items()
+    }
+
+
+class TestOrganizeSymbols(unittest.TestCase):
+    def test_symbol_without_objfile(self):
+        self.assertEqual(
+            to_tuples(
+                decomp_getter.organize_symbols(
+                    decomp_getter.parse_map_file(MAP_LINES[:2])
+                )
+            ),
+            {None: {None: [("foo", 0x80000400, 0x1000)]}},
+        )
+
+    def test_symbol_without_objfile_after_objfile(self):
+        self.assertEqual(
+            to_tuples(
+                decomp_getter.organize_symbols(decomp_getter.parse_map_file(MAP_LINES))
+            ),
+            {
+                None: {
+                    None: [("foo", 0x80000400, 0x1000), ("bar", 0x80000500, 0x1100)]
+                },
+                "build/src/code/a.o": {
+                    ".text": [("func_a", 0x80000404, 0x1004)],
+                    ".data": [("D_a", 0x80000504, 0x1104)],
+                },
+            },
+        )
+
+    def test_sharded(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            map_path = Path(temp_dir) / "z64.map"
+            map_path.write_text("".join(MAP_LINES))
+            self.assertEqual(
+                to_tuples(decomp_getter.read_symbols_sharded(map_path, 2)),
+                to_tuples(decomp_getter.read_and_organize_symbols(MAP_LINES)),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/bin/env python3
+
+# SPDX-License-Identifier: CC0-1.0 OR Unlicense
+
+# Checks the diffs of unidiff.py against GNU diff (skipped if diff isn't installed)
+# python3 -m unittest test_unidiff
+
+import os
+from pathlib import Path
+import random
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import unidiff
+
+INCLUDE_PATCH_PATH = Path(__file__).parent / "include-patch.txt"
+
+
+def make_old_file(file_patch: unidiff.FilePatch) -> bytes:
+    """
+    Returns contents the hunks of `file_patch` apply to: their old lines,
+    with lines that appear nowhere else in between
+    """
+    lines = []
+    for hunk in file_patch.hunks:
+        while len(lines) < hunk.old_start - 1:
+            lines.append(f"/* line {len(lines) + 1} */\n".encode())
+        lines.extend(hunk.get_old_lines())
+    return b"".join(lines)
+
+
+@unittest.skipIf(shutil.which("diff") is None, "GNU diff is not installed")
+class TestDiff(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.temp_dir.cleanup()
+
+    def gnu_diff(self, *args: str) -> bytes:
+        return subprocess.run(
+            ["diff", *args], stdout=subprocess.PIPE, env={**os.environ, "LC_ALL": "C"}
+        ).stdout
+
+    def test_include_patch(self):
+        patch_data = INCLUDE_PATCH_PATH.read_bytes()
+        for file_patch in unidiff.parse_patch(patch_data):
+            old_path = Path(file_patch.old_path)
+            old_path.parent.mkdir(parents=True, exist_ok=True)
+            old_path.write_bytes(make_old_file(file_patch))
+        shutil.copytree("include-base", "include")
+        patched_paths, conflicts = unidiff.apply_patch(patch_data)
+        self.assertEqual(conflicts, [])
+
+        regenerated_patch_data = unidiff.diff_trees(
+            Path("include-base"), Path("include")
+        )
+        self.assertEqual(
+            regenerated_patch_data, self.gnu_diff("-Naur", "include-base", "include")
+        )
+        # the lines in between are the same in both files, so no hunk changed
+        self.assertEqual(
+            [
+                [hunk.to_text() for hunk in file_patch.hunks]
+                for file_patch in unidiff.parse_patch(regenerated_patch_data)
+            ],
+            [
+                [hunk.to_text() for hunk in file_patch.hunks]
+                for file_patch in unidiff.parse_patch(patch_data)
+            ],
+        )
+
+    def test_random_edits(self):
+        rng = random.Random(0)
+        old_path = Path("old.h")
+        new_path = Path("new.h")
+        for i in range(300):
+            # few distinct lines, like the braces and blank lines of headers
+            alphabet = [f"line {j}\n".encode() for j in range(rng.choice((3, 10, 200)))]
+            lines = [rng.choice(alphabet) for _ in range(rng.choice((0, 1, 10, 300)))]
+            new_lines = list(lines)
+            for _ in range(rng.randrange(10)):
+                pos = rng.randint(0, len(new_lines))
+                if rng.random() < 0.5:
+                    del new_lines[pos : pos + rng.randint(1, 5)]
+                else:
+                    new_lines[pos:pos] = rng.choices(alphabet, k=rng.randint(1, 5))
+            old_data = b"".join(lines)
+            new_data = b"".join(new_lines)
+            if rng.random() < 0.2:
+                new_data = new_data.rstrip(b"\n")
+            old_path.write_bytes(old_data)
+            new_path.write_bytes(new_data)
+            context = rng.choice((0, 1, 3))
+            with self.subTest(i=i, context=context):
+                self.assertEqual(
+                    unidiff.diff_files(old_path, new_path, context),
+                    self.gnu_diff(f"-U{context}", "-N", "old.h", "new.h"),
+                )
+
+
+class TestFindChangedFiles(unittest.TestCase):
+    def test_same_size_and_mtime(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            old_dir = Path(temp_dir) / "old"
+            new_dir = Path(temp_dir) / "new"
+            old_dir.mkdir()
+            new_dir.mkdir()
+            (old_dir / "a.h").write_bytes(b"int a;\n")
+            (new_dir / "a.h").write_bytes(b"int b;\n")
+            stat = (old_dir / "a.h").stat()
+            os.utime(new_dir / "a.h", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+            self.assertEqual(unidiff.find_changed_files(old_dir, new_dir), ["a.h"])
+            self.assertEqual(
+                unidiff.find_changed_files(old_dir, new_dir, trust_mtimes=True), []
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,1046 @@
+#!/bin/env python3
+
+# SPDX-License-Identifier: CC0-1.0 OR Unlicense
+
+# Applies and generates unified diffs (like `patch -p0` and `diff -Naur`),
+# in-process. Files are handled as bytes, so any encoding is kept as is.
+# Diffs are made with the same algorithm as GNU diff, and have the same hunks.
+
+import argparse
+import json
+import os
+from pathlib import Path
+import re
+import sys
+import time
+
+from typing import Tuple, Dict, List, Optional, Iterable
+
+NO_NEWLINE_AT_END_OF_FILE = b"\\ No newline at end of file\n"
+
+HUNK_HEADER_PATTERN = re.compile(rb"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class Hunk:
+    def __init__(self, old_start: int, old_len: int, new_start: int, new_len: int):
+        self.old_start = old_start
+        self.old_len = old_len
+        self.new_start = new_start
+        self.new_len = new_len
+        # (tag, line) with tag one of b" ", b"-", b"+"
+        # and line including its line ending, if any
+        self.lines: List[Tuple[bytes, bytes]] = []
+
+    def get_old_lines(self) -> List[bytes]:
+        return [line for tag, line in self.lines if tag != b"+"]
+
+    def get_new_lines(self) -> List[bytes]:
+        return [line for tag, line in self.lines if tag != b"-"]
+
+    def get_header(self) -> str:
+        return (
+            f"@@ -{self.old_start},{self.old_len} +{self.new_start},{self.new_len} @@"
+        )
+
+    def to_text(self) -> str:
+        return "".join(
+            [self.get_header() + "\n"]
+            + [
+                (tag + line).decode(errors="replace")
+                + ("" if line.endswith(b"\n") else "\n\\ No newline at end of file\n")
+                for tag, line in self.lines
+            ]
+        )
+
+
+class FilePatch:
+    def __init__(
+        self, old_path: str, new_path: str, old_timestamp: str, new_timestamp: str
+    ):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.old_timestamp = old_timestamp
+        self.new_timestamp = new_timestamp
+        self.hunks: List[Hunk] = []
+
+    def is_creation(self):
+        return all(hunk.old_start == 0 and hunk.old_len == 0 for hunk in self.hunks)
+
+    def is_deletion(self):
+        # `diff -N` uses the epoch as the timestamp of missing files,
+        # which tells deleted files apart from files that are emptied
+        return _is_epoch_timestamp(self.new_timestamp) and all(
+            hunk.new_start == 0 and hunk.new_len == 0 for hunk in self.hunks
+        )
+
+
+class PatchConflict:
+    def __init__(self, path: Path, hunk_index: int, hunk: Hunk, reason: str):
+        """
+        The hunk `hunk` (number `hunk_index`, from 1) of the patch of the file
+        at `path` could not be applied, because of `reason`
+        """
+        self.path = path
+        self.hunk_index = hunk_index
+        self.hunk = hunk
+        self.reason = reason
+
+    def to_dict(self):
+        return {
+            "path": self.path.as_posix(),
+            "hunk": self.hunk_index,
+            "old_start": self.hunk.old_start,
+            "old_len": self.hunk.old_len,
+            "new_start": self.hunk.new_start,
+            "new_len": self.hunk.new_len,
+            "reason": self.reason,
+            "text": self.hunk.to_text(),
+        }
+
+    def __str__(self):
+        return (
+            f"{self.path.as_posix()}: hunk #{self.hunk_index} failed ({self.reason})\n"
+            + self.hunk.to_text()
+        )
+
+
+def split_lines(data: bytes) -> List[bytes]:
+    """
+    Splits `data` into lines, keeping the line endings
+
+    Unlike `bytes.splitlines`, only splits on b"\\n"
+    """
+    lines = data.split(b"\n")
+    last_line = lines.pop()
+    split = [line + b"\n" for line in lines]
+    if last_line:
+        split.append(last_line)
+    return split
+
+
+def _parse_file_header(header_line: bytes) -> Tuple[str, str]:
+    """
+    Returns the path and timestamp from a `--- path\ttimestamp` line
+    """
+    path, _, timestamp = header_line[4:].rstrip(b"\r\n").partition(b"\t")
+    return os.fsdecode(path), timestamp.decode(errors="replace")
+
+
+def _is_epoch_timestamp(timestamp: str):
+    # the epoch in the local timezone, like 1970-01-01 01:00:00.000000000 +0100
+    return timestamp.startswith(("1970-01-01 ", "1969-12-31 "))
+
+
+def parse_patch(patch_data: bytes) -> List[FilePatch]:
+    """
+    Parses a unified diff, as output by `diff -Naur`
+    """
+    lines = split_lines(patch_data)
+    file_patches: List[FilePatch] = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if (
+            line.startswith(b"--- ")
+            and i + 1 < len(lines)
+            and lines[i + 1].startswith(b"+++ ")
+        ):
+            old_path, old_timestamp = _parse_file_header(line)
+            new_path, new_timestamp = _parse_file_header(lines[i + 1])
+            file_patches.append(
+                FilePatch(old_path, new_path, old_timestamp, new_timestamp)
+            )
+            i += 2
+            continue
+        match = HUNK_HEADER_PATTERN.match(line)
+        if match is None:
+            # diff command lines, or anything else that isn't part of a patch
+            i += 1
+            continue
+        if not file_patches:
+            raise Exception("Hunk without file header", i + 1, line)
+        old_start, old_len, new_start, new_len = (
+            int(group) if group is not None else 1 for group in match.groups()
+        )
+        hunk = Hunk(old_start, old_len, new_start, new_len)
+        i += 1
+        old_remaining = old_len
+        new_remaining = new_len
+        while old_remaining > 0 or new_remaining > 0:
+            if i >= len(lines):
+                raise Exception("Truncated hunk", hunk.get_header())
+            line = lines[i]
+            i += 1
+            if line.startswith(b"\\"):
+                continue
+            # some tools strip the trailing space of empty context lines
+            tag = line[:1] if line not in {b"\n", b"\r\n"} else b" "
+            if tag == b" ":
+                old_remaining -= 1
+                new_remaining -= 1
+            elif tag == b"-":
+                old_remaining -= 1
+            elif tag == b"+":
+                new_remaining -= 1
+            else:
+                raise Exception("Unexpected line in hunk", hunk.get_header(), line)
+            hunk.lines.append((tag, line[1:] if line[:1] == tag else line))
+            if (
+                i < len(lines)
+                and lines[i] == NO_NEWLINE_AT_END_OF_FILE
+                and hunk.lines[-1][1].endswith(b"\n")
+            ):
+                tag, line = hunk.lines[-1]
+                hunk.lines[-1] = (tag, line[:-1])
+                i += 1
+        if old_remaining < 0 or new_remaining < 0:
+            raise Exception("Hunk line counts don't match", hunk.get_header())
+        file_patches[-1].hunks.append(hunk)
+    return file_patches
+
+
+def _find_lines(
+    lines: List[bytes], needle: List[bytes], expected_index: int, min_index: int
+) -> Optional[int]:
+    """
+    Finds `needle` in `lines`, at `min_index` or later,
+    trying the indices the closest to `expected_index` first
+    """
+    max_index = len(lines) - len(needle)
+    if max_index < min_index:
+        return None
+    expected_index = min(max(expected_index, min_index), max_index)
+    n = len(needle)
+    max_distance = max(expected_index - min_index, max_index - expected_index)
+    for distance in range(max_distance + 1):
+        for index in (expected_index - distance, expected_index + distance):
+            if min_index <= index <= max_index and lines[index : index + n] == needle:
+                return index
+            if distance == 0:
+                break
+    return None
+
+
+def get_file_patch_rel_path(file_patch: FilePatch, strip: int = 0) -> Path:
+    """
+    Returns the path of the file patched by `file_patch` (its new file name),
+    with `strip` leading components removed (like `patch -p`)
+    """
+    path_parts = Path(file_patch.new_path).parts[strip:]
+    if not path_parts:
+        raise Exception("Can't strip", strip, "components from", file_patch.new_path)
+    return Path(*path_parts)
+
+
+def apply_file_patch(
+    file_patch: FilePatch,
+    root: Path = Path("."),
+    strip: int = 0,
+    base_root: Optional[Path] = None,
+) -> Tuple[Path, List[PatchConflict]]:
+    """
+    Applies `file_patch` to its file in `root`,
+    `strip` leading components being removed from the paths (like `patch -p`)
+
+    If `base_root` is set, `root` is an overlay over `base_root`:
+    files not in `root` are read from `base_root`, and written to `root`
+
+    The hunks that apply are applied even if others conflict,
+    and hunks may apply at a different line than the one in the patch
+
+    Returns the path to the patched file, and the conflicts
+    """
+    rel_path = get_file_patch_rel_path(file_patch, strip)
+    path = root / rel_path
+    read_path = path
+    if base_root is not None and not path.exists():
+        read_path = base_root / rel_path
+
+    if read_path.exists():
+        lines = split_lines(read_path.read_bytes())
+    elif file_patch.is_creation():
+        lines = []
+    else:
+        hunk = file_patch.hunks[0] if file_patch.hunks else Hunk(0, 0, 0, 0)
+        return path, [PatchConflict(path, 1, hunk, "file not found")]
+
+    conflicts: List[PatchConflict] = []
+    patched_lines: List[bytes] = []
+    # index in `lines` of the first line not yet copied to `patched_lines`
+    pos = 0
+    # difference between where hunks were found and their line in the patch
+    offset = 0
+    for hunk_index, hunk in enumerate(file_patch.hunks, 1):
+        old_lines = hunk.get_old_lines()
+        # a hunk with no old lines inserts after line old_start
+        hunk_index_in_file = hunk.old_start - 1 if hunk.old_len else hunk.old_start
+        found_index = _find_lines(lines, old_lines, hunk_index_in_file + offset, pos)
+        if found_index is None:
+            conflicts.append(
+                PatchConflict(path, hunk_index, hunk, "context not found")
+            )
+            continue
+        offset = found_index - hunk_index_in_file
+        patched_lines.extend(lines[pos:found_index])
+        patched_lines.extend(hunk.get_new_lines())
+        pos = found_index + len(old_lines)
+    patched_lines.extend(lines[pos:])
+
+    if not conflicts and file_patch.is_deletion() and not patched_lines:
+        if path.exists():
+            path.unlink()
+    else:
+        patched_data = b"".join(patched_lines)
+        if not path.exists() or patched_data != b"".join(lines):
+            if path.exists():
+                # don't write through an existing hardlink
+                path.unlink()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(patched_data)
+
+    return path, conflicts
+
+
+# in an overlay directory, lists the paths of the files deleted
+# from the base directory, one per line (see `apply_patch`)
+OVERLAY_DELETED_FILE_NAME = ".overlay_deleted"
+
+
+def apply_patch(
+    patch_data: bytes,
+    root: Path = Path("."),
+    strip: int = 0,
+    base_root: Optional[Path] = None,
+) -> Tuple[List[Path], List[PatchConflict]]:
+    """
+    Applies the unified diff `patch_data` to the files in `root`, like `patch -p0`
+    (the new file name of each file patch is used, see `apply_file_patch`)
+
+    Only the files in the patch are read and written
+
+    If `base_root` is set, `root` is an overlay over `base_root`
+    which is left untouched: only the patched files are written to `root`,
+    and deleted files are listed in OVERLAY_DELETED_FILE_NAME
+
+    Returns the paths to the patched files, and the conflicts
+    """
+    patched_paths = []
+    conflicts = []
+    deleted_rel_paths = []
+    for file_patch in parse_patch(patch_data):
+        path, file_conflicts = apply_file_patch(file_patch, root, strip, base_root)
+        patched_paths.append(path)
+        conflicts.extend(file_conflicts)
+        if base_root is not None and not file_conflicts and not path.exists():
+            rel_path = get_file_patch_rel_path(file_patch, strip)
+            if (base_root / rel_path).exists():
+                deleted_rel_paths.append(rel_path.as_posix())
+    if deleted_rel_paths:
+        with (root / OVERLAY_DELETED_FILE_NAME).open("a") as f:
+            f.writelines(f"{rel_path}\n" for rel_path in deleted_rel_paths)
+    return patched_paths, conflicts
+
+
+def find_overlay_files(overlay_dir: Path) -> Tuple[List[str], List[str]]:
+    """
+    Returns the sorted relative paths of the files in the overlay `overlay_dir`,
+    and of the files it deletes from its base directory
+    """
+    files = _scan_tree(overlay_dir) if overlay_dir.exists() else dict()
+    deleted_files = []
+    if OVERLAY_DELETED_FILE_NAME in files:
+        del files[OVERLAY_DELETED_FILE_NAME]
+        with (overlay_dir / OVERLAY_DELETED_FILE_NAME).open() as f:
+            deleted_files = sorted(set(f.read().splitlines()) - files.keys())
+    return sorted(files), deleted_files
+
+
+def _scan_tree(path: Path) -> Dict[str, Tuple[int, int]]:
+    """
+    Returns {relative path: (size, mtime_ns)} for all files in `path`
+    """
+    files = dict()
+    dirs_to_scan = [""]
+    while dirs_to_scan:
+        rel_dir = dirs_to_scan.pop()
+        with os.scandir(path / rel_dir) as it:
+            for entry in it:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if entry.is_dir():
+                    dirs_to_scan.append(rel_path)
+                else:
+                    stat = entry.stat()
+                    files[rel_path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def find_changed_files(
+    old_dir: Path, new_dir: Path, trust_mtimes: bool = False
+) -> List[str]:
+    """
+    Returns the sorted relative paths of the files that differ between
+    `old_dir` and `new_dir`, including files only in one of them
+
+    Files of the same size are compared by contents. With `trust_mtimes`,
+    files with the same size and modification time are assumed to be the same
+    (without being read): only set it if `new_dir` is a copy of `old_dir`
+    preserving modification times (like `shutil.copytree` does)
+    """
+    old_files = _scan_tree(old_dir) if old_dir.exists() else dict()
+    new_files = _scan_tree(new_dir) if new_dir.exists() else dict()
+    changed_files = []
+    for rel_path in old_files.keys() | new_files.keys():
+        old_stat = old_files.get(rel_path)
+        new_stat = new_files.get(rel_path)
+        if old_stat is None or new_stat is None:
+            changed_files.append(rel_path)
+        elif old_stat[0] != new_stat[0]:
+            changed_files.append(rel_path)
+        elif trust_mtimes and old_stat[1] == new_stat[1]:
+            continue
+        elif (old_dir / rel_path).read_bytes() != (new_dir / rel_path).read_bytes():
+            changed_files.append(rel_path)
+    # same order as diff -r
+    changed_files.sort(key=lambda path: path.split("/"))
+    return changed_files
+
+
+def _format_timestamp(path: Path) -> str:
+    # like diff: 2022-06-07 18:38:20.852165879 +0200
+    mtime_ns = path.stat().st_mtime_ns if path.exists() else 0
+    t = time.localtime(mtime_ns // 1_000_000_000)
+    return (
+        time.strftime("%Y-%m-%d %H:%M:%S", t)
+        + f".{mtime_ns % 1_000_000_000:09d} "
+        + time.strftime("%z", t)
+    )
+
+
+# The line differences are found like GNU diff does (diffutils' analyze.c and
+# gnulib's diffseq.h), so that the hunks are the same as with `diff -u`:
+# patch files regenerated in-process only change where the files changed.
+
+
+def _common_prefix_length(a: bytes, b: bytes) -> int:
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def _common_suffix_length(a: bytes, b: bytes, limit: int) -> int:
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[len(a) - mid :] == b[len(b) - mid :]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def _find_identical_ends(
+    data0: bytes, data1: bytes, horizon: int
+) -> Tuple[int, int, int]:
+    """
+    Returns the line from which, and the lines until which in each file,
+    the contents `data0` and `data1` are compared: like GNU diff, the identical
+    lines at the start and at the end are left out, except for `horizon` lines
+    """
+    # a missing newline at the end of a file is added, but makes its last line
+    # different from a line with a newline
+    missing0 = data0 != b"" and not data0.endswith(b"\n")
+    missing1 = data1 != b"" and not data1.endswith(b"\n")
+    buf0 = data0 + b"\n" if missing0 else data0
+    buf1 = data1 + b"\n" if missing1 else data1
+    n0 = len(buf0)
+    n1 = len(buf1)
+
+    p = _common_prefix_length(buf0, buf1)
+    if (n0 - missing0 < p) != (n1 - missing1 < p):
+        p -= 1
+    # back to the start of the line, and `horizon` lines more
+    i = horizon
+    while p != 0:
+        if buf0[p - 1] != ord("\n"):
+            p -= 1
+        elif i == 0:
+            break
+        else:
+            i -= 1
+            p -= 1
+    prefix_end = p
+
+    suffix_begin0 = n0
+    suffix_begin1 = n1
+    if missing0 == missing1:
+        length = _common_suffix_length(buf0, buf1, min(n0, n1) - prefix_end)
+        p0 = beg0 = n0 - length
+        p1 = n1 - length
+        # finish the line if the suffix starts inside it, then `horizon` lines more
+        i = horizon + (
+            not (
+                (p0 == 0 or buf0[p0 - 1] == ord("\n"))
+                and (p1 == 0 or buf1[p1 - 1] == ord("\n"))
+            )
+        )
+        while i > 0 and p0 != n0:
+            i -= 1
+            p0 = buf0.index(b"\n", p0) + 1
+        suffix_begin0 = p0
+        suffix_begin1 = p1 + p0 - beg0
+
+    return (
+        buf0.count(b"\n", 0, prefix_end),
+        buf0.count(b"\n", 0, suffix_begin0),
+        buf1.count(b"\n", 0, suffix_begin1),
+    )
+
+
+def _discard_confusing_lines(equivs0: List[int], equivs1: List[int]) -> List[bytearray]:
+    """
+    Returns which lines of each file are discarded from the comparison:
+    lines matching no line of the other file, and in runs of these,
+    lines matching many lines of the other file
+    """
+    discarded = []
+    for equivs, other_equivs in ((equivs0, equivs1), (equivs1, equivs0)):
+        other_counts: Dict[int, int] = dict()
+        for equiv in other_equivs:
+            other_counts[equiv] = other_counts.get(equiv, 0) + 1
+        many = 5
+        tem = len(equivs) // 64
+        while True:
+            tem >>= 2
+            if tem <= 0:
+                break
+            many *= 2
+        # 1 to discard, 2 to provisionally discard
+        discards = bytearray(len(equivs))
+        for i, equiv in enumerate(equivs):
+            n_matches = other_counts.get(equiv, 0)
+            if n_matches == 0:
+                discards[i] = 1
+            elif n_matches > many:
+                discards[i] = 2
+        discarded.append(discards)
+
+    # only discard the provisional lines in the middle of runs of discarded lines
+    for discards in discarded:
+        end = len(discards)
+        i = 0
+        while i < end:
+            if discards[i] == 2:
+                discards[i] = 0
+            elif discards[i] != 0:
+                provisional = 0
+                j = i
+                while j < end and discards[j] != 0:
+                    if discards[j] == 2:
+                        provisional += 1
+                    j += 1
+                while j > i and discards[j - 1] == 2:
+                    j -= 1
+                    discards[j] = 0
+                    provisional -= 1
+                length = j - i
+
+                if provisional * 4 > length:
+                    while j > i:
+                        j -= 1
+                        if discards[j] == 2:
+                            discards[j] = 0
+                else:
+                    minimum = 1
+                    tem = length >> 2
+                    while True:
+                        tem >>= 2
+                        if tem <= 0:
+                            break
+                        minimum <<= 1
+                    minimum += 1
+
+                    # cancel subruns of `minimum` or more provisional lines
+                    j = 0
+                    consec = 0
+                    while j < length:
+                        if discards[i + j] != 2:
+                            consec = 0
+                        else:
+                            consec += 1
+                            if consec == minimum:
+                                # back to the start of the subrun
+                                j -= consec
+                            elif consec > minimum:
+                                discards[i + j] = 0
+                        j += 1
+
+                    # cancel provisional lines at the start of the run,
+                    # until 3 lines in a row are discarded or 8 lines in
+                    consec = 0
+                    for j in range(length):
+                        if j >= 8 and discards[i + j] == 1:
+                            break
+                        if discards[i + j] == 2:
+                            consec = 0
+                            discards[i + j] = 0
+                        elif discards[i + j] == 0:
+                            consec = 0
+                        else:
+                            consec += 1
+                        if consec == 3:
+                            break
+
+                    i += length - 1
+
+                    # same from the end
+                    consec = 0
+                    for j in range(length):
+                        if j >= 8 and discards[i - j] == 1:
+                            break
+                        if discards[i - j] == 2:
+                            consec = 0
+                            discards[i - j] = 0
+                        elif discards[i - j] == 0:
+                            consec = 0
+                        else:
+                            consec += 1
+                        if consec == 3:
+                            break
+            i += 1
+
+    return discarded
+
+
+def _compare_sequences(
+    xvec: List[int], yvec: List[int], x_changed: bytearray, y_changed: bytearray
+):
+    """
+    Marks the elements of `xvec` and `yvec` that are not part of a longest common
+    subsequence as changed (Myers' algorithm, splitting at the middle snake)
+    """
+    n_diagonals = len(xvec) + len(yvec) + 3
+    # indexed by diagonal (x - y), offset to be positive
+    offset = len(yvec) + 1
+    fdiag = [0] * n_diagonals
+    bdiag = [0] * n_diagonals
+    too_expensive = 1
+    diags = n_diagonals
+    while diags != 0:
+        too_expensive <<= 1
+        diags >>= 2
+    too_expensive = max(4096, too_expensive)
+    infinity = len(xvec) + len(yvec) + 1
+
+    def diag(
+        xoff: int, xlim: int, yoff: int, ylim: int, find_minimal: bool
+    ) -> Tuple[int, int, bool, bool]:
+        fd = fdiag
+        bd = bdiag
+        dmin = xoff - ylim
+        dmax = xlim - yoff
+        fmid = xoff - yoff
+        bmid = xlim - ylim
+        fmin = fmax = fmid
+        bmin = bmax = bmid
+        odd = (fmid - bmid) & 1
+        fd[offset + fmid] = xoff
+        bd[offset + bmid] = xlim
+        c = 1
+        while True:
+            if fmin > dmin:
+                fmin -= 1
+                fd[offset + fmin - 1] = -1
+            else:
+                fmin += 1
+            if fmax < dmax:
+                fmax += 1
+                fd[offset + fmax + 1] = -1
+            else:
+                fmax -= 1
+            for d in range(fmax, fmin - 1, -2):
+                tlo = fd[offset + d - 1]
+                thi = fd[offset + d + 1]
+                x = thi if tlo < thi else tlo + 1
+                y = x - d
+                while x < xlim and y < ylim and xvec[x] == yvec[y]:
+                    x += 1
+                    y += 1
+                fd[offset + d] = x
+                if odd and bmin <= d <= bmax and bd[offset + d] <= x:
+                    return x, y, True, True
+
+            if bmin > dmin:
+                bmin -= 1
+                bd[offset + bmin - 1] = infinity
+            else:
+                bmin += 1
+            if bmax < dmax:
+                bmax += 1
+                bd[offset + bmax + 1] = infinity
+            else:
+                bmax -= 1
+            for d in range(bmax, bmin - 1, -2):
+                tlo = bd[offset + d - 1]
+                thi = bd[offset + d + 1]
+                x = tlo if tlo < thi else thi - 1
+                y = x - d
+                while xoff < x and yoff < y and xvec[x - 1] == yvec[y - 1]:
+                    x -= 1
+                    y -= 1
+                bd[offset + d] = x
+                if not odd and fmin <= d <= fmax and x <= fd[offset + d]:
+                    return x, y, True, True
+
+            if not find_minimal and c >= too_expensive:
+                # give up, and split halfway between the best results so far
+                fxybest = -1
+                fxbest = 0
+                for d in range(fmax, fmin - 1, -2):
+                    x = min(fd[offset + d], xlim)
+                    y = x - d
+                    if ylim < y:
+                        x = ylim + d
+                        y = ylim
+                    if fxybest < x + y:
+                        fxybest = x + y
+                        fxbest = x
+                bxybest = infinity * 2
+                bxbest = 0
+                for d in range(bmax, bmin - 1, -2):
+                    x = max(xoff, bd[offset + d])
+                    y = x - d
+                    if y < yoff:
+                        x = yoff + d
+                        y = yoff
+                    if x + y < bxybest:
+                        bxybest = x + y
+                        bxbest = x
+                if (xlim + ylim) - bxybest < fxybest - (xoff + yoff):
+                    return fxbest, fxybest - fxbest, True, False
+                return bxbest, bxybest - bxbest, False, True
+            c += 1
+
+    def compareseq(xoff: int, xlim: int, yoff: int, ylim: int, find_minimal: bool):
+        while xoff < xlim and yoff < ylim and xvec[xoff] == yvec[yoff]:
+            xoff += 1
+            yoff += 1
+        while xoff < xlim and yoff < ylim and xvec[xlim - 1] == yvec[ylim - 1]:
+            xlim -= 1
+            ylim -= 1
+        if xoff == xlim:
+            for y in range(yoff, ylim):
+                y_changed[y] = 1
+        elif yoff == ylim:
+            for x in range(xoff, xlim):
+                x_changed[x] = 1
+        else:
+            xmid, ymid, lo_minimal, hi_minimal = diag(
+                xoff, xlim, yoff, ylim, find_minimal
+            )
+            compareseq(xoff, xmid, yoff, ymid, lo_minimal)
+            compareseq(xmid, xlim, ymid, ylim, hi_minimal)
+
+    compareseq(0, len(xvec), 0, len(yvec), False)
+
+
+def _shift_boundaries(equivs: List[int], changed: bytearray, other_changed: bytearray):
+    """
+    Moves the runs of changed lines of a file (in `changed`, which like
+    `other_changed` ends with two unchanged elements, so that index -1 is one too)
+    to merge them with other runs, else as far down as possible,
+    else back to where they correspond to a run of changes in the other file
+    """
+    i = 0
+    j = 0
+    i_end = len(equivs)
+    while True:
+        # find the start of the next run, and the corresponding line in the other file
+        while i < i_end and not changed[i]:
+            while other_changed[j]:
+                j += 1
+            j += 1
+            i += 1
+        if i == i_end:
+            break
+        start = i
+
+        # find the end of the run
+        i += 1
+        while changed[i]:
+            i += 1
+        while other_changed[j]:
+            j += 1
+
+        while True:
+            runlength = i - start
+
+            # move the run up while the previous line matches the last changed one
+            # (merging with previous runs)
+            while start and equivs[start - 1] == equivs[i - 1]:
+                start -= 1
+                changed[start] = 1
+                i -= 1
+                changed[i] = 0
+                while changed[start - 1]:
+                    start -= 1
+                j -= 1
+                while other_changed[j]:
+                    j -= 1
+
+            # the end of the run, at the last point where it corresponds
+            # to a run in the other file (i_end if none)
+            corresponding = i if other_changed[j - 1] else i_end
+
+            # move the run down while the first changed line matches the next one
+            # (merging with next runs)
+            while i != i_end and equivs[start] == equivs[i]:
+                changed[start] = 0
+                start += 1
+                changed[i] = 1
+                i += 1
+                while changed[i]:
+                    i += 1
+                j += 1
+                while other_changed[j]:
+                    j += 1
+                    corresponding = i
+
+            if runlength == i - start:
+                break
+
+        # move the run back to a corresponding run in the other file, if any
+        while corresponding < i:
+            start -= 1
+            changed[start] = 1
+            i -= 1
+            changed[i] = 0
+            j -= 1
+            while other_changed[j]:
+                j -= 1
+
+
+def diff_lines(
+    old_data: bytes, new_data: bytes, horizon: int = 0
+) -> List[Tuple[int, int, int, int]]:
+    """
+    Returns the differences between the lines of `old_data` and `new_data`
+    like GNU diff, as (old line, new line, deleted lines, inserted lines),
+    from line 0
+
+    `horizon` is the amount of identical lines at the start and at the end kept
+    for the comparison (GNU diff uses the amount of context lines)
+    """
+    old_lines = split_lines(old_data)
+    new_lines = split_lines(new_data)
+    start, old_end, new_end = _find_identical_ends(old_data, new_data, horizon)
+
+    equivs_ids: Dict[bytes, int] = dict()
+    equivs = [
+        [equivs_ids.setdefault(line, len(equivs_ids) + 1) for line in lines]
+        for lines in (old_lines[start:old_end], new_lines[start:new_end])
+    ]
+    # with two more elements, unchanged, so that index -1 is unchanged too
+    changed = [bytearray(len(file_equivs) + 2) for file_equivs in equivs]
+
+    discarded = _discard_confusing_lines(*equivs)
+    undiscarded = []
+    realindexes = []
+    for file_equivs, file_discards, file_changed in zip(equivs, discarded, changed):
+        file_undiscarded = []
+        file_realindexes = []
+        for i, (equiv, discard) in enumerate(zip(file_equivs, file_discards)):
+            if discard == 0:
+                file_undiscarded.append(equiv)
+                file_realindexes.append(i)
+            else:
+                file_changed[i] = 1
+        undiscarded.append(file_undiscarded)
+        realindexes.append(file_realindexes)
+
+    undiscarded_changed = [
+        bytearray(len(file_undiscarded)) for file_undiscarded in undiscarded
+    ]
+    _compare_sequences(*undiscarded, *undiscarded_changed)
+    for file_undiscarded_changed, file_realindexes, file_changed in zip(
+        undiscarded_changed, realindexes, changed
+    ):
+        for i, is_changed in enumerate(file_undiscarded_changed):
+            if is_changed:
+                file_changed[file_realindexes[i]] = 1
+
+    _shift_boundaries(equivs[0], changed[0], changed[1])
+    _shift_boundaries(equivs[1], changed[1], changed[0])
+
+    differences = []
+    i0 = i1 = 0
+    n0 = len(equivs[0])
+    n1 = len(equivs[1])
+    while i0 < n0 or i1 < n1:
+        if changed[0][i0] or changed[1][i1]:
+            start0 = i0
+            start1 = i1
+            while changed[0][i0]:
+                i0 += 1
+            while changed[1][i1]:
+                i1 += 1
+            differences.append(
+                (start + start0, start + start1, i0 - start0, i1 - start1)
+            )
+        i0 += 1
+        i1 += 1
+    return differences
+
+
+def _format_range(start: int, stop: int) -> str:
+    # like diff
+    length = stop - start
+    if length == 1:
+        return f"{start + 1}"
+    if length == 0:
+        return f"{start},0"
+    return f"{start + 1},{length}"
+
+
+def _format_line(tag: bytes, line: bytes) -> bytes:
+    if line.endswith(b"\n"):
+        return tag + line
+    else:
+        return tag + line + b"\n" + NO_NEWLINE_AT_END_OF_FILE
+
+
+def diff_files(old_path: Path, new_path: Path, context: int = 3) -> bytes:
+    """
+    Returns the unified diff between the files at `old_path` and `new_path`,
+    like `diff -Nau` (missing files are treated as empty), see `diff_lines`
+    """
+    old_data = old_path.read_bytes() if old_path.exists() else b""
+    new_data = new_path.read_bytes() if new_path.exists() else b""
+    differences = diff_lines(old_data, new_data, horizon=context)
+    if not differences:
+        return b""
+    old_lines = split_lines(old_data)
+    new_lines = split_lines(new_data)
+    out = [
+        f"--- {old_path.as_posix()}\t{_format_timestamp(old_path)}\n".encode(),
+        f"+++ {new_path.as_posix()}\t{_format_timestamp(new_path)}\n".encode(),
+    ]
+
+    # group the differences less than 2 * context + 1 lines apart into hunks
+    hunks = [[differences[0]]]
+    for difference in differences[1:]:
+        old_line, _, deleted, _ = hunks[-1][-1]
+        if difference[0] - (old_line + deleted) < 2 * context + 1:
+            hunks[-1].append(difference)
+        else:
+            hunks.append([difference])
+
+    for hunk in hunks:
+        first_old_line, first_new_line, _, _ = hunk[0]
+        old_line, new_line, deleted, inserted = hunk[-1]
+        before = min(context, first_old_line)
+        after = min(context, len(old_lines) - (old_line + deleted))
+        old_start = first_old_line - before
+        new_start = first_new_line - before
+        old_range = _format_range(old_start, old_line + deleted + after)
+        new_range = _format_range(new_start, new_line + inserted + after)
+        out.append(f"@@ -{old_range} +{new_range} @@\n".encode())
+        i = old_start
+        for old_line, new_line, deleted, inserted in hunk:
+            out.extend(_format_line(b" ", line) for line in old_lines[i:old_line])
+            out.extend(
+                _format_line(b"-", line)
+                for line in old_lines[old_line : old_line + deleted]
+            )
+            out.extend(
+                _format_line(b"+", line)
+                for line in new_lines[new_line : new_line + inserted]
+            )
+            i = old_line + deleted
+        out.extend(_format_line(b" ", line) for line in old_lines[i : i + after])
+    return b"".join(out)
+
+
+def diff_trees(
+    old_dir: Path,
+    new_dir: Path,
+    rel_paths: Optional[Iterable[str]] = None,
+    context: int = 3,
+    trust_mtimes: bool = False,
+) -> bytes:
+    """
+    Returns the unified diff between the directories `old_dir` and `new_dir`,
+    like `diff -Naur`
+
+    Only the files at `rel_paths` are diffed, by default the ones found by
+    `find_changed_files` (with `trust_mtimes`)
+    """
+    if rel_paths is None:
+        rel_paths = find_changed_files(old_dir, new_dir, trust_mtimes)
+    out = []
+    for rel_path in rel_paths:
+        old_path = old_dir / rel_path
+        new_path = new_dir / rel_path
+        file_diff = diff_files(old_path, new_path, context)
+        if file_diff:
+            out.append(
+                f"diff -Naur {old_path.as_posix()} {new_path.as_posix()}\n".encode()
+            )
+            out.append(file_diff)
+    return b"".join(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Apply or generate unified diffs, like patch -p0 and diff -Naur"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    apply_parser = subparsers.add_parser("apply", help="Apply a patch file")
+    apply_parser.add_argument("patch_path", type=Path)
+    apply_parser.add_argument("-p", "--strip", type=int, default=0)
+    apply_parser.add_argument(
+        "--json", action="store_true", help="Print conflicts as json"
+    )
+    diff_parser = subparsers.add_parser(
+        "diff", help="Print the diff between two directories"
+    )
+    diff_parser.add_argument("old_dir", type=Path)
+    diff_parser.add_argument("new_dir", type=Path)
+    diff_parser.add_argument(
+        "--trust-mtimes",
+        action="store_true",
+        help=(
+            "Assume files with the same size and modification time are the same,"
+            " only if new_dir is a copy of old_dir preserving modification times"
+        ),
+    )
+    args = parser.parse_args()
+
+    if args.command == "apply":
+        patched_paths, conflicts = apply_patch(
+            args.patch_path.read_bytes(), strip=args.strip
+        )
+        if args.json:
+            json.dump(
+                [conflict.to_dict() for conflict in conflicts], sys.stdout, indent=1
+            )
+            print()
+        else:
+            for path in patched_paths:
+                print("patched", path.as_posix())
+            for conflict in conflicts:
+                print(conflict)
+        if conflicts:
+            sys.exit(1)
+    else:
+        sys.stdout.buffer.write(
+            diff_trees(args.old_dir, args.new_dir, trust_mtimes=args.trust_mtimes)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,113 +3,473 @@
 # SPDX-License-Identifier: CC0-1.0 OR Unlicense
 
 import argparse
-import subprocess
-import os.path
+import concurrent.futures
+import io
+import multiprocessing
+from pathlib import Path
+import shutil
+import sys
+import threading
+import time
+import traceback
 
-from typing import List
+from typing import Callable, Dict, List, Optional, Sequence, TextIO, Tuple
 
+import decomp_getter
+import gen_changelog
+import headerbundle
+import headerdeps
+import profiling
+import unidiff
 
-def confirm_call(cmd_args: List[str], stdin=None, stdout=None, check=True):
-    print("Command:")
-    if any(any(c.isspace() for c in arg) for arg in cmd_args):
-        print(cmd_args)
-    else:
-        print(" ".join(cmd_args))
-    input("Press enter to run")
-    kwargs = dict()
-    if stdin is not None:
-        kwargs["stdin"] = stdin
-    if stdout is not None:
-        kwargs["stdout"] = stdout
-    return subprocess.run(cmd_args, check=check, **kwargs)
-
-
-parser = argparse.ArgumentParser()
-parser.add_argument("oot_decomp_repo_path", help="Path to oot decomp")
-parser.add_argument("oot_version", help="OoT version (oot_mq_debug)")
-parser.add_argument("z64hdr_repo_path", help="Path to z64hdr repo")
-args = parser.parse_args()
-
-syms_oot_version_path = f"syms_{args.oot_version}"
-z64hdr_include_path = args.z64hdr_repo_path + os.path.sep + "include"
-z64hdr_oot_version_path = args.z64hdr_repo_path + os.path.sep + args.oot_version
-
-print("--- Get headers and symbols from decomp")
-confirm_call(
-    [
-        "./decomp_getter.py",
-        args.oot_decomp_repo_path,
-        syms_oot_version_path,
-        "include-base",
-    ]
+
+# how steps are run
+PIPELINE_POLICIES = (
+    # ask before running each step (and run them one at a time, in order)
+    "ask",
+    # run all steps without asking, concurrently when they don't depend on each other
+    "yes",
+    # only print the steps that would be run
+    "dry-run",
 )
 
-print("--- Copy include-base to include")
-confirm_call(["rm", "-r", "include"])
-confirm_call(["cp", "-r", "include-base", "include"])
-
-print("--- Patch include (make sure to fix conflicts if any)")
-with open("include-patch.txt") as f:
-    patch_cp = confirm_call(["patch", "-p0"], stdin=f, check=False)
-if patch_cp.returncode == 0:
-    print("No conflicts")
-elif patch_cp.returncode == 1:
-    print("THERE ARE CONFLICTS!")
-    print("Fix the conflicts")
-    print("Also delete the .orig and .rej files")
-    print("then generate a new patch to update it for the future")
-else:
-    print("patch failed unexpectedly (not due to conflicts)")
-
-print("Fix any conflict, or make changes if needed, in include/")
-
-if (
-    input(
-        "Generate new patch file? "
-        "(for example if there was conflicts, or if more changes were made) "
-        "('yes' for yes): "
-    )
-    == "yes"
-):
-    with open("include-patch.txt", "w") as f:
-        p = confirm_call(
-            ["diff", "-Naur", "include-base", "include"], stdout=f, check=False
+
+def get_steps_mp_context() -> multiprocessing.context.BaseContext:
+    """
+    Returns the context to start the processes of the steps' process pools with
+
+    Steps run in threads, and forking (the default on linux) while other threads
+    run can copy locks they hold into the child processes, which then deadlock.
+    The processes are started from a server process instead, or from scratch.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+class Step:
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        run: Callable[[], None],
+        deps: Sequence[str] = (),
+        question: Optional[str] = None,
+        default_answer: bool = True,
+    ):
+        """
+        A step of the pipeline, named `name`, which runs `run`
+        after all the steps named in `deps` are done.
+
+        If `question` is set, the step is optional: it is asked as a yes/no question
+        with the "ask" policy, otherwise `default_answer` is used.
+        """
+        self.name = name
+        self.description = description
+        self.run = run
+        self.deps = deps
+        self.question = question
+        self.default_answer = default_answer
+
+
+class StepOutput(io.TextIOBase):
+    """
+    Stands for sys.stdout or sys.stderr while steps run concurrently,
+    so that their output isn't mixed up: the lines written from a step's thread
+    are prefixed with the step's name (see `set_step`)
+
+    Other threads' output is written as is.
+    """
+
+    def __init__(self, out: TextIO):
+        self.out = out
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def set_step(self, step_name: Optional[str]):
+        """
+        Prefixes the lines written from the current thread with `step_name`,
+        or stops prefixing them if None (writing the unfinished line if any)
+        """
+        self.flush_line()
+        self.local.prefix = f"[{step_name}] " if step_name is not None else None
+        self.local.line = ""
+
+    def flush_line(self):
+        line = getattr(self.local, "line", "")
+        if line:
+            self.local.line = ""
+            self.write(line + "\n")
+
+    def write(self, s: str) -> int:
+        prefix = getattr(self.local, "prefix", None)
+        if prefix is None:
+            with self.lock:
+                self.out.write(s)
+            return len(s)
+        *lines, self.local.line = (self.local.line + s).split("\n")
+        if lines:
+            with self.lock:
+                self.out.write("".join(f"{prefix}{line}\n" for line in lines))
+        return len(s)
+
+    def flush(self):
+        with self.lock:
+            self.out.flush()
+
+
+def run_step(step: Step, policy: str) -> Tuple[str, Optional[float]]:
+    """
+    Runs `step` according to `policy`
+
+    Returns the status of the step ("done", "skipped", "failed" or "dry-run")
+    and how long running it took (not counting prompts), if it was run
+    """
+    print(f"--- {step.name}: {step.description}")
+    if policy == "dry-run":
+        return "dry-run", None
+    if step.question is not None:
+        if policy == "ask":
+            answer = input(f"{step.question} ('yes' for yes): ") == "yes"
+        else:
+            answer = step.default_answer
+        if not answer:
+            return "skipped", None
+    elif policy == "ask":
+        input("Press enter to run")
+    start = time.perf_counter()
+    try:
+        with profiling.stage(step.name):
+            step.run()
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+        print(f"--- {step.name} failed")
+        return "failed", time.perf_counter() - start
+    return "done", time.perf_counter() - start
+
+
+def run_pipeline(steps: List[Step], policy: str):
+    """
+    Runs the `steps` according to `policy` and prints how long each step took
+
+    Steps whose dependencies failed are not run.
+
+    Steps running concurrently have their output lines prefixed with their name,
+    see `StepOutput`
+    """
+    assert policy in PIPELINE_POLICIES, policy
+
+    steps_by_name = {step.name: step for step in steps}
+    for step in steps:
+        for dep in step.deps:
+            if dep not in steps_by_name:
+                raise Exception("Unknown dependency", dep, "of step", step.name)
+
+    statuses: Dict[str, str] = dict()
+    durations: Dict[str, float] = dict()
+
+    def timed_run_step(step: Step):
+        status, duration = run_step(step, policy)
+        if duration is not None:
+            durations[step.name] = duration
+        return status
+
+    def get_deps_status(step: Step) -> Optional[str]:
+        """
+        Returns None if some dependencies haven't finished yet,
+        "not run" if some failed or weren't run, "ok" otherwise
+        """
+        deps_statuses = [statuses.get(dep) for dep in step.deps]
+        if any(dep_status is None for dep_status in deps_statuses):
+            return None
+        if any(dep_status in {"failed", "not run"} for dep_status in deps_statuses):
+            return "not run"
+        return "ok"
+
+    if policy == "ask":
+        # one step at a time, in order
+        for step in steps:
+            deps_status = get_deps_status(step)
+            if deps_status is None:
+                raise Exception("Steps are not in dependency order", step.name)
+            if deps_status == "ok":
+                statuses[step.name] = timed_run_step(step)
+            else:
+                statuses[step.name] = "not run"
+    else:
+        # write the output of each step's thread with the step's name
+        step_output = StepOutput(sys.stdout)
+        step_errors = StepOutput(sys.stderr)
+
+        def prefixed_run_step(step: Step):
+            step_output.set_step(step.name)
+            step_errors.set_step(step.name)
+            try:
+                return timed_run_step(step)
+            finally:
+                step_output.set_step(None)
+                step_errors.set_step(None)
+
+        pending_steps = list(steps)
+        running_steps: Dict[concurrent.futures.Future, Step] = dict()
+        sys.stdout, sys.stderr = step_output, step_errors
+        try:
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                while pending_steps or running_steps:
+                    for step in pending_steps.copy():
+                        deps_status = get_deps_status(step)
+                        if deps_status is None:
+                            continue
+                        pending_steps.remove(step)
+                        if deps_status == "ok":
+                            running_steps[
+                                executor.submit(prefixed_run_step, step)
+                            ] = step
+                        else:
+                            statuses[step.name] = "not run"
+                    if not running_steps:
+                        if pending_steps:
+                            raise Exception(
+                                "Dependency cycle between steps",
+                                [step.name for step in pending_steps],
+                            )
+                        break
+                    done, _ = concurrent.futures.wait(
+                        running_steps, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        statuses[running_steps.pop(future).name] = future.result()
+        finally:
+            sys.stdout, sys.stderr = step_output.out, step_errors.out
+
+    print("--- Summary")
+    for step in steps:
+        duration = durations.get(step.name)
+        print(
+            f"{step.name:<20} {statuses[step.name]:<8}",
+            f"{duration:8.3f} s" if duration is not None else "",
         )
-    if p.returncode == 0:
-        print("include-base and include are the same!")
-    elif p.returncode == 2:
-        print("diff failed")
 
-print("--- Changelog generation")
 
-if input("Generate changelog? ('yes' for yes): ") == "yes":
-    confirm_call(["rm", "-r", "./changelog/"])
-    confirm_call(
-        [
-            "./gen_changelog.py",
-            z64hdr_oot_version_path + os.path.sep + "syms.json",
-            syms_oot_version_path + os.path.sep + "syms.json",
-            "./changelog/",
-        ]
-    )
+def replace_dir(src: Path, dst: Path, ignore=None):
+    """
+    Replaces the directory `dst` with a copy of `src`
+    """
+    if dst.exists():
+        shutil.rmtree(dst)
+    shutil.copytree(src, dst, ignore=ignore)
 
-print("--- Update z64hdr repo")
 
-confirm_call(["rm", "-r", z64hdr_include_path])
-confirm_call(["cp", "-r", "include", z64hdr_include_path])
+def copy_include_overlay(base_path: Path, overlay_path: Path, dst: Path):
+    """
+    Replaces the directory `dst` with the headers of `base_path`,
+    overlaid with the files of `overlay_path` (see `unidiff.apply_patch`)
 
-print(
-    "Copy syms.ld, z64hdr.h and z64hdr.ld from z64hdr repo to builder's syms repo "
-    "(all other files will be ignored and deleted)"
-)
-for file in ("syms.ld", "z64hdr.h", "z64hdr.ld"):
-    confirm_call(
+    Each file is copied once, from either `base_path` or `overlay_path`
+    """
+    if dst.exists():
+        shutil.rmtree(dst)
+    overlay_files, deleted_files = unidiff.find_overlay_files(overlay_path)
+    files_not_from_base = set(overlay_files) | set(deleted_files)
+    decomp_getter.copy_header_files(
+        base_path,
+        dst,
         [
-            "cp",
-            z64hdr_oot_version_path + os.path.sep + file,
-            syms_oot_version_path + os.path.sep + file,
-        ]
+            header
+            for header in decomp_getter.find_headers(base_path)
+            if header not in files_not_from_base
+        ],
     )
+    decomp_getter.copy_header_files(overlay_path, dst, overlay_files)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("oot_decomp_repo_path", help="Path to oot decomp")
+    parser.add_argument("oot_version", help="OoT version (oot_mq_debug)")
+    parser.add_argument("z64hdr_repo_path", help="Path to z64hdr repo")
+    policy_group = parser.add_mutually_exclusive_group()
+    policy_group.add_argument(
+        "--yes",
+        dest="policy",
+        action="store_const",
+        const="yes",
+        help=(
+            "Run all steps without asking, concurrently when possible "
+            "(generates the changelog, doesn't generate a new patch file)"
+        ),
+    )
+    policy_group.add_argument(
+        "--dry-run",
+        dest="policy",
+        action="store_const",
+        const="dry-run",
+        help="Only print the steps",
+    )
+    parser.set_defaults(policy="ask")
+    parser.add_argument(
+        "--reachable-headers-only",
+        action="store_true",
+        help=(
+            "Only get the headers reachable through #include from"
+            " the version's z64hdr.h in the z64hdr repo"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        metavar="REPORT_PATH",
+        help="Write a json report of how long each stage took, memory and counters",
+    )
+    args = parser.parse_args()
+
+    syms_oot_version_path = Path(f"syms_{args.oot_version}")
+    z64hdr_include_path = Path(args.z64hdr_repo_path) / "include"
+    z64hdr_oot_version_path = Path(args.z64hdr_repo_path) / args.oot_version
+    mp_context = get_steps_mp_context()
+
+    def decomp_getter_step():
+        decomp_getter.update_z64hdr(
+            Path(args.oot_decomp_repo_path),
+            syms_oot_version_path,
+            Path("include-base"),
+            incremental=True,
+            ask_before_delete=args.policy == "ask",
+            headers_roots=(
+                [z64hdr_oot_version_path / "z64hdr.h"]
+                if args.reachable_headers_only
+                else None
+            ),
+            mp_context=mp_context,
+        )
+
+    def include_step():
+        decomp_getter.make_empty_dir(Path("include"), ask_before_delete=False)
+
+    def patch_step():
+        patched_paths, conflicts = unidiff.apply_patch(
+            Path("include-patch.txt").read_bytes(),
+            Path("include"),
+            strip=1,
+            base_root=Path("include-base"),
+        )
+        for path in patched_paths:
+            print("Patched", path)
+        profiling.count("files_patched", len(patched_paths))
+        profiling.count("patch_conflicts", len(conflicts))
+        if not conflicts:
+            print("No conflicts")
+        else:
+            for conflict in conflicts:
+                print(conflict)
+            print("THERE ARE CONFLICTS!")
+            print("Apply the hunks above by hand, in the files they failed in")
+            print("then generate a new patch to update it for the future")
+            if args.policy != "ask":
+                raise Exception("Conflicts when patching include", len(conflicts))
+
+    def regenerate_patch_step():
+        # include only holds the files that differ from include-base
+        overlay_files, deleted_files = unidiff.find_overlay_files(Path("include"))
+        profiling.count("files_diffed", len(overlay_files) + len(deleted_files))
+        patch_data = unidiff.diff_trees(
+            Path("include-base"),
+            Path("include"),
+            # same order as diff -r
+            sorted(overlay_files + deleted_files, key=lambda path: path.split("/")),
+        )
+        if not patch_data:
+            print("include-base and include are the same!")
+        Path("include-patch.txt").write_bytes(patch_data)
+
+    def changelog_step():
+        changelog_path = Path("./changelog/")
+        if changelog_path.exists():
+            shutil.rmtree(changelog_path)
+        gen_changelog.gen_changelog(
+            z64hdr_oot_version_path / "syms.json",
+            syms_oot_version_path / "syms.json",
+            changelog_path,
+            mp_context=mp_context,
+        )
+
+    def z64hdr_include_step():
+        copy_include_overlay(Path("include-base"), Path("include"), z64hdr_include_path)
+
+    def z64hdr_syms_step():
+        for file in ("syms.ld", "z64hdr.h", "z64hdr.ld"):
+            shutil.copy(z64hdr_oot_version_path / file, syms_oot_version_path / file)
+        replace_dir(
+            syms_oot_version_path,
+            z64hdr_oot_version_path,
+            # decomp_getter's build caches, which hold local paths
+            ignore=shutil.ignore_patterns(
+                decomp_getter.SYMS_MANIFEST_FILE_NAME,
+                headerdeps.HEADERS_DEPS_FILE_NAME,
+                headerbundle.HEADERS_BUNDLE_CACHE_FILE_NAME,
+            ),
+        )
+
+    steps = [
+        Step(
+            "decomp_getter",
+            "Get headers and symbols from decomp",
+            decomp_getter_step,
+        ),
+        Step(
+            "include",
+            "Empty include, to hold the files patched over include-base",
+            include_step,
+            deps=("decomp_getter",),
+        ),
+        Step(
+            "patch",
+            "Patch include (make sure to fix conflicts if any)",
+            patch_step,
+            deps=("include",),
+        ),
+        Step(
+            "regenerate_patch",
+            "Generate new patch file from include-base and include",
+            regenerate_patch_step,
+            deps=("patch",),
+            question=(
+                "Fix any conflict, or make changes if needed, in include/\n"
+                "(to change a file not in include/, copy it from include-base/ first)\n"
+                "Generate new patch file? "
+                "(for example if there was conflicts, or if more changes were made)"
+            ),
+            default_answer=False,
+        ),
+        Step(
+            "changelog",
+            "Changelog generation",
+            changelog_step,
+            deps=("decomp_getter",),
+            question="Generate changelog?",
+        ),
+        Step(
+            "z64hdr_include",
+            "Update z64hdr repo include",
+            z64hdr_include_step,
+            deps=("regenerate_patch",),
+        ),
+        Step(
+            "z64hdr_syms",
+            (
+                "Copy syms.ld, z64hdr.h and z64hdr.ld from z64hdr repo "
+                "to builder's syms folder, then replace the z64hdr repo's syms folder "
+                "(all other files will be ignored and deleted)"
+            ),
+            z64hdr_syms_step,
+            # the changelog needs the old syms.json from the z64hdr repo
+            deps=("decomp_getter", "changelog"),
+        ),
+    ]
+
+    with profiling.profile("upgrade_assist", args.profile):
+        run_pipeline(steps, args.policy)
+
 
-confirm_call(["rm", "-r", z64hdr_oot_version_path])
-confirm_call(["cp", "-r", syms_oot_version_path, z64hdr_oot_version_path])
+if __name__ == "__main__":
+    main()